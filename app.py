@@ -1,12 +1,42 @@
 # app.py
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template
+from werkzeug.http import generate_etag, is_resource_modified
+import datetime
+import gzip
 import json
 import os
-import boto3
-import json
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import providers
+from batch import BatchRunner
+from compression import DEFAULT_COMPRESSION_SETTINGS, compress_response
+from providers import configure_providers, get_model_id, set_model_ids, warm_in_background
+from context_window import estimate_message_tokens, fit_context, get_context_budget
+from jobs import Job, JobQueue
+from model_catalog import ModelCatalog
+from metrics import LATENCY_BUCKETS, format_samples, registry
+from rate_limiter import limiter_stats
+from routing import Router
+from usage import TokenBudgets
+from conversation_store import ConversationLocks, open_store
 
 app = Flask(__name__)
 
+# Duration of each startup step in milliseconds, served by /startup
+startup_phases = {}
+_phase_start = time.perf_counter()
+
+def startup_phase(name):
+    """Record the time spent since the previous startup step"""
+    global _phase_start
+    now = time.perf_counter()
+    startup_phases[name] = round((now - _phase_start) * 1000, 2)
+    _phase_start = now
+
 # Load model configuration
 MODEL_CONFIG_FILE = 'model_config.json'
 if os.path.exists(MODEL_CONFIG_FILE):
@@ -17,69 +47,247 @@ else:
     model_config = {
         "available_models": ["deepseek", "claude", "mistral"],
         "default_model": "deepseek",
-        "region": "us-east-1"
+        "region": "us-east-1",
+        "model_ids": {
+            "deepseek": "us.deepseek.r1-v1:0",
+            "claude": "anthropic.claude-3-haiku-20240307-v1:0",
+            "mistral": "mistral.mistral-large-2402-v1:0"
+        }
     }
     with open(MODEL_CONFIG_FILE, 'w') as f:
         json.dump(model_config, f)
+startup_phase("config")
 
-# Load or initialize conversations
-CONVERSATIONS_FILE = 'conversations.json'
-if os.path.exists(CONVERSATIONS_FILE):
-    with open(CONVERSATIONS_FILE, 'r') as f:
-        conversations = json.load(f)
-else:
-    conversations = {
-        "metadata": {},  # Store conversation titles and timestamps
-        "data": {}       # Store actual conversation messages
+# gzip/brotli encoding of the buffered responses ("compression" section)
+compression_settings = {**DEFAULT_COMPRESSION_SETTINGS, **model_config.get("compression", {})}
+
+# Load the cached model catalog; it is only refreshed in the background
+catalog_settings = model_config.get("catalog", {})
+catalog = ModelCatalog(
+    catalog_settings.get("cache_path", "model_catalog.json"),
+    model_config["region"],
+    catalog_settings.get("ttl", 86400)
+)
+catalog.load()
+startup_phase("catalog")
+
+def resolve_model_ids(catalog):
+    """Resolve the configured model ids through the catalog"""
+    return {
+        name: catalog.resolve_model_id(model_id)
+        for name, model_id in model_config.get("model_ids", {}).items()
     }
 
-# Save conversations
-def save_conversations():
-    with open(CONVERSATIONS_FILE, 'w') as f:
-        json.dump(conversations, f)
+# Provider modules (and boto3) are imported on first use. Warming them in
+# the background builds the clients before the first /send without making
+# startup wait for it.
+configure_providers({**model_config, "model_ids": resolve_model_ids(catalog)})
+if model_config.get("warm_on_startup", True):
+    warm_in_background(model_config["available_models"], model_config["region"])
+catalog.on_refresh(lambda refreshed: set_model_ids(resolve_model_ids(refreshed)))
+if catalog_settings.get("auto_refresh", True):
+    catalog.start_auto_refresh()
+# Spreads the calls of each model over its endpoints ("routing" section)
+router = Router(model_config.get("routing", {}), model_config["region"])
+startup_phase("providers")
+
+# Open the conversation store (migrates an old conversations.json on first run).
+# Messages are read on demand; only recently active conversations stay in memory.
+CONVERSATIONS_DB = 'conversations.db'
+CONVERSATIONS_FILE = 'conversations.json'
+store = open_store(CONVERSATIONS_DB, CONVERSATIONS_FILE, model_config.get("storage", {}))
+# Serializes the store changes of each conversation; never held during model calls
+conversation_lock = ConversationLocks()
+# Token budgets checked before each model call ("budgets" section)
+budgets = TokenBudgets(model_config.get("budgets", {}), store)
+# Answers dropped by hedging were still paid for
+router.on_discarded(budgets.charge)
+startup_phase("store")
+print(f"Started in {sum(startup_phases.values()):.1f} ms {startup_phases}, "
+      f"providers not loaded yet: {providers.load_report()['not_loaded']}")
+
+@app.before_request
+def start_timer():
+    g.request_start = time.time()
+
+@app.after_request
+def record_request(response):
+    # For streamed responses this measures the time until the headers are sent
+    if request.endpoint and request.endpoint not in ('static', 'metrics'):
+        registry.histogram(
+            "http_request_duration_seconds", "Latency of HTTP requests", LATENCY_BUCKETS,
+            endpoint=request.endpoint, status=response.status_code
+        ).observe(time.time() - g.request_start)
+    return response
+
+@app.after_request
+def compress(response):
+    # Runs before record_request, so the request duration includes it
+    return compress_response(response, request.headers.get('Accept-Encoding'), compression_settings)
+
+def last_modified_at(changed_at):
+    """
+    Convert a change time of the store to a Last-Modified date.
+
+    HTTP dates have a one-second resolution, so none is returned for the
+    current second, which could still see another change.
+
+    Parameters:
+        changed_at (float): Unix time of the last change, None if unknown
+
+    Returns:
+        datetime.datetime: The date in UTC, or None
+    """
+    if changed_at is None or changed_at > time.time() - 1:
+        return None
+    return datetime.datetime.fromtimestamp(int(changed_at), datetime.timezone.utc)
+
+def not_modified(etag, last_modified=None):
+    """
+    Answer a conditional GET before the response is built.
+
+    Parameters:
+        etag (str): Weak entity tag of the current content, unquoted
+        last_modified (datetime.datetime): Date of the last change, if known
+
+    Returns:
+        Response: A 304 response if the client's copy is current, else None
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    """Set the ETag and Last-Modified of a read response, to be revalidated on every use"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add("Accept-Encoding")
+    return response
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def start_turn(conversation_id, message, model):
+    """
+    Create the conversation if needed and append the user message.
+    
+    Parameters:
+        conversation_id (str): ID of the conversation
+        message (str): The user message
+        model (str): Name of the model answering the conversation
+        
+    Returns:
+        tuple: The conversation messages, including the new user message,
+            and the ID of the user message
+    """
+    with conversation_lock(conversation_id):
+        # Initialize conversation if new
+        if not store.exists(conversation_id):
+            # Create metadata entry with timestamp as default title
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            store.create(conversation_id, {
+                "title": timestamp,
+                "created_at": timestamp,
+                "updated_at": timestamp,
+                "model": model
+            })
+
+        # Append user message
+        message_id = store.append_message(conversation_id, 'user', message)
+        return store.get_messages(conversation_id), message_id
+
+def finish_turn(conversation_id, response, reply_to, model=None, usage=None):
+    """
+    Append the assistant response and persist the conversation.
+    
+    Parameters:
+        conversation_id (str): ID of the conversation
+        response (str): The assistant response
+        reply_to (int): ID of the user message being answered
+        model (str): Name of the model that answered, recorded for /compare
+        usage (dict): Tokens and latency of the model call, if it made one
+    """
+    # Append assistant response (store only the final response in conversation history)
+    # and update the timestamp in the same write
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conversation_lock(conversation_id):
+        # The conversation may have been deleted during the model call
+        if store.exists(conversation_id):
+            store.append_message(
+                conversation_id, 'assistant', response,
+                updated_at=timestamp, model=model, reply_to=reply_to, usage=usage
+            )
+    if usage is not None:
+        budgets.record((usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0))
+
+def stream_usage(event):
+    """Return the token counts of a stream 'usage' event, with the prompt cache counts if any"""
+    return {key: value for key, value in event.items() if key != "type"}
+
+def run_job(job, messages, use_cache):
+    """
+    Generate the reply of a /send job and add it to the conversation.
+
+    The model is streamed so that the job can be followed while it runs
+    and stops at the next event once cancelled. A cancelled job adds no
+    reply to the conversation.
+    """
+    start = time.time()
+    usage = None
+    stream = stream_llm_api(messages, job.model, use_cache, job.conversation_id)
+    try:
+        for event in stream:
+            if job.cancelled.is_set():
+                break
+            if event["type"] == "usage":
+                usage = {
+                    "model": job.model,
+                    **stream_usage(event),
+                    "latency_ms": int((time.time() - start) * 1000)
+                }
+            else:
+                job.add_event(event)
+    finally:
+        stream.close()
+    job.usage = usage
+    if not job.cancelled.is_set():
+        finish_turn(job.conversation_id, job.response, job.message_id, usage=usage)
+
+# Background generations started by /send with "async": true ("jobs" section)
+jobs = JobQueue(run_job, store, model_config.get("jobs", {}))
+
 @app.route('/send', methods=['POST'])
 def send():
+    """
+    Send a message and return the model's reply.
+
+    With "async": true in the body, the reply is generated by a background
+    job instead: the response is a job ID to follow with /jobs/<id>, and
+    the reply is added to the conversation even if the client goes away.
+    """
     data = request.json
     conversation_id = data.get('conversation_id')
     message = data.get('message')
     model = data.get('model')
+    use_cache = data.get('cache', True)
 
-    # Initialize conversation if new
-    if conversation_id not in conversations["data"]:
-        conversations["data"][conversation_id] = []
-        # Create metadata entry with timestamp as default title
-        import datetime
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conversations["metadata"][conversation_id] = {
-            "title": timestamp,
-            "created_at": timestamp,
-            "updated_at": timestamp,
-            "model": model
-        }
+    messages, message_id = start_turn(conversation_id, message, model)
 
-    # Append user message
-    conversations["data"][conversation_id].append({'role': 'user', 'content': message})
+    if data.get('async'):
+        job = jobs.submit(Job(conversation_id, model, message_id), messages, use_cache)
+        return jsonify({"job_id": job.id, "state": job.state, "conversation_id": conversation_id}), 202
 
     # Call API with model and corresponding key
-    result = call_llm_api(conversations["data"][conversation_id], model)
+    result = call_llm_api(messages, model, use_cache, conversation_id)
     
     # Extract response and reasoning
     response = result.get('response', '')
     reasoning = result.get('reasoning', '')
 
-    # Append assistant response (store only the final response in conversation history)
-    conversations["data"][conversation_id].append({'role': 'assistant', 'content': response})
-    
-    # Update the timestamp
-    import datetime
-    conversations["metadata"][conversation_id]["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    save_conversations()
+    finish_turn(conversation_id, response, message_id, usage=result.get('usage'))
 
     # Return both response and reasoning to the frontend
     return jsonify({
@@ -89,27 +297,387 @@ def send():
         'conversation_id': conversation_id
     })
 
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/send/stream', methods=['POST'])
+def send_stream():
+    """
+    Streaming variant of /send.
+    
+    Returns a text/event-stream with 'reasoning' and 'text' events carrying
+    deltas as the model produces them, then a final 'done' event. The
+    complete response is saved to the conversation once the stream ends.
+    """
+    data = request.json
+    conversation_id = data.get('conversation_id')
+    message = data.get('message')
+    model = data.get('model')
+    use_cache = data.get('cache', True)
+
+    messages, message_id = start_turn(conversation_id, message, model)
+    request_start = g.request_start
+
+    def generate():
+        response = ""
+        usage = None
+        first_token = True
+        for event in stream_llm_api(messages, model, use_cache, conversation_id):
+            if event["type"] == "usage":
+                usage = event
+                continue
+            if first_token and event["type"] in ("text", "reasoning"):
+                registry.histogram(
+                    "http_time_to_first_token_seconds", "Time from request to first streamed token",
+                    LATENCY_BUCKETS, endpoint="send_stream", model=model
+                ).observe(time.time() - request_start)
+                first_token = False
+            if event["type"] == "text":
+                response += event["text"]
+            elif event["type"] == "error":
+                response = event["text"]
+            yield sse_event(event["type"], {"text": event["text"]})
+
+        if usage is not None:
+            usage = {
+                "model": model,
+                **stream_usage(usage),
+                "latency_ms": int((time.time() - request_start) * 1000)
+            }
+        finish_turn(conversation_id, response, message_id, usage=usage)
+        yield sse_event("done", {"conversation_id": conversation_id, "usage": usage})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Shared pool for the concurrent model calls of /compare
+compare_executor = ThreadPoolExecutor(max_workers=model_config.get("compare_workers", 16))
+
+def compare_one(conversation_id, messages, message_id, model_name):
+    """
+    Call one model for /compare and record its reply in the conversation.
+    
+    The reply is saved from the worker thread, so it is kept even if the
+    client stops reading the results.
+    
+    Returns:
+        dict: The model name, its response and reasoning, and the latency in seconds
+    """
+    start = time.time()
+    result = call_llm_api(messages, model_name, conversation_id=conversation_id)
+    latency = time.time() - start
+    finish_turn(conversation_id, result.get('response', ''), message_id, model=model_name,
+                usage=result.get('usage'))
+    return {
+        'model': model_name,
+        'response': result.get('response', ''),
+        'reasoning': result.get('reasoning', ''),
+        'latency': round(latency, 3)
+    }
+
+@app.route('/compare', methods=['POST'])
+def compare():
+    """
+    Send one prompt to several models at once.
+    
+    The body holds 'conversation_id', 'message' and 'models' (defaults to
+    every available model). By default the reply is a text/event-stream with
+    one 'result' event per model in completion order, then a 'done' event;
+    with "stream": false a single JSON list is returned once all models are
+    done. Each reply is saved in the conversation with its model name.
+    """
+    data = request.json
+    conversation_id = data.get('conversation_id')
+    message = data.get('message')
+    models = data.get('models') or model_config["available_models"]
+
+    unknown = [name for name in models if name not in model_config["available_models"]]
+    if unknown:
+        return jsonify({"error": f"Unknown models: {', '.join(unknown)}"}), 400
+
+    messages, message_id = start_turn(conversation_id, message, models[0])
+    futures = [
+        compare_executor.submit(compare_one, conversation_id, messages, message_id, name)
+        for name in models
+    ]
+
+    if not data.get('stream', True):
+        results = [future.result() for future in as_completed(futures)]
+        return jsonify({'results': results, 'conversation_id': conversation_id})
+
+    def generate():
+        for future in as_completed(futures):
+            yield sse_event("result", future.result())
+        yield sse_event("done", {"conversation_id": conversation_id})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/models')
 def get_models():
-    return jsonify({
+    # Served from the cached catalog, without calling Bedrock
+    overrides = model_config.get("model_capabilities", {})
+    response = jsonify({
         "available_models": model_config["available_models"],
-        "default_model": model_config["default_model"]
+        "default_model": model_config["default_model"],
+        "capabilities": {
+            name: catalog.capabilities(get_model_id(name), overrides.get(name))
+            for name in model_config["available_models"]
+            if get_model_id(name)
+        },
+        "catalog_updated_at": catalog.fetched_at or None
+    })
+    # Small enough to build every time; the ETag saves sending it again
+    etag = generate_etag(response.get_data())
+    return not_modified(etag) or with_validators(response, etag)
+
+@app.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Get the response cache hit/miss counters"""
+    cache = providers.response_cache
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+@app.route('/cache', methods=['DELETE'])
+def clear_cache():
+    """Empty the response cache"""
+    cache = providers.response_cache
+    if cache is None:
+        return jsonify({"error": "Response cache is disabled"}), 400
+    cache.clear()
+    return jsonify({"status": "success"})
+
+@app.route('/startup', methods=['GET'])
+def get_startup():
+    """Get the duration of the startup steps and the providers loaded since"""
+    return jsonify({
+        "phases_ms": startup_phases,
+        "total_ms": round(sum(startup_phases.values()), 2),
+        "providers": providers.load_report(),
+        "boto3_loaded": "boto3" in sys.modules
     })
 
+@app.route('/limits', methods=['GET'])
+def get_limits():
+    """Get the concurrency limit, in-flight calls and queue depth of each model and region"""
+    return jsonify(limiter_stats())
+
+@app.route('/storage', methods=['GET'])
+def get_storage():
+    """Get the message cache counters and the size of the stored messages"""
+    return jsonify({"cache": store.cache.stats(), "messages": store.storage_stats()})
+
+@app.route('/routing', methods=['GET'])
+def get_routing():
+    """Get the rolling latency and health of each model endpoint"""
+    return jsonify({"enabled": router.settings["enabled"], "endpoints": router.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose latency, token and error metrics in Prometheus text format"""
+    limits = limiter_stats()
+    text = registry.render()
+    text += format_samples("model_concurrency_limit", "Current adaptive concurrency limit", "gauge",
+                           [({"model": s["model"], "region": s["region"]}, s["concurrency_limit"]) for s in limits])
+    text += format_samples("model_in_flight", "Bedrock calls in flight", "gauge",
+                           [({"model": s["model"], "region": s["region"]}, s["in_flight"]) for s in limits])
+    text += format_samples("model_queue_depth", "Bedrock calls waiting for capacity", "gauge",
+                           [({"model": s["model"], "region": s["region"]}, s["queue_depth"]) for s in limits])
+    text += format_samples("model_throttles_total", "Throttled Bedrock calls", "counter",
+                           [({"model": s["model"], "region": s["region"]}, s["throttled"]) for s in limits])
+    routes = router.stats()
+    text += format_samples("route_latency_p95_seconds", "Rolling p95 latency of model endpoints", "gauge",
+                           [({"model": r["model"], "region": r["region"], "kind": r["kind"]}, r["p95"])
+                            for r in routes if r["p95"] is not None])
+    if providers.single_flight is not None:
+        text += format_samples("single_flight_calls_in_flight", "Distinct model calls that identical calls can join",
+                               "gauge", [({}, providers.single_flight.stats()["in_flight"])])
+    text += format_samples("jobs_in_progress", "Background /send jobs", "gauge",
+                           [({"state": state}, count) for state, count in jobs.stats().items()])
+    stats = store.cache.stats()
+    text += format_samples("conversation_cache_bytes", "Estimated memory held by cached conversation messages",
+                           "gauge", [({}, stats["bytes"])])
+    text += format_samples("conversation_cache_conversations", "Conversations in the message cache", "gauge",
+                           [({}, stats["conversations"])])
+    text += format_samples("conversation_cache_lookups_total", "Message cache lookups", "counter",
+                           [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])])
+    text += format_samples("conversation_cache_evictions_total", "Conversations evicted from the message cache",
+                           "counter", [({}, stats["evictions"])])
+    cache = providers.response_cache
+    if cache is not None:
+        stats = cache.stats()
+        text += format_samples("response_cache_lookups_total", "Response cache lookups", "counter",
+                               [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"]),
+                                ({"result": "bypass"}, stats["bypassed"])])
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+def page_limit(default=50, maximum=200):
+    """Read the 'limit' query parameter of a paged request"""
+    return min(max(request.args.get('limit', default, type=int), 1), maximum)
+
 @app.route('/conversations', methods=['GET'])
 def get_conversations():
-    """Get all conversation metadata"""
-    return jsonify(conversations["metadata"])
+    """
+    Get conversation metadata.
+
+    With 'limit' or 'cursor', returns one page of conversations, most
+    recently updated first, and the cursor of the next page; otherwise the
+    metadata of every conversation keyed by ID.
+    """
+    version, changed_at = store.list_version()
+    etag, last_modified = f"{store.database_id}-{version}", last_modified_at(changed_at)
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return with_validators(jsonify(store.list_metadata()), etag, last_modified)
+    try:
+        page, next_cursor = store.list_page(page_limit(), request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return with_validators(jsonify({"conversations": page, "next_cursor": next_cursor}), etag, last_modified)
+
+def time_arg(name):
+    """
+    Read an ISO date or datetime query parameter as a store timestamp.
+
+    Raises:
+        ValueError: If the value is not an ISO date
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+
+def gzip_chunks(chunks):
+    """Compress a stream of byte chunks into a gzip stream"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/conversations/export', methods=['GET'])
+def export_conversations():
+    """
+    Stream conversations as NDJSON, one conversation per line.
+
+    'since' and 'until' (ISO dates, 'until' excluded) select conversations
+    by their last update and 'model' by their model; 'gzip=1' compresses
+    the stream.
+    """
+    try:
+        since, until = time_arg('since'), time_arg('until')
+    except ValueError:
+        return jsonify({"error": "'since' and 'until' must be ISO dates"}), 400
+
+    records = store.export_records(since, until, request.args.get('model'))
+    body = (json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n" for record in records)
+    filename, mimetype = "conversations.ndjson", "application/x-ndjson"
+    if request.args.get('gzip') in ('1', 'true'):
+        body = gzip_chunks(body)
+        filename, mimetype = filename + ".gz", "application/gzip"
+    return Response(body, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route('/conversations/import', methods=['POST'])
+def import_conversations():
+    """
+    Import conversations from an NDJSON body, as written by /conversations/export.
+
+    The body is read one line at a time and written in batches. A gzip
+    body is sent with 'Content-Encoding: gzip' or 'gzip=1'. Conversations
+    that already exist are skipped.
+    """
+    stream = request.stream
+    if request.headers.get('Content-Encoding') == 'gzip' or request.args.get('gzip') in ('1', 'true'):
+        stream = gzip.GzipFile(fileobj=stream)
+
+    def records():
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    raise ValueError(f"Line {number}: invalid JSON")
+
+    counts = {}
+    try:
+        store.import_records(records(), counts=counts)
+    except (ValueError, OSError, EOFError) as e:
+        # The batches written before the error are kept
+        return jsonify({"error": str(e), **counts}), 400
+    return jsonify(counts)
 
 @app.route('/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    """Get a specific conversation"""
-    if conversation_id in conversations["data"]:
-        return jsonify({
-            "messages": conversations["data"][conversation_id],
-            "metadata": conversations["metadata"].get(conversation_id, {})
-        })
-    return jsonify({"error": "Conversation not found"}), 404
+    """Get a specific conversation, or only its latest 'limit' messages"""
+    state = store.conversation_version(conversation_id)
+    if state is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    etag, last_modified = f"{store.database_id}-{state[0]}", last_modified_at(state[1])
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    metadata = store.get_metadata(conversation_id)
+    if metadata is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    if 'limit' in request.args:
+        data = {**store.get_message_range(conversation_id, page_limit()), "metadata": metadata}
+    else:
+        data = {"messages": store.get_messages(conversation_id), "metadata": metadata}
+    return with_validators(jsonify(data), etag, last_modified)
+
+@app.route('/conversations/<conversation_id>/messages', methods=['GET'])
+def get_conversation_messages(conversation_id):
+    """Get the 'limit' messages before or after a cursor, or the latest ones"""
+    state = store.conversation_version(conversation_id)
+    if state is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    etag, last_modified = f"{store.database_id}-{state[0]}", last_modified_at(state[1])
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    try:
+        return with_validators(jsonify(store.get_message_range(
+            conversation_id, page_limit(), request.args.get('before'), request.args.get('after')
+        )), etag, last_modified)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/conversations/<conversation_id>/usage', methods=['GET'])
+def get_conversation_usage(conversation_id):
+    """Get the tokens and latency of each reply of a conversation, with totals per model"""
+    if not store.exists(conversation_id):
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify({**store.get_usage(conversation_id), "budgets": budgets.stats(conversation_id)})
+
+@app.route('/usage', methods=['GET'])
+def get_usage():
+    """Get the tokens used by each model, over the last 'since' seconds if given"""
+    since = request.args.get('since', type=float)
+    return jsonify({
+        "by_model": store.usage_by_model(time.time() - since if since else 0),
+        "budgets": budgets.stats()
+    })
+
+@app.route('/search', methods=['GET'])
+def search_conversations():
+    """Find conversations by the words and "phrases" of their messages, best match first"""
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        results = store.search(query, limit, offset)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": query, "results": results})
 
 @app.route('/conversations/<conversation_id>/title', methods=['PUT'])
 def update_conversation_title(conversation_id):
@@ -117,48 +685,62 @@ def update_conversation_title(conversation_id):
     data = request.json
     new_title = data.get('title')
     
-    if conversation_id in conversations["metadata"] and new_title:
-        conversations["metadata"][conversation_id]["title"] = new_title
-        save_conversations()
-        return jsonify({"status": "success"})
+    if new_title:
+        with conversation_lock(conversation_id):
+            updated = store.update_metadata(conversation_id, title=new_title)
+        if updated:
+            return jsonify({"status": "success"})
     
     return jsonify({"error": "Conversation not found or invalid title"}), 400
 
 @app.route('/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
     """Delete a conversation"""
-    if conversation_id in conversations["data"]:
-        # Remove the conversation data
-        del conversations["data"][conversation_id]
-        # Remove the metadata
-        if conversation_id in conversations["metadata"]:
-            del conversations["metadata"][conversation_id]
-        save_conversations()
+    # Removes the metadata and, by cascade, the messages
+    with conversation_lock(conversation_id):
+        deleted = store.delete(conversation_id)
+    if deleted:
         return jsonify({"status": "success"})
     
     return jsonify({"error": "Conversation not found"}), 404
 
 
-def call_llm_api(messages, model_name):
+def call_llm_api(messages, model_name, use_cache=True, conversation_id=None):
     """
     Call the appropriate LLM API based on the model name.
     
     Parameters:
         messages (list): List of message dictionaries with 'role' and 'content'
         model_name (str): Name of the model to use
+        use_cache (bool): Set to False to bypass the response cache
+        conversation_id (str): ID of the conversation, for its token budget
         
     Returns:
-        dict: Contains 'response' and optionally 'reasoning' if available
+        dict: Contains 'response', optionally 'reasoning' if available, and
+            'usage' when the model was called
     """
     try:
-        from bedrock_models import get_model
-        
-        # Get the appropriate model instance
-        model = get_model(model_name)
+        # Get the shared model instance, or its router
+        model = router.get_model(model_name, cached=use_cache)
         
+        # Send as much recent history as fits in the model's budget
+        context = fit_context(messages, get_context_budget(model_config, model_name), model_name)
+        max_tokens = model_config.get("max_output_tokens", 2000)
+        error = budgets.check(conversation_id, sum(estimate_message_tokens(m) for m in context) + max_tokens)
+        if error:
+            return {"response": error, "reasoning": ""}
 
-        response = model.generate(messages[-1]['content'])
-        result = {"response": response, "reasoning": ""}
+        start = time.time()
+        result = model.converse(
+            context,
+            max_tokens=max_tokens,
+            temperature=model_config.get("temperature", 0.3)
+        )
+        if result.get("usage"):
+            # A routed call names the model that answered, which can be a fallback
+            result = {**result, "usage": {
+                "model": model_name, **result["usage"], "latency_ms": int((time.time() - start) * 1000)
+            }}
             
         # Return both response and reasoning if available
         return result
@@ -166,14 +748,193 @@ def call_llm_api(messages, model_name):
     except Exception as e:
         return {"response": f"Error: {str(e)}", "reasoning": ""}
 
+def stream_llm_api(messages, model_name, use_cache=True, conversation_id=None):
+    """
+    Stream a reply from the appropriate LLM API based on the model name.
+    
+    Parameters:
+        messages (list): List of message dictionaries with 'role' and 'content'
+        model_name (str): Name of the model to use
+        use_cache (bool): Set to False to bypass the response cache
+        conversation_id (str): ID of the conversation, for its token budget
+        
+    Yields:
+        dict: Events with a 'type' ('reasoning', 'text' or 'error') and 'text',
+            and a final 'usage' event when the model was called
+    """
+    try:
+        model = router.get_model(model_name, cached=use_cache)
+    except Exception as e:
+        yield {"type": "error", "text": f"Error: {str(e)}"}
+        return
+
+    context = fit_context(messages, get_context_budget(model_config, model_name), model_name)
+    max_tokens = model_config.get("max_output_tokens", 2000)
+    error = budgets.check(conversation_id, sum(estimate_message_tokens(m) for m in context) + max_tokens)
+    if error:
+        yield {"type": "error", "text": error}
+        return
+    yield from model.stream(
+        context,
+        max_tokens=max_tokens,
+        temperature=model_config.get("temperature", 0.3)
+    )
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Get the latest jobs, of one 'conversation_id' and only the pending or running ones with 'active=1'"""
+    return jsonify(store.list_jobs(
+        request.args.get('conversation_id'),
+        request.args.get('active') in ('1', 'true'),
+        page_limit()
+    ))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the state of a job and the reply generated so far"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.status())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def follow_job(job_id):
+    """
+    Follow a job as a text/event-stream.
+
+    Sends the 'reasoning', 'text' and 'error' events generated so far, from
+    the 'from' event index if given, then the new ones as they arrive, and
+    a final 'done' event with the state of the job.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    start = max(request.args.get('from', 0, type=int), 0)
+
+    def generate():
+        for event in job.read_events(start):
+            yield sse_event(event["type"], {"text": event["text"]})
+        status = job.status()
+        yield sse_event("done", {
+            "job_id": job.id,
+            "conversation_id": job.conversation_id,
+            "state": status["state"],
+            "usage": status["usage"]
+        })
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a pending or running job"""
+    job = jobs.cancel(job_id)
+    if job is not None:
+        return jsonify(job.status())
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"error": "Job already ended"}), 409
+
+# Batch runs started from /batch, keyed by batch ID
+BATCH_DIR = 'batches'
+batches = {}
+# Held while a batch is checked and registered, so two requests cannot claim the same files
+batches_lock = threading.Lock()
+
+def batch_file_in_use(path):
+    """Return True if a pending or running batch reads or writes a file"""
+    return any(path in (b.input_path, b.output_path) and b.state in ("pending", "running")
+               for b in batches.values())
+
+@app.route('/batch', methods=['POST'])
+def start_batch():
+    """
+    Start a batch run in the background.
+    
+    The input is either an uploaded 'file' or the name of a JSONL file in the
+    batches directory given as 'input' in a JSON body. Results go to
+    'output' (default '<input>.out.jsonl') in the same directory; if that file
+    already exists the run resumes from it. 'workers' is capped by
+    batch_max_workers in model_config.json. An upload never replaces an
+    existing file: it gets a unique name instead.
+    """
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    with batches_lock:
+        if 'file' in request.files:
+            upload = request.files['file']
+            input_name = os.path.basename(upload.filename or '') or f"{uuid.uuid4().hex}.jsonl"
+            if batch_file_in_use(os.path.join(BATCH_DIR, input_name)):
+                return jsonify({"error": "A running batch uses a file of this name"}), 409
+            if os.path.exists(os.path.join(BATCH_DIR, input_name)):
+                # Never overwrite an earlier input or output
+                stem, extension = os.path.splitext(input_name)
+                input_name = f"{stem}-{uuid.uuid4().hex[:8]}{extension}"
+            upload.save(os.path.join(BATCH_DIR, input_name))
+            data = request.form
+        else:
+            data = request.json or {}
+            input_name = data.get('input', '')
+
+        output_name = data.get('output') or os.path.splitext(input_name)[0] + '.out.jsonl'
+        # Only plain file names inside the batches directory are accepted
+        if not input_name or os.path.basename(input_name) != input_name or os.path.basename(output_name) != output_name:
+            return jsonify({"error": "Invalid input or output file name"}), 400
+        if output_name == input_name:
+            return jsonify({"error": "The output must be another file than the input"}), 400
+        input_path = os.path.join(BATCH_DIR, input_name)
+        output_path = os.path.join(BATCH_DIR, output_name)
+        if not os.path.exists(input_path):
+            return jsonify({"error": "Input file not found"}), 404
+        if batch_file_in_use(output_path):
+            return jsonify({"error": "A running batch already uses this output"}), 409
+        if any(b.output_path == input_path and b.state in ("pending", "running") for b in batches.values()):
+            return jsonify({"error": "A running batch is still writing this input"}), 409
+        try:
+            workers = int(data.get('workers', 4))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'workers' must be an integer"}), 400
+        if workers < 1:
+            return jsonify({"error": "'workers' must be at least 1"}), 400
+
+        runner = BatchRunner(
+            input_path,
+            output_path,
+            workers=min(workers, model_config.get("batch_max_workers", 16)),
+            model_limits=model_config.get("batch_model_limits", {}),
+            default_model=model_config["default_model"],
+            region_name=model_config["region"],
+            max_tokens=model_config.get("max_output_tokens", 2000),
+            temperature=model_config.get("temperature", 0.3)
+        )
+        batch_id = uuid.uuid4().hex
+        batches[batch_id] = runner
+    threading.Thread(target=runner.run, daemon=True).start()
+    return jsonify({"batch_id": batch_id, **runner.status()}), 202
+
+@app.route('/batch', methods=['GET'])
+def list_batches():
+    """Get the status of every batch run"""
+    return jsonify({batch_id: runner.status() for batch_id, runner in batches.items()})
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Get the status of a batch run"""
+    if batch_id in batches:
+        return jsonify(batches[batch_id].status())
+    return jsonify({"error": "Batch not found"}), 404
+
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     if request.method == 'POST':
         data = request.json
         # Save selected model
-        # For simplicity, store in a file or variable
-        with open('settings.json', 'w') as f:
+        # Write to a temporary file first so concurrent readers never see a partial file
+        temp_path = f"settings.json.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
             json.dump(data, f)
+        os.replace(temp_path, 'settings.json')
         return jsonify({'status': 'saved'})
     else:
         if os.path.exists('settings.json'):
@@ -184,4 +945,13 @@ def settings():
         return jsonify(settings)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Each request runs in its own thread so slow generations do not block
+    # other users. The reloader is off because it imports the app twice,
+    # warming the clients and opening the store in both processes.
+    app.run(
+        host=os.getenv('HOST', '127.0.0.1'),
+        port=int(os.getenv('PORT', '5000')),
+        debug=True,
+        threaded=True,
+        use_reloader=False
+    )
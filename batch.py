@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from providers import configure_providers, get_model
+
+
+def read_completed_ids(output_path):
+    """
+    Collect the IDs already answered in an output file.
+
+    Error records are not counted, so a resumed run retries their prompts.
+    A line cut short by a crash is removed so the file can be appended to.
+
+    Parameters:
+        output_path (str): Path of the output JSONL file
+
+    Returns:
+        set: IDs of the prompts that already have a result
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    valid_size = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if "error" not in record:
+                    completed.add(record["id"])
+            except (ValueError, KeyError, TypeError):
+                break
+            valid_size += len(line)
+
+    if valid_size != os.path.getsize(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(valid_size)
+    return completed
+
+
+def is_valid_id(value):
+    """Return True if a value can identify a prompt: a string or a number"""
+    return not isinstance(value, bool) and isinstance(value, (str, int, float))
+
+
+def check_item(item):
+    """
+    Validate one input line.
+
+    Parameters:
+        item: The decoded JSON value of the line
+
+    Returns:
+        str: An error message if the line cannot be run, else None
+    """
+    if not isinstance(item, dict):
+        return "Error: the line is not a JSON object"
+    if "id" in item and not is_valid_id(item["id"]):
+        return "Error: 'id' must be a string or a number"
+    if not isinstance(item.get("model", ""), str):
+        return "Error: 'model' must be a string"
+    if "messages" in item:
+        messages = item["messages"]
+        if not isinstance(messages, list) or not messages or not all(
+                isinstance(message, dict) and message.get("role") in ("user", "assistant")
+                and isinstance(message.get("content"), (str, list)) for message in messages):
+            return "Error: 'messages' must be a list of objects with a 'role' and a 'content'"
+    elif not isinstance(item.get("prompt"), str):
+        return "Error: the line needs a 'prompt' string or a 'messages' list"
+    for name in ("max_tokens", "temperature"):
+        if name in item and (isinstance(item[name], bool) or not isinstance(item[name], (int, float))):
+            return f"Error: '{name}' must be a number"
+    return None
+
+
+class BatchRunner:
+    """
+    Run the prompts of a JSONL file through the models.
+
+    Each input line is a JSON object with an optional 'id', an optional
+    'model' and either a 'prompt' string or a 'messages' list; 'max_tokens'
+    and 'temperature' override the defaults. The input is read line by line,
+    at most `workers` prompts are in flight, and each result is appended to
+    the output file as soon as it finishes. A line that is not valid gets
+    an error record. Prompts whose ID already has a result in the output
+    file are skipped, so an interrupted run resumes where it stopped and
+    retries the prompts that failed.
+    """
+
+    def __init__(self, input_path, output_path, workers=4, model_limits=None,
+                 default_model="deepseek", region_name="us-east-1", max_tokens=2000, temperature=0.3):
+        """
+        Prepare a batch run.
+
+        Parameters:
+            input_path (str): Path of the input JSONL file
+            output_path (str): Path of the output JSONL file
+            workers (int): Maximum number of prompts in flight
+            model_limits (dict): Maximum number of concurrent calls per model name
+            default_model (str): Model used when a line has no 'model'
+            region_name (str): AWS region of the models
+            max_tokens (int): Default maximum number of tokens to generate
+            temperature (float): Default temperature
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = workers
+        self.model_limits = model_limits or {}
+        self.default_model = default_model
+        self.region_name = region_name
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self._model_semaphores = {}
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.read = 0
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def _model_semaphore(self, model_name):
+        """Return the semaphore capping the concurrency of one model"""
+        with self._lock:
+            semaphore = self._model_semaphores.get(model_name)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self.model_limits.get(model_name, self.workers))
+                self._model_semaphores[model_name] = semaphore
+            return semaphore
+
+    def _process(self, item):
+        """Call the model for one input line and return the result record"""
+        model_name = item.get("model", self.default_model)
+        messages = item.get("messages") or [{"role": "user", "content": item.get("prompt", "")}]
+        start = time.time()
+        with self._model_semaphore(model_name):
+            try:
+                model = get_model(model_name, self.region_name)
+                result = model.converse(
+                    messages,
+                    max_tokens=item.get("max_tokens", self.max_tokens),
+                    temperature=item.get("temperature", self.temperature)
+                )
+            except Exception as e:
+                result = {"response": f"Error: {str(e)}", "reasoning": ""}
+
+        record = {
+            "id": item["id"],
+            "model": model_name,
+            "response": result["response"],
+            "reasoning": result.get("reasoning", ""),
+            "latency": round(time.time() - start, 3)
+        }
+        if result.get("usage"):
+            record["usage"] = result["usage"]
+        if result["response"].startswith("Error:"):
+            record["error"] = result["response"]
+        return record
+
+    def _write(self, output, record):
+        """Append one result to the output file"""
+        with self._lock:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if "error" in record:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def run(self):
+        """
+        Process the whole input file.
+
+        Returns:
+            dict: The final status of the run
+        """
+        self.state = "running"
+        self.started_at = time.time()
+        completed_ids = read_completed_ids(self.output_path)
+        # Bounds the number of lines read ahead of the workers
+        in_flight = threading.BoundedSemaphore(self.workers)
+
+        def task(item):
+            try:
+                self._write(output, self._process(item))
+            finally:
+                in_flight.release()
+
+        try:
+            with open(self.input_path, 'r') as source, \
+                    open(self.output_path, 'a') as output, \
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for line_number, line in enumerate(source, 1):
+                    if not line.strip():
+                        continue
+                    self.read += 1
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        item = None
+                        error = "Error: invalid JSON"
+                    else:
+                        error = check_item(item)
+                    if error is not None:
+                        item_id = item.get("id", line_number) if isinstance(item, dict) else line_number
+                        self._write(output, {
+                            "id": item_id if is_valid_id(item_id) else line_number,
+                            "response": "",
+                            "error": f"{error} on line {line_number}"
+                        })
+                        continue
+                    item.setdefault("id", line_number)
+                    if item["id"] in completed_ids:
+                        self.skipped += 1
+                        continue
+
+                    in_flight.acquire()
+                    executor.submit(task, item)
+            self.state = "finished"
+        except Exception:
+            self.state = "failed"
+            raise
+        finally:
+            self.finished_at = time.time()
+        return self.status()
+
+    def status(self):
+        """
+        Get the progress of the run.
+
+        Returns:
+            dict: State and counters of the run
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "input": self.input_path,
+                "output": self.output_path,
+                "read": self.read,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "failed": self.failed,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+
+def parse_model_limits(values):
+    """Parse 'model=limit' command line values into a dictionary"""
+    limits = {}
+    for value in values or []:
+        model_name, _, limit = value.partition("=")
+        limits[model_name] = int(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the Bedrock models")
+    parser.add_argument("input", help="Input JSONL file")
+    parser.add_argument("output", help="Output JSONL file, appended to when resuming")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of prompts in flight")
+    parser.add_argument("--model-limit", action="append", metavar="MODEL=N",
+                        help="Maximum number of concurrent calls for a model")
+    parser.add_argument("--config", default="model_config.json", help="Model configuration file")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        model_config = json.load(f)
+
+    configure_providers(model_config)
+
+    runner = BatchRunner(
+        args.input,
+        args.output,
+        workers=args.workers,
+        model_limits={**model_config.get("batch_model_limits", {}), **parse_model_limits(args.model_limit)},
+        default_model=model_config["default_model"],
+        region_name=model_config["region"],
+        max_tokens=model_config.get("max_output_tokens", 2000),
+        temperature=model_config.get("temperature", 0.3)
+    )
+    status = runner.run()
+    print(json.dumps(status, indent=2))
+
+
+if __name__ == "__main__":
+    main()
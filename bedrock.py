@@ -1,41 +1,32 @@
-import boto3
 import json
 from botocore.exceptions import ClientError
-
-# Create a Bedrock Runtime client in the AWS Region you want to use.
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
+from bedrock_models import get_client
+from model_catalog import ModelCatalog
 
 region = 'us-east-1'
-bedrock_client = boto3.client(
-    service_name="bedrock",
-    region_name=region
-)
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name=region,
-)
+# Model summaries and inference profiles are cached in model_catalog.json
+# and only fetched from Bedrock when the cache is missing or expired
+catalog = ModelCatalog(region_name=region)
+catalog.load()
 
 def list_foundation_models():
-    response = bedrock_client.list_foundation_models()
-
-    return response['modelSummaries']
+    if catalog.is_stale():
+        catalog.refresh()
+    return list(catalog.models.values())
 
 
 def get_foundation_model(model_id):
-    response = bedrock_client.get_foundation_model(
-        modelIdentifier=model_id
-    )
-
-    return response['modelDetails']
+    return catalog.get_model_details(model_id)
 
 
 
 
 def list_inference_profiles():
     """List all available inference profiles"""
-    response = bedrock_client.list_inference_profiles()
-    return response.get('inferenceProfileSummaries', [])
+    if catalog.is_stale():
+        catalog.refresh()
+    return list(catalog.profiles.values())
 
 def stream_response(user_message,model_id="mistral.mistral-large-2402-v1:0"):
     conversation = [
@@ -47,7 +38,7 @@ def stream_response(user_message,model_id="mistral.mistral-large-2402-v1:0"):
 
     try:
         # Send the message to the model, using a basic inference configuration.
-        streaming_response = bedrock_runtime.converse_stream(
+        streaming_response = get_client(region).converse_stream(
             modelId=model_id,
             messages=conversation,
             inferenceConfig={"maxTokens": 512, "temperature": 0.5, "topP": 0.9},
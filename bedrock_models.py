@@ -1,25 +1,172 @@
-import boto3
-from botocore.exceptions import ClientError
 import json
+import threading
+import time
+from context_window import estimate_message_tokens, estimate_tokens
+from message_format import DEFAULT_FORMAT_SETTINGS, cache_point_tokens, with_cache_point
+from metrics import read_usage, record_model_call
+from rate_limiter import get_limiter, is_throttling_error
+
+# Default botocore settings for the shared bedrock-runtime clients.
+# Every key can be overridden from the "client" section of model_config.json.
+# Throttling is retried by the per-model limiters (rate_limiter.py), so
+# botocore makes a single attempt and does not hide throttles from them.
+DEFAULT_CLIENT_SETTINGS = {
+    "max_pool_connections": 50,
+    "connect_timeout": 5,
+    "read_timeout": 300,
+    "tcp_keepalive": True,
+    "max_attempts": 1
+}
+
+_client_settings = dict(DEFAULT_CLIENT_SETTINGS)
+_format_settings = dict(DEFAULT_FORMAT_SETTINGS)
+_client_factory = None
+_session = None
+_clients = {}
+_models = {}
+_registry_lock = threading.Lock()
+
+
+def usage_from(response):
+    """Return the token counts of a Bedrock response as a 'usage' dictionary"""
+    input_tokens, output_tokens = read_usage(response)
+    usage = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    usage.update(cache_usage(response.get("usage", {})))
+    return usage
+
+
+def cache_usage(usage):
+    """Return the prompt cache token counts of a Converse 'usage' field, if any"""
+    counts = {}
+    if usage.get("cacheReadInputTokens"):
+        counts["cache_read_tokens"] = usage["cacheReadInputTokens"]
+    if usage.get("cacheWriteInputTokens"):
+        counts["cache_write_tokens"] = usage["cacheWriteInputTokens"]
+    return counts
+
+
+def converse_message(message):
+    """
+    Convert a chat message to the Converse API format.
+
+    Parameters:
+        message (dict): Message dictionary with 'role' and 'content', the
+            content being a string or a list of Converse content blocks
+
+    Returns:
+        dict: The message with a list of content blocks
+    """
+    if isinstance(message["content"], str):
+        return {"role": message["role"], "content": [{"text": message["content"]}]}
+    return message
+
+
+def read_output(response):
+    """
+    Split the content of a Converse response.
+
+    Returns:
+        tuple: (text, reasoning), each the concatenation of its blocks
+    """
+    text = ""
+    reasoning = ""
+    for block in response["output"]["message"]["content"]:
+        if "text" in block:
+            text += block["text"]
+        elif "reasoningContent" in block:
+            reasoning += block["reasoningContent"].get("reasoningText", {}).get("text", "")
+    return text, reasoning
+
+
+def read_delta(delta):
+    """
+    Convert the delta of a ConverseStream contentBlockDelta event.
+
+    Returns:
+        dict: A 'text' or 'reasoning' event, or None for other deltas
+    """
+    if "text" in delta:
+        return {"type": "text", "text": delta["text"]}
+    if "text" in delta.get("reasoningContent", {}):
+        return {"type": "reasoning", "text": delta["reasoningContent"]["text"]}
+    return None
+
 
 class BedrockModel:
     """
     Base class for Amazon Bedrock models.
     
     This class provides the foundation for specific model implementations
-    and handles common functionality like client initialization.
+    and handles common functionality like client initialization. The
+    Converse API has the same request and response format for every model
+    family, so conversations are handled here once for all subclasses.
     """
     
-    def __init__(self, model_id, region_name="us-east-1"):
+    def __init__(self, model_id, region_name="us-east-1", client=None, cache_point_tokens=None):
         """
         Initialize a Bedrock model.
         
         Parameters:
             model_id (str): The ID of the model to use
             region_name (str): AWS region where the model is available
+            client: Optional bedrock-runtime client, defaults to the shared
+                client for the region
+            cache_point_tokens (int): Add a prompt cache point to requests of
+                at least this many estimated tokens, None for models without
+                prompt caching
         """
         self.model_id = model_id
-        self.client = boto3.client("bedrock-runtime", region_name=region_name)
+        self.region_name = region_name
+        self.client = client if client is not None else get_client(region_name)
+        self.limiter = get_limiter(model_id, self.region_name)
+        self.cache_point_tokens = cache_point_tokens
+    
+    def _format(self, messages):
+        """
+        Build the Converse messages of a request.
+        
+        When the model supports prompt caching and the request is large
+        enough, a cache point closes the last message: Bedrock caches the
+        whole request, and the next turn, which starts with it, reads that
+        prefix from the cache.
+        
+        Parameters:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            
+        Returns:
+            tuple: (formatted messages, estimated input tokens)
+        """
+        formatted = [converse_message(message) for message in messages]
+        tokens = sum(estimate_message_tokens(m) for m in messages)
+        if formatted and self.cache_point_tokens is not None and tokens >= self.cache_point_tokens:
+            formatted = with_cache_point(formatted)
+        return formatted, tokens
+    
+    def _invoke(self, operation, tokens, **kwargs):
+        """
+        Call a bedrock-runtime operation through the model's rate limiter.
+        
+        The call waits for capacity when the model is at its quota and is
+        retried with backoff when Bedrock throttles it.
+        
+        Parameters:
+            operation (str): Name of the client method, e.g. 'converse'
+            tokens (int): Estimated tokens of the call
+            **kwargs: Arguments of the operation
+            
+        Returns:
+            dict: The operation response
+        """
+        method = getattr(self.client, operation)
+        start = time.time()
+        try:
+            response = self.limiter.call(lambda: method(**kwargs), tokens)
+        except Exception:
+            record_model_call(self.model_id, operation, time.time() - start, error=True)
+            raise
+        input_tokens, output_tokens = read_usage(response)
+        record_model_call(self.model_id, operation, time.time() - start, input_tokens, output_tokens)
+        return response
     
     def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
         """
@@ -46,16 +193,104 @@ class BedrockModel:
             temperature (float): Controls randomness (0-1)
             
         Returns:
-            dict: Contains 'response' (str) and optionally 'reasoning' (str)
+            dict: Contains 'response' (str), 'reasoning' (str), and 'usage'
+                with the 'input_tokens' and 'output_tokens' of the call, plus
+                the prompt cache token counts when Bedrock reports them
         """
-        raise NotImplementedError("Subclasses must implement this method")
+        formatted_messages, tokens = self._format(messages)
+        try:
+            response = self._invoke(
+                "converse",
+                tokens + max_tokens,
+                modelId=self.model_id,
+                messages=formatted_messages,
+                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
+            )
+            response_text, reasoning = read_output(response)
+            return {
+                "response": response_text,
+                "reasoning": reasoning,
+                "usage": usage_from(response)
+            }
+        except Exception as e:
+            return {"response": f"Error: {str(e)}", "reasoning": ""}
+    
+    def stream(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Stream a conversation reply from the model as it is generated.
+        
+        Uses the Converse streaming API, which has the same request and
+        event format for every Bedrock model family.
+        
+        Parameters:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            max_tokens (int): Maximum number of tokens to generate
+            temperature (float): Controls randomness (0-1)
+            
+        Yields:
+            dict: Events with a 'type' of 'reasoning', 'text' or 'error' and
+                the corresponding 'text', then a 'usage' event with the
+                'input_tokens' and 'output_tokens' of the call
+        """
+        formatted_messages, tokens = self._format(messages)
+        start = time.time()
+        try:
+            # The limiter slot is held until the stream is fully read
+            response = self.limiter.call(
+                lambda: self.client.converse_stream(
+                    modelId=self.model_id,
+                    messages=formatted_messages,
+                    inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
+                ),
+                tokens + max_tokens,
+                keep_slot=True
+            )
+        except Exception as e:
+            record_model_call(self.model_id, "converse_stream", time.time() - start, error=True)
+            yield {"type": "error", "text": f"Error: {str(e)}"}
+            return
+        
+        throttled = False
+        failed = False
+        first_token_at = None
+        usage = {}
+        try:
+            for chunk in response["stream"]:
+                if "metadata" in chunk:
+                    usage = chunk["metadata"].get("usage", {})
+                if "contentBlockDelta" not in chunk:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.time()
+                event = read_delta(chunk["contentBlockDelta"]["delta"])
+                if event is not None:
+                    yield event
+            if usage:
+                yield {"type": "usage", "input_tokens": usage.get("inputTokens"),
+                       "output_tokens": usage.get("outputTokens"), **cache_usage(usage)}
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            failed = True
+            yield {"type": "error", "text": f"Error: {str(e)}"}
+        finally:
+            self.limiter.release(throttled=throttled)
+            record_model_call(
+                self.model_id,
+                "converse_stream",
+                time.time() - start,
+                usage.get("inputTokens"),
+                usage.get("outputTokens"),
+                time_to_first_token=first_token_at - start if first_token_at is not None else None,
+                error=failed
+            )
 
 
 class DeepSeekModel(BedrockModel):
     """
     Implementation of the DeepSeek model for Amazon Bedrock.
     
-    This class handles the specific request/response formats for DeepSeek models.
+    This class handles the specific InvokeModel request/response format
+    used by generate() for DeepSeek models.
     """
     
     def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
@@ -79,69 +314,24 @@ class DeepSeekModel(BedrockModel):
         }
         
         try:
-            response = self.client.invoke_model(
+            response = self._invoke(
+                "invoke_model",
+                estimate_tokens(prompt) + max_tokens,
                 modelId=self.model_id,
                 body=json.dumps(request_body)
             )
             response_body = json.loads(response["body"].read())
             return response_body["choices"][0]["text"]
-        except (ClientError, Exception) as e:
+        except Exception as e:
             return f"Error: {str(e)}"
-    
-    def converse(self, messages, max_tokens=2000, temperature=0.3):
-        """
-        Have a conversation with the DeepSeek model.
-        
-        Parameters:
-            messages (list): List of message dictionaries with 'role' and 'content'
-            max_tokens (int): Maximum number of tokens to generate
-            temperature (float): Controls randomness (0-1)
-            
-        Returns:
-            dict: Contains 'response' (str) and 'reasoning' (str) if available
-        """
-        formatted_messages = []
-        
-        for message in messages:
-            if isinstance(message["content"], str):
-                formatted_message = {
-                    "role": message["role"],
-                    "content": [{"text": message["content"]}]
-                }
-            else:
-                formatted_message = message
-            formatted_messages.append(formatted_message)
-        
-        try:
-            response = self.client.converse(
-                modelId=self.model_id,
-                messages=formatted_messages,
-                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
-            )
-            
-            response_text = ""
-            reasoning = ""
-            
-            for item in response["output"]["message"]["content"]:
-                for key, value in item.items():
-                    if key == "reasoningContent":
-                        reasoning = value["reasoningText"]["text"]
-                    elif key == "text":
-                        response_text = value
-            
-            return {
-                "response": response_text,
-                "reasoning": reasoning
-            }
-        except (ClientError, Exception) as e:
-            return {"response": f"Error: {str(e)}", "reasoning": ""}
 
 
 class ClaudeModel(BedrockModel):
     """
     Implementation of the Claude model for Amazon Bedrock.
     
-    This class handles the specific request/response formats for Claude models.
+    This class handles the specific InvokeModel request/response format
+    used by generate() for Claude models.
     """
     
     def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
@@ -165,69 +355,24 @@ class ClaudeModel(BedrockModel):
         }
         
         try:
-            response = self.client.invoke_model(
+            response = self._invoke(
+                "invoke_model",
+                estimate_tokens(prompt) + max_tokens,
                 modelId=self.model_id,
                 body=json.dumps(request_body)
             )
             response_body = json.loads(response["body"].read())
             return response_body.get("completion", "")
-        except (ClientError, Exception) as e:
+        except Exception as e:
             return f"Error: {str(e)}"
-    
-    def converse(self, messages, max_tokens=2000, temperature=0.3):
-        """
-        Have a conversation with the Claude model.
-        
-        Parameters:
-            messages (list): List of message dictionaries with 'role' and 'content'
-            max_tokens (int): Maximum number of tokens to generate
-            temperature (float): Controls randomness (0-1)
-            
-        Returns:
-            dict: Contains 'response' (str) and 'reasoning' (str) if available
-        """
-        formatted_messages = []
-        
-        for message in messages:
-            if isinstance(message["content"], str):
-                formatted_message = {
-                    "role": message["role"],
-                    "content": [{"text": message["content"]}]
-                }
-            else:
-                formatted_message = message
-            formatted_messages.append(formatted_message)
-        
-        try:
-            response = self.client.converse(
-                modelId=self.model_id,
-                messages=formatted_messages,
-                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
-            )
-            
-            response_text = ""
-            reasoning = ""
-            
-            for item in response["output"]["message"]["content"]:
-                if "text" in item:
-                    response_text = item["text"]
-                # Check if Claude provides reasoning (uncommon but possible)
-                if "reasoningContent" in item:
-                    reasoning = item["reasoningContent"]["reasoningText"]["text"]
-            
-            return {
-                "response": response_text,
-                "reasoning": reasoning
-            }
-        except (ClientError, Exception) as e:
-            return {"response": f"Error: {str(e)}", "reasoning": ""}
 
 
 class MistralModel(BedrockModel):
     """
     Implementation of the Mistral model for Amazon Bedrock.
     
-    This class handles the specific request/response formats for Mistral models.
+    This class handles the specific InvokeModel request/response format
+    used by generate() for Mistral models.
     """
     
     def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
@@ -251,70 +396,159 @@ class MistralModel(BedrockModel):
         }
         
         try:
-            response = self.client.invoke_model(
+            response = self._invoke(
+                "invoke_model",
+                estimate_tokens(prompt) + max_tokens,
                 modelId=self.model_id,
                 body=json.dumps(request_body)
             )
             response_body = json.loads(response["body"].read())
             return response_body.get("outputs", [{}])[0].get("text", "")
-        except (ClientError, Exception) as e:
+        except Exception as e:
             return f"Error: {str(e)}"
+
+
+# Model classes by name, replaced by the "providers" section of
+# model_config.json (see providers.py). The ids to call come from
+# "model_ids", resolved through the model catalog (model_catalog.py).
+MODEL_CLASSES = {
+    "deepseek": DeepSeekModel,
+    "claude": ClaudeModel,
+    "mistral": MistralModel
+}
+
+_model_ids = {}
+
+
+def configure_registry(config, models=None):
+    """
+    Apply model_config.json settings to the shared model registry.
     
-    def converse(self, messages, max_tokens=2000, temperature=0.3):
-        """
-        Have a conversation with the Mistral model.
+    "model_ids" gives the id of each model name, the "client" section
+    overrides DEFAULT_CLIENT_SETTINGS and the "message_format" section
+    overrides DEFAULT_FORMAT_SETTINGS. The rate limiters are set up by
+    providers.py. Cached clients and models are dropped so the next
+    get_model() call uses the new settings.
+    
+    Parameters:
+        config (dict): The loaded model configuration
+        models (dict): Class name of each model name served by this
+            module, defaults to the built-in MODEL_CLASSES
+    """
+    global MODEL_CLASSES, _client_settings, _format_settings, _model_ids
+    with _registry_lock:
+        if models is not None:
+            MODEL_CLASSES = {name: globals()[class_name] for name, class_name in models.items()}
+        _model_ids = {
+            name: model_id for name, model_id in config.get("model_ids", {}).items()
+            if name in MODEL_CLASSES
+        }
+        _client_settings = {**DEFAULT_CLIENT_SETTINGS, **config.get("client", {})}
+        _format_settings = {**DEFAULT_FORMAT_SETTINGS, **config.get("message_format", {})}
+        _clients.clear()
+        _models.clear()
+
+
+def set_model_ids(model_ids):
+    """
+    Change the ids of some models, keeping the warm clients.
+    
+    Called when a model catalog refresh resolves a model to a new id.
+    
+    Parameters:
+        model_ids (dict): Model ids keyed by model name
+    """
+    global _model_ids
+    with _registry_lock:
+        changed = {
+            name for name, model_id in model_ids.items()
+            if name in MODEL_CLASSES and _model_ids.get(name) != model_id
+        }
+        if not changed:
+            return
+        _model_ids = {**_model_ids, **{name: model_ids[name] for name in changed}}
+        # Only the models whose id changed are rebuilt; the regional clients
+        # and the other models, with their limiters, are kept
+        for key in [key for key in _models if key[0] in changed]:
+            del _models[key]
+
+
+def get_model_id(model_name):
+    """Return the id configured for a model name, or None"""
+    return _model_ids.get(model_name)
+
+
+def set_client_factory(factory):
+    """
+    Replace the way bedrock-runtime clients are built.
+    
+    Used by the benchmarks to run against a local stand-in for Bedrock.
+    Cached clients and models are dropped.
+    
+    Parameters:
+        factory (callable): Called with (region_name, botocore Config) and
+            returning a client, or None to build real boto3 clients
+    """
+    global _client_factory
+    with _registry_lock:
+        _client_factory = factory
+        _clients.clear()
+        _models.clear()
+
+
+def get_client(region_name="us-east-1"):
+    """
+    Return the shared bedrock-runtime client for a region.
+    
+    boto3 clients are thread-safe, so a single client (and its connection
+    pool) is built once per region and shared by every model and request
+    thread.
+    
+    Parameters:
+        region_name (str): AWS region of the client
         
-        Parameters:
-            messages (list): List of message dictionaries with 'role' and 'content'
-            max_tokens (int): Maximum number of tokens to generate
-            temperature (float): Controls randomness (0-1)
+    Returns:
+        botocore.client.BaseClient: The bedrock-runtime client
+    """
+    client = _clients.get(region_name)
+    if client is not None:
+        return client
+    
+    global _session
+    with _registry_lock:
+        client = _clients.get(region_name)
+        if client is None:
+            # Imported on first use so that loading the module stays cheap
+            import boto3
+            from botocore.config import Config
             
-        Returns:
-            dict: Contains 'response' (str) and 'reasoning' (str) if available
-        """
-        formatted_messages = []
-        
-        for message in messages:
-            if isinstance(message["content"], str):
-                formatted_message = {
-                    "role": message["role"],
-                    "content": [{"text": message["content"]}]
-                }
-            else:
-                formatted_message = message
-            formatted_messages.append(formatted_message)
-        
-        try:
-            response = self.client.converse(
-                modelId=self.model_id,
-                messages=formatted_messages,
-                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
+            settings = _client_settings
+            config = Config(
+                max_pool_connections=settings["max_pool_connections"],
+                connect_timeout=settings["connect_timeout"],
+                read_timeout=settings["read_timeout"],
+                tcp_keepalive=settings["tcp_keepalive"],
+                retries={"max_attempts": settings["max_attempts"], "mode": "standard"}
             )
-            
-            response_text = ""
-            reasoning = ""
-            
-            for item in response["output"]["message"]["content"]:
-                if "text" in item:
-                    response_text = item["text"]
-                # Check if Mistral provides reasoning
-                if "reasoningContent" in item:
-                    reasoning = item["reasoningContent"]["reasoningText"]["text"]
-            
-            return {
-                "response": response_text,
-                "reasoning": reasoning
-            }
-        except (ClientError, Exception) as e:
-            return {"response": f"Error: {str(e)}", "reasoning": ""}
+            if _client_factory is not None:
+                client = _client_factory(region_name, config)
+            else:
+                # boto3.client() goes through the default session, which is not
+                # safe to use from several threads, so use a dedicated one
+                if _session is None:
+                    _session = boto3.session.Session()
+                client = _session.client("bedrock-runtime", region_name=region_name, config=config)
+            _clients[region_name] = client
+    return client
 
 
 def get_model(model_name, region_name="us-east-1"):
     """
-    Factory function to create the appropriate model instance.
+    Return the shared instance of the requested model.
     
-    This function creates and returns an instance of the requested model class
-    based on the model name provided.
+    Instances are created on first use and cached per (model, region), so
+    repeated calls reuse the same object and its warm client. The response
+    cache is applied on top by providers.get_model().
     
     Parameters:
         model_name (str): Name of the model to create ('deepseek', 'claude', or 'mistral')
@@ -326,23 +560,43 @@ def get_model(model_name, region_name="us-east-1"):
     Raises:
         ValueError: If the model name is not recognized
     """
-    model_map = {
-        "deepseek": {
-            "class": DeepSeekModel,
-            "id": "us.deepseek.r1-v1:0"
-        },
-        "claude": {
-            "class": ClaudeModel,
-            "id": "anthropic.claude-3-haiku-20240307-v1:0"
-        },
-        "mistral": {
-            "class": MistralModel,
-            "id": "mistral.mistral-large-2402-v1:0"
-        }
-    }
+    key = (model_name, region_name)
+    model = _models.get(key)
+    if model is not None:
+        return model
     
-    if model_name not in model_map:
+    if model_name not in MODEL_CLASSES or model_name not in _model_ids:
         raise ValueError(f"Unknown model: {model_name}")
     
-    model_info = model_map[model_name]
-    return model_info["class"](model_info["id"], region_name)
\ No newline at end of file
+    client = get_client(region_name)
+    with _registry_lock:
+        model = _models.get(key)
+        if model is None:
+            model_id = _model_ids[model_name]
+            model = MODEL_CLASSES[model_name](
+                model_id, region_name, client=client,
+                cache_point_tokens=cache_point_tokens(_format_settings, model_name, model_id)
+            )
+            _models[key] = model
+    return model
+
+
+def warm_models(model_names, region_name="us-east-1"):
+    """
+    Build the clients and model instances ahead of the first request.
+    
+    Parameters:
+        model_names (list): Names of the models to prepare
+        region_name (str): AWS region where the models are available
+        
+    Returns:
+        list: Names of the models that could not be prepared
+    """
+    failed = []
+    for model_name in model_names:
+        try:
+            get_model(model_name, region_name)
+        except Exception as e:
+            print(f"Could not warm model {model_name}: {e}")
+            failed.append(model_name)
+    return failed
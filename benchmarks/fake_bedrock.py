@@ -0,0 +1,137 @@
+import io
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class FakeBedrockRuntime:
+    """
+    Local stand-in for the bedrock-runtime client.
+
+    Implements converse, converse_stream and invoke_model with the same
+    response shapes as Bedrock. Each call waits `latency` seconds before the
+    first token, then produces tokens at `tokens_per_second`; a fraction
+    `throttle_rate` of calls fails with a ThrottlingException.
+    """
+
+    def __init__(self, latency=0.2, tokens_per_second=50, output_tokens=100, throttle_rate=0.0,
+                 chunk_tokens=4, seed=None):
+        """
+        Create a fake runtime.
+
+        Parameters:
+            latency (float): Seconds before the first token
+            tokens_per_second (float): Generation speed, 0 for instant
+            output_tokens (int): Tokens per reply, capped by the call's maxTokens
+            throttle_rate (float): Probability (0-1) that a call is throttled
+            chunk_tokens (int): Tokens per streamed chunk
+            seed (int): Seed of the random generator, for repeatable runs
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.throttle_rate = throttle_rate
+        self.chunk_tokens = chunk_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    def _start_call(self, operation):
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                operation
+            )
+
+    def _generation_time(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _count_output(self, max_tokens):
+        return min(self.output_tokens, max_tokens) if max_tokens else self.output_tokens
+
+    @staticmethod
+    def _count_input(messages):
+        text = "".join(block.get("text", "") for m in messages for block in m["content"])
+        return max(1, len(text) // 4)
+
+    def converse(self, modelId, messages, inferenceConfig=None, **kwargs):
+        self._start_call("Converse")
+        output_tokens = self._count_output((inferenceConfig or {}).get("maxTokens"))
+        time.sleep(self.latency + self._generation_time(output_tokens))
+
+        content = [{"text": "token " * output_tokens}]
+        if "deepseek" in modelId:
+            content.insert(0, {"reasoningContent": {"reasoningText": {"text": "thinking " * 10}}})
+        return {
+            "output": {"message": {"role": "assistant", "content": content}},
+            "stopReason": "end_turn",
+            "usage": {
+                "inputTokens": self._count_input(messages),
+                "outputTokens": output_tokens,
+                "totalTokens": self._count_input(messages) + output_tokens
+            }
+        }
+
+    def converse_stream(self, modelId, messages, inferenceConfig=None, **kwargs):
+        self._start_call("ConverseStream")
+        output_tokens = self._count_output((inferenceConfig or {}).get("maxTokens"))
+        input_tokens = self._count_input(messages)
+
+        def events():
+            yield {"messageStart": {"role": "assistant"}}
+            time.sleep(self.latency)
+            if "deepseek" in modelId:
+                yield {"contentBlockDelta": {"delta": {"reasoningContent": {"text": "thinking "}}, "contentBlockIndex": 0}}
+            remaining = output_tokens
+            while remaining > 0:
+                tokens = min(self.chunk_tokens, remaining)
+                time.sleep(self._generation_time(tokens))
+                yield {"contentBlockDelta": {"delta": {"text": "token " * tokens}, "contentBlockIndex": 1}}
+                remaining -= tokens
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            yield {"metadata": {
+                "usage": {"inputTokens": input_tokens, "outputTokens": output_tokens,
+                          "totalTokens": input_tokens + output_tokens},
+                "metrics": {"latencyMs": int(self.latency * 1000)}
+            }}
+
+        return {"stream": events()}
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._start_call("InvokeModel")
+        request = json.loads(body)
+        output_tokens = self._count_output(request.get("max_tokens") or request.get("max_tokens_to_sample"))
+        time.sleep(self.latency + self._generation_time(output_tokens))
+
+        text = "token " * output_tokens
+        # One body that satisfies the DeepSeek, Claude and Mistral parsers
+        response_body = {"choices": [{"text": text}], "completion": text, "outputs": [{"text": text}]}
+        return {
+            "body": io.BytesIO(json.dumps(response_body).encode("utf-8")),
+            "ResponseMetadata": {"HTTPHeaders": {
+                "x-amzn-bedrock-input-token-count": str(max(1, len(request.get("prompt", "")) // 4)),
+                "x-amzn-bedrock-output-token-count": str(output_tokens)
+            }}
+        }
+
+
+def fake_client_factory(**settings):
+    """
+    Build a client factory for bedrock_models.set_client_factory().
+
+    Parameters:
+        **settings: Arguments of FakeBedrockRuntime
+
+    Returns:
+        callable: Factory returning one FakeBedrockRuntime per region
+    """
+    return lambda region_name, config: FakeBedrockRuntime(**settings)
@@ -0,0 +1,663 @@
+"""
+Load generator replaying a JSONL trace of API calls over HTTP.
+
+Each trace line is one call:
+
+    {"at": 1.5, "method": "POST", "path": "/send", "conversation": "s12",
+     "body": {"message": "Hello", "model": "claude"}}
+
+'at' is the arrival time in seconds from the start of the trace. Calls
+with the same 'conversation' belong to one session: the replay gives the
+session a fresh conversation id, set as the body's 'conversation_id' and
+substituted for '{conversation}' in the path.
+
+A trace is generated with a mix of conversation lengths and endpoints, or
+built from a conversation export (GET /conversations/export):
+
+    python benchmarks/replay.py generate trace.jsonl --sessions 200 --lengths 1:5,5:3,20:1
+    python benchmarks/replay.py from-export export.ndjson trace.jsonl
+
+and replayed against a running app, or against an app started in this
+process on FakeBedrockRuntime, either open-loop (calls arrive at the trace
+times or at a fixed rate, whatever the app's latency) or closed-loop (a
+fixed number of users each replaying sessions, one call at a time):
+
+    python benchmarks/replay.py run trace.jsonl --url http://127.0.0.1:5000 --rates 5,10,20
+    python benchmarks/replay.py run trace.jsonl --local --mode closed --concurrency 1,4,16,64
+
+Each level reports throughput, error rate, latency percentiles and a
+latency histogram, and the first level where the app saturates.
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from run import load_app, percentile  # noqa: E402
+
+# Upper bounds of the latency histogram, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Calls of each endpoint kind in generated traces
+ENDPOINTS = {
+    "send": ("POST", "/send"),
+    "stream": ("POST", "/send/stream"),
+    "compare": ("POST", "/compare"),
+    "list": ("GET", "/conversations?limit=50"),
+    "history": ("GET", "/conversations/{conversation}/messages?limit=50")
+}
+
+WORDS = ("model", "latency", "token", "region", "cache", "stream", "prompt", "reply", "budget", "route")
+
+
+def parse_weights(text, convert=str):
+    """
+    Parse 'value:weight' pairs such as '1:5,5:3,20:1' or 'send=0.8,list=0.2'.
+
+    Returns:
+        tuple: (values, weights)
+    """
+    values, weights = [], []
+    for item in text.split(","):
+        value, _, weight = item.replace("=", ":").partition(":")
+        values.append(convert(value))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+def generate_trace(sessions=100, lengths="1:5,5:3,20:1", mix="send=0.8,stream=0.1,list=0.05,history=0.05",
+                   models="claude", compare_models="claude,mistral", rate=2.0, think=5.0, words=30, seed=1):
+    """
+    Build a synthetic trace.
+
+    Sessions start as a Poisson process of `rate` sessions per second. Each
+    has a number of turns drawn from `lengths`, separated by exponentially
+    distributed think times, and each turn calls an endpoint drawn from `mix`.
+
+    Parameters:
+        sessions (int): Number of sessions
+        lengths (str): Weighted turns per session, e.g. '1:5,5:3,20:1'
+        mix (str): Weighted endpoint kinds, from the keys of ENDPOINTS
+        models (str): Comma-separated models, picked at random per session
+        compare_models (str): Comma-separated models of the /compare calls
+        rate (float): Sessions started per second
+        think (float): Mean seconds between the turns of a session
+        words (int): Mean words per message
+        seed (int): Seed of the random generator
+
+    Returns:
+        list: Trace entries sorted by arrival time
+    """
+    rng = random.Random(seed)
+    turn_counts, turn_weights = parse_weights(lengths, int)
+    kinds, kind_weights = parse_weights(mix)
+    unknown = [kind for kind in kinds if kind not in ENDPOINTS]
+    if unknown:
+        raise ValueError(f"Unknown endpoint kinds: {', '.join(unknown)}")
+    model_names = models.split(",")
+
+    entries = []
+    start = 0.0
+    for session in range(sessions):
+        start += rng.expovariate(rate)
+        at = start
+        model = rng.choice(model_names)
+        for turn in range(rng.choices(turn_counts, turn_weights)[0]):
+            if turn:
+                at += rng.expovariate(1 / think) if think else 0.0
+            kind = rng.choices(kinds, kind_weights)[0]
+            if turn == 0 and kind == "history":
+                # A conversation is read only once it exists
+                kind = "send"
+            method, path = ENDPOINTS[kind]
+            entry = {"at": round(at, 3), "method": method, "path": path, "conversation": f"s{session}"}
+            if method == "POST":
+                text = " ".join(rng.choice(WORDS) for _ in range(max(1, int(rng.expovariate(1 / words)))))
+                entry["body"] = {"message": f"Session {session} turn {turn}: {text}", "model": model}
+                if kind == "compare":
+                    entry["body"] = {"message": entry["body"]["message"], "models": compare_models.split(",")}
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry["at"])
+    return entries
+
+
+def trace_from_export(path, think=5.0):
+    """
+    Build a trace from a conversation export, one call per user message.
+
+    A user message answered by one model becomes a /send call and one
+    answered by several models a /compare call. The arrival time of a call
+    is the time its first reply was requested (the usage time minus its
+    latency); calls without usage come `think` seconds after the previous
+    call of their conversation.
+
+    Parameters:
+        path (str): NDJSON export file, gzipped if it ends with .gz
+        think (float): Seconds between calls of unknown time
+
+    Returns:
+        list: Trace entries sorted by arrival time
+    """
+    entries = []
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = record.get("messages", [])
+            replies = {}
+            for message in messages:
+                if message.get("reply_to") is not None:
+                    replies.setdefault(message["reply_to"], []).append(message)
+            at = None
+            for index, message in enumerate(messages):
+                if message["role"] != "user":
+                    continue
+                answers = replies.get(index, [])
+                times = [
+                    answer["usage"]["created_at"] - (answer["usage"].get("latency_ms") or 0) / 1000
+                    for answer in answers if answer.get("usage")
+                ]
+                at = min(times) if times else (at + think if at is not None else None)
+                models = [answer.get("model") or record.get("model") for answer in answers]
+                body = {"message": message["content"]}
+                if len(models) > 1:
+                    body["models"] = models
+                    endpoint = "/compare"
+                else:
+                    body["model"] = models[0] if models else record.get("model")
+                    endpoint = "/send"
+                entries.append({"at": at, "method": "POST", "path": endpoint, "conversation": record["id"],
+                                "body": body})
+
+    # Conversations without any usage start with the earliest known time
+    known = [entry["at"] for entry in entries if entry["at"] is not None]
+    origin = min(known) if known else 0.0
+    for entry in entries:
+        entry["at"] = round((entry["at"] if entry["at"] is not None else origin) - origin, 3)
+    entries.sort(key=lambda entry: entry["at"])
+    return entries
+
+
+def read_trace(path):
+    """Read the entries of a JSONL trace, sorted by arrival time"""
+    entries = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {line_number}: invalid JSON")
+            if "path" not in entry:
+                raise ValueError(f"Line {line_number}: missing 'path'")
+            entry.setdefault("at", 0.0)
+            entry.setdefault("method", "POST" if "body" in entry else "GET")
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry["at"])
+    return entries
+
+
+def write_trace(path, entries):
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def endpoint_of(entry):
+    """Label of an entry's endpoint, e.g. 'GET /conversations/{conversation}/messages'"""
+    return f"{entry['method']} {entry['path'].split('?')[0]}"
+
+
+class Target:
+    """
+    HTTP client of the app under test.
+
+    Each thread keeps its own connection, which is reopened after an error.
+    """
+
+    def __init__(self, url, timeout=300):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def call(self, entry, prefix):
+        """
+        Make the call of one trace entry.
+
+        Parameters:
+            entry (dict): The trace entry
+            prefix (str): Prefix of the conversation ids of this run
+
+        Returns:
+            dict: 'endpoint', 'status', 'error' (None on success), 'ttfb' and
+                'duration' in seconds
+        """
+        path = entry["path"]
+        body = entry.get("body")
+        if entry.get("conversation") is not None:
+            conversation_id = f"{prefix}-{entry['conversation']}"
+            path = path.replace("{conversation}", conversation_id)
+            if isinstance(body, dict):
+                body = {**body, "conversation_id": conversation_id}
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+
+        result = {"endpoint": endpoint_of(entry), "status": None, "error": None, "ttfb": None}
+        start = time.perf_counter()
+        try:
+            connection = self._connection()
+            connection.request(entry["method"], path, body=payload, headers=headers)
+            response = connection.getresponse()
+            result["ttfb"] = time.perf_counter() - start
+            content = response.read()
+            result["status"] = response.status
+            result["error"] = response_error(response.status, response.getheader("Content-Type", ""), content)
+        except Exception as e:
+            self._local.connection = None
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["duration"] = time.perf_counter() - start
+        return result
+
+
+def response_error(status, content_type, content):
+    """
+    Tell whether a response reports a failure.
+
+    Model failures are returned with a 200 status and an 'Error:' reply, or
+    as an 'error' event of a stream, so the body is checked too.
+
+    Returns:
+        str: Description of the error, or None
+    """
+    if status >= 400:
+        return f"HTTP {status}"
+    if "text/event-stream" in content_type:
+        return "stream error event" if b"event: error" in content else None
+    if "application/json" not in content_type:
+        return None
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return "invalid JSON"
+    if not isinstance(data, dict):
+        return None
+    replies = [data] + [item for item in data.get("results", []) if isinstance(item, dict)]
+    for reply in replies:
+        if str(reply.get("response", "")).startswith("Error:"):
+            return "model error"
+    return "error" if "error" in data else None
+
+
+def run_open(target, entries, prefix, rate=None, speed=1.0, max_in_flight=256, seed=1):
+    """
+    Replay a trace open-loop.
+
+    Calls are issued at their arrival time whether or not earlier calls
+    have completed, so a slow app builds a backlog instead of slowing the
+    load down. The latency of a call is measured from its arrival time, so
+    the time spent waiting for a free client thread is included.
+
+    Parameters:
+        target (Target): The app under test
+        entries (list): Trace entries sorted by arrival time
+        prefix (str): Prefix of the conversation ids of this run
+        rate (float): Calls per second with Poisson arrivals, None to keep
+            the trace times
+        speed (float): Speed-up of the trace times when rate is None
+        max_in_flight (int): Client threads
+        seed (int): Seed of the Poisson arrivals
+
+    Returns:
+        tuple: (results, wall time in seconds, offered calls per second)
+    """
+    if rate:
+        rng = random.Random(seed)
+        arrivals, at = [], 0.0
+        for _ in entries:
+            at += rng.expovariate(rate)
+            arrivals.append(at)
+    else:
+        arrivals = [entry["at"] / speed for entry in entries]
+    span = arrivals[-1] - arrivals[0] if len(arrivals) > 1 else 0.0
+    offered = rate or (len(entries) / span if span else None)
+
+    results = []
+    lock = threading.Lock()
+
+    def task(entry, scheduled):
+        result = target.call(entry, prefix)
+        result["latency"] = time.perf_counter() - scheduled
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="replay") as executor:
+        for entry, arrival in zip(entries, arrivals):
+            scheduled = start + arrival - arrivals[0]
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(task, entry, scheduled)
+    return results, time.perf_counter() - start, offered
+
+
+def run_closed(target, entries, prefix, concurrency, think=0.0):
+    """
+    Replay a trace closed-loop.
+
+    `concurrency` users each take the next session and make its calls one
+    after the other, waiting `think` seconds between calls, until every
+    session is done. The load adapts to the app: a slower app gets fewer
+    calls per second.
+
+    Parameters:
+        target (Target): The app under test
+        entries (list): Trace entries sorted by arrival time
+        prefix (str): Prefix of the conversation ids of this run
+        concurrency (int): Number of users
+        think (float): Seconds between the calls of a user
+
+    Returns:
+        tuple: (results, wall time in seconds, None)
+    """
+    sessions = {}
+    for index, entry in enumerate(entries):
+        key = entry.get("conversation")
+        sessions.setdefault(key if key is not None else ("call", index), []).append(entry)
+    pending = iter(list(sessions.values()))
+    results = []
+    lock = threading.Lock()
+
+    def user():
+        while True:
+            with lock:
+                session = next(pending, None)
+            if session is None:
+                return
+            for entry in session:
+                result = target.call(entry, prefix)
+                result["latency"] = result["duration"]
+                with lock:
+                    results.append(result)
+                if think:
+                    time.sleep(think)
+
+    threads = [threading.Thread(target=user) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start, None
+
+
+def histogram(latencies_ms):
+    """Count the latencies in LATENCY_BUCKETS_MS, the last count being the overflow"""
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for value in latencies_ms:
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if value <= bound), len(LATENCY_BUCKETS_MS))
+        counts[index] += 1
+    return counts
+
+
+def latency_summary(results):
+    latencies = [result["latency"] * 1000 for result in results]
+    ttfbs = [result["ttfb"] * 1000 for result in results if result["ttfb"] is not None]
+    errors = sum(1 for result in results if result["error"])
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p90_ms": round(percentile(latencies, 0.90), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        "mean_ttfb_ms": round(statistics.fmean(ttfbs), 2) if ttfbs else 0.0
+    }
+
+
+def summarize_level(results, wall_time, offered):
+    """Build the report of one load level, overall and per endpoint"""
+    summary = latency_summary(results)
+    summary["throughput"] = round(len(results) / wall_time, 2) if wall_time else 0.0
+    summary["offered"] = round(offered, 2) if offered else None
+    summary["histogram"] = histogram([result["latency"] * 1000 for result in results])
+    errors = {}
+    endpoints = {}
+    for result in results:
+        endpoints.setdefault(result["endpoint"], []).append(result)
+        if result["error"]:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+    summary["errors_by_kind"] = errors
+    summary["endpoints"] = {name: latency_summary(items) for name, items in sorted(endpoints.items())}
+    return summary
+
+
+def find_saturation(levels, mode, max_error_rate=0.01, slo_ms=None, min_gain=0.1):
+    """
+    Find the first level at which the app is saturated.
+
+    A level is saturated when its error rate exceeds max_error_rate, when its
+    p99 latency exceeds slo_ms, and, open-loop, when the app completes less
+    than 90% of the offered calls per second or, closed-loop, when the
+    throughput grew by less than min_gain over the previous level.
+
+    Parameters:
+        levels (dict): Level reports keyed by rate or concurrency, in order
+        mode (str): 'open' or 'closed'
+
+    Returns:
+        dict: 'level' and 'reason', or None if no level is saturated
+    """
+    previous = None
+    for level, summary in levels.items():
+        if summary["error_rate"] > max_error_rate:
+            return {"level": level, "reason": f"error rate {summary['error_rate']:.1%}"}
+        if slo_ms is not None and summary["p99_ms"] > slo_ms:
+            return {"level": level, "reason": f"p99 {summary['p99_ms']} ms over {slo_ms} ms"}
+        if mode == "open" and summary["offered"] and summary["throughput"] < 0.9 * summary["offered"]:
+            return {"level": level, "reason": f"{summary['throughput']} of {summary['offered']} req/s completed"}
+        if mode == "closed" and previous and summary["throughput"] < previous["throughput"] * (1 + min_gain):
+            return {"level": level, "reason": f"throughput {previous['throughput']} -> {summary['throughput']} req/s"}
+        previous = summary
+    return None
+
+
+def print_report(report):
+    unit = "rate" if report["mode"] == "open" else "users"
+    print(f"{report['mode']}-loop replay of {report['trace']} ({report['calls']} calls) against {report['url']}")
+    for level, summary in report["levels"].items():
+        offered = f" of {summary['offered']}" if summary["offered"] else ""
+        print(f"\n{unit} {level}: {summary['throughput']}{offered} req/s, "
+              f"{summary['errors']} errors ({summary['error_rate']:.1%}), "
+              f"p50 {summary['p50_ms']} ms, p90 {summary['p90_ms']} ms, p99 {summary['p99_ms']} ms, "
+              f"max {summary['max_ms']} ms")
+        for error, count in summary["errors_by_kind"].items():
+            print(f"  error {error}: {count}")
+        print(f"  {'endpoint':<50} {'calls':>6} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'ttfb ms':>9}")
+        for name, entry in summary["endpoints"].items():
+            print(f"  {name:<50} {entry['requests']:>6} {entry['errors']:>7} {entry['p50_ms']:>9} "
+                  f"{entry['p99_ms']:>9} {entry['mean_ttfb_ms']:>9}")
+        total = max(1, summary["requests"])
+        widest = max(summary["histogram"]) or 1
+        for bound, count in zip((*LATENCY_BUCKETS_MS, "+Inf"), summary["histogram"]):
+            if count:
+                bar = "#" * max(1, round(count / widest * 40))
+                print(f"  <= {bound:>6} ms {count:>6} {count / total:>6.1%} {bar}")
+    saturation = report["saturation"]
+    if saturation:
+        print(f"\nsaturated at {unit} {saturation['level']}: {saturation['reason']}")
+    else:
+        print("\nno saturation within the levels tested")
+
+
+def start_local_app(fake_settings):
+    """
+    Serve the app from this process on FakeBedrockRuntime.
+
+    The app runs in a scratch directory (see run.load_app) behind a threaded
+    HTTP server on a free port, so the calls go through the same HTTP, Flask,
+    storage and model layers as in production.
+
+    Returns:
+        tuple: (base URL, cleanup function)
+    """
+    from werkzeug.serving import make_server
+
+    # One access log line per call would slow the server down
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="playground-replay-")
+    app_module = load_app(workdir, fake_settings)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def cleanup():
+        server.shutdown()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return f"http://127.0.0.1:{server.server_port}", cleanup
+
+
+def run_replay(args):
+    entries = read_trace(args.trace)
+    if not entries:
+        raise SystemExit(f"{args.trace} has no calls")
+    # The local app runs in a scratch directory, so resolve the paths first
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    cleanup = None
+    url = args.url
+    if args.local:
+        url, cleanup = start_local_app({
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "output_tokens": args.output_tokens,
+            "throttle_rate": args.throttle_rate,
+            "seed": args.seed
+        })
+    target = Target(url, timeout=args.timeout)
+    run_id = uuid.uuid4().hex[:8]
+    levels = {}
+    try:
+        if args.mode == "open":
+            rates = [float(value) for value in args.rates.split(",")] if args.rates else [None]
+            for rate in rates:
+                level = "trace" if rate is None else f"{rate:g}"
+                results, wall_time, offered = run_open(
+                    target, entries, f"replay-{run_id}-{level}", rate, args.speed, args.max_in_flight, args.seed
+                )
+                levels[level] = summarize_level(results, wall_time, offered)
+        else:
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                results, wall_time, offered = run_closed(
+                    target, entries, f"replay-{run_id}-{concurrency}", concurrency, args.think
+                )
+                levels[str(concurrency)] = summarize_level(results, wall_time, offered)
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    report = {
+        "mode": args.mode,
+        "trace": args.trace,
+        "calls": len(entries),
+        "url": "local fake backend" if args.local else url,
+        "levels": levels,
+        "saturation": find_saturation(levels, args.mode, args.max_error_rate, args.slo_ms)
+    }
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a JSONL trace of API calls against the app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write a synthetic trace")
+    generate.add_argument("output", help="Trace file to write")
+    generate.add_argument("--sessions", type=int, default=100, help="Number of conversations")
+    generate.add_argument("--lengths", default="1:5,5:3,20:1", help="Weighted turns per conversation")
+    generate.add_argument("--mix", default="send=0.8,stream=0.1,list=0.05,history=0.05",
+                          help=f"Weighted endpoint kinds among {', '.join(ENDPOINTS)}")
+    generate.add_argument("--models", default="claude", help="Comma-separated models of the conversations")
+    generate.add_argument("--compare-models", default="claude,mistral", help="Models of the /compare calls")
+    generate.add_argument("--rate", type=float, default=2.0, help="Conversations started per second")
+    generate.add_argument("--think", type=float, default=5.0, help="Mean seconds between turns")
+    generate.add_argument("--words", type=int, default=30, help="Mean words per message")
+    generate.add_argument("--seed", type=int, default=1, help="Seed of the random generator")
+
+    export = commands.add_parser("from-export", help="Build a trace from a conversation export")
+    export.add_argument("export", help="NDJSON export of GET /conversations/export (.gz if gzipped)")
+    export.add_argument("output", help="Trace file to write")
+    export.add_argument("--think", type=float, default=5.0, help="Seconds between calls of unknown time")
+
+    replay = commands.add_parser("run", help="Replay a trace")
+    replay.add_argument("trace", help="Trace file")
+    replay.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the running app")
+    replay.add_argument("--local", action="store_true", help="Serve the app from this process on the fake backend")
+    replay.add_argument("--mode", choices=("open", "closed"), default="open", help="Open or closed loop")
+    replay.add_argument("--rates", help="Open loop: comma-separated calls per second, default the trace times")
+    replay.add_argument("--speed", type=float, default=1.0, help="Open loop: speed-up of the trace times")
+    replay.add_argument("--max-in-flight", type=int, default=256, help="Open loop: client threads")
+    replay.add_argument("--concurrency", default="1,4,16", help="Closed loop: comma-separated user counts")
+    replay.add_argument("--think", type=float, default=0.0, help="Closed loop: seconds between calls of a user")
+    replay.add_argument("--timeout", type=float, default=300, help="Seconds to wait for a response")
+    replay.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate of a saturated level")
+    replay.add_argument("--slo-ms", type=float, help="p99 latency of a saturated level")
+    replay.add_argument("--latency", type=float, default=0.05, help="Fake time to first token (s)")
+    replay.add_argument("--tokens-per-second", type=float, default=500, help="Fake generation speed")
+    replay.add_argument("--output-tokens", type=int, default=100, help="Fake reply length in tokens")
+    replay.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of throttled calls")
+    replay.add_argument("--seed", type=int, default=1, help="Seed of the fake runtime and the arrivals")
+    replay.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        entries = generate_trace(args.sessions, args.lengths, args.mix, args.models, args.compare_models,
+                                 args.rate, args.think, args.words, args.seed)
+        write_trace(args.output, entries)
+        print(f"Wrote {len(entries)} calls of {args.sessions} conversations to {args.output}")
+    elif args.command == "from-export":
+        entries = trace_from_export(args.export, args.think)
+        write_trace(args.output, entries)
+        print(f"Wrote {len(entries)} calls to {args.output}")
+    else:
+        run_replay(args)
+
+
+if __name__ == "__main__":
+    main()
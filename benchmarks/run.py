@@ -0,0 +1,294 @@
+"""
+Offline benchmarks for the playground.
+
+Runs the Flask app against FakeBedrockRuntime, so no network or AWS
+credentials are needed, and measures /send and /send/stream at several
+concurrency levels plus microbenchmarks of the storage, context and model
+layers. Results can be saved as JSON and compared with a previous run:
+
+    python benchmarks/run.py --json results.json
+    python benchmarks/run.py --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_bedrock import FakeBedrockRuntime, fake_client_factory  # noqa: E402
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of the sorted values fall"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, wall_time, errors=0):
+    """Build the result entry of a load benchmark"""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / wall_time, 2) if wall_time else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0
+    }
+
+
+def load_app(workdir, fake_settings):
+    """
+    Import the app in a scratch directory with the fake runtime installed.
+
+    The app reads model_config.json and writes conversations.db in the
+    current directory, so it is imported from a copy of the config in
+    `workdir`, with the catalog refresh turned off. The response cache,
+    call coalescing and routing are turned off too, so every request goes
+    through the whole path down to the model instead of being answered by
+    an earlier identical one.
+    """
+    with open(os.path.join(REPO_DIR, "model_config.json"), 'r') as f:
+        config = json.load(f)
+    # The catalog refresh would call the Bedrock control plane
+    config.setdefault("catalog", {})["auto_refresh"] = False
+    for section in ("cache", "coalesce", "routing"):
+        config.setdefault(section, {})["enabled"] = False
+    with open(os.path.join(workdir, "model_config.json"), 'w') as f:
+        json.dump(config, f)
+    os.chdir(workdir)
+
+    import bedrock_models
+    bedrock_models.set_client_factory(fake_client_factory(**fake_settings))
+    import app
+    return app
+
+
+def run_load(app_module, endpoint, concurrency, total_requests, model, history):
+    """
+    Send `total_requests` requests from `concurrency` threads.
+
+    Each thread owns its conversations; `history` user turns are sent to a
+    conversation before moving to the next one, so later requests carry
+    longer histories. For /send/stream the latency is the time to the
+    first streamed token. The prompts carry a nonce of the run, so no two
+    runs send the same request.
+    """
+    nonce = uuid.uuid4().hex[:8]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker(worker_id):
+        client = app_module.app.test_client()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            conversation_id = f"bench-{endpoint.strip('/').replace('/', '-')}-{concurrency}-{worker_id}-{index // history}"
+            body = {"conversation_id": conversation_id, "message": f"Question {index} ({nonce})", "model": model}
+            start = time.perf_counter()
+            if endpoint == "/send/stream":
+                response = client.post(endpoint, json=body, buffered=False)
+                first = None
+                for chunk in response.response:
+                    if first is None and b"event: text" in chunk:
+                        first = time.perf_counter()
+                latency = (first or time.perf_counter()) - start
+                ok = response.status_code == 200
+            else:
+                response = client.post(endpoint, json=body)
+                latency = time.perf_counter() - start
+                ok = response.status_code == 200 and not response.json["response"].startswith("Error:")
+            with lock:
+                latencies.append(latency)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def check_uncached():
+    """Fail the run if any request was answered by the response cache or a coalesced call"""
+    import providers
+
+    hits = providers.response_cache.stats()["hits"] if providers.response_cache is not None else 0
+    coalesced = providers.single_flight.stats()["coalesced"] if providers.single_flight is not None else 0
+    if hits or coalesced:
+        raise RuntimeError(f"{hits} cache hits and {coalesced} coalesced calls: the load results are not valid")
+
+
+def time_operation(fn, iterations):
+    """Return the mean duration of fn() in microseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 2)
+
+
+def run_micro(app_module, iterations):
+    """Microbenchmarks of the storage, context and model layers"""
+    import bedrock_models
+    import providers
+    from context_window import fit_context
+    from conversation_store import ConversationStore
+
+    results = {}
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": "word " * 200}
+        for i in range(200)
+    ]
+
+    store = ConversationStore(os.path.join(os.getcwd(), "micro.db"))
+    store.create("micro", {"title": "micro"})
+    results["store_append_message_us"] = time_operation(
+        lambda: store.append_message("micro", "user", "hello " * 50, updated_at="2024-01-01 00:00:00"),
+        iterations
+    )
+    results["store_get_messages_us"] = time_operation(lambda: store.get_messages("micro"), max(1, iterations // 10))
+    results["fit_context_200_messages_us"] = time_operation(lambda: fit_context(history, 16000), iterations)
+
+    instant = FakeBedrockRuntime(latency=0, tokens_per_second=0, output_tokens=10)
+    model = bedrock_models.ClaudeModel("anthropic.claude-3-haiku-20240307-v1:0", client=instant)
+    results["converse_format_200_messages_us"] = time_operation(
+        lambda: model.converse(history, temperature=0), iterations
+    )
+    results["get_model_cached_us"] = time_operation(
+        lambda: providers.get_model("claude", app_module.model_config["region"]), iterations
+    )
+    results["model_construction_us"] = time_operation(
+        lambda: bedrock_models.ClaudeModel("anthropic.claude-3-haiku-20240307-v1:0", client=instant),
+        iterations
+    )
+    try:
+        import boto3
+        results["boto3_client_construction_us"] = time_operation(
+            lambda: boto3.session.Session().client("bedrock-runtime", region_name="us-east-1"),
+            max(1, iterations // 100)
+        )
+    except Exception as e:
+        print(f"Skipping boto3 client construction: {e}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results, baseline=None):
+    """Print the results, with the relative change against a baseline run"""
+    def change(path, value):
+        base = baseline
+        for key in path:
+            base = base.get(key) if isinstance(base, dict) else None
+        if not isinstance(base, (int, float)) or not base:
+            return ""
+        return f" ({(value - base) / base * 100:+.1f}%)"
+
+    print(f"commit {results['commit']}  python {results['python']}")
+    for name, levels in results["load"].items():
+        print(f"\n{name}")
+        print(f"{'concurrency':>11} {'req/s':>14} {'p50 ms':>16} {'p99 ms':>16} {'errors':>7}")
+        for level, entry in levels.items():
+            print(
+                f"{level:>11} "
+                f"{entry['throughput']:>7}{change(('load', name, level, 'throughput'), entry['throughput']):<7} "
+                f"{entry['p50_ms']:>8}{change(('load', name, level, 'p50_ms'), entry['p50_ms']):<8} "
+                f"{entry['p99_ms']:>8}{change(('load', name, level, 'p99_ms'), entry['p99_ms']):<8} "
+                f"{entry['errors']:>7}"
+            )
+    print("\nmicrobenchmarks (us/op)")
+    for name, value in results["micro"].items():
+        print(f"  {name:<36} {value:>10}{change(('micro', name), value)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a fake Bedrock runtime")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--model", default="claude", help="Model name to call")
+    parser.add_argument("--history", type=int, default=5, help="User turns per conversation")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=500, help="Fake generation speed")
+    parser.add_argument("--output-tokens", type=int, default=100, help="Fake reply length in tokens")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of throttled calls")
+    parser.add_argument("--iterations", type=int, default=1000, help="Iterations of each microbenchmark")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the fake runtime")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare with the results of a previous run")
+    args = parser.parse_args()
+    # The app runs in a scratch directory, so resolve the paths first
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    fake_settings = {
+        "latency": args.latency,
+        "tokens_per_second": args.tokens_per_second,
+        "output_tokens": args.output_tokens,
+        "throttle_rate": args.throttle_rate,
+        "seed": args.seed
+    }
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="playground-bench-")
+    try:
+        app_module = load_app(workdir, fake_settings)
+        results = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "settings": {**fake_settings, "requests": args.requests, "model": args.model, "history": args.history},
+            "load": {"send": {}, "send_stream": {}},
+            "micro": {}
+        }
+        for level in [int(value) for value in args.concurrency.split(",")]:
+            results["load"]["send"][str(level)] = run_load(
+                app_module, "/send", level, args.requests, args.model, args.history
+            )
+            results["load"]["send_stream"][str(level)] = run_load(
+                app_module, "/send/stream", level, args.requests, args.model, args.history
+            )
+        check_uncached()
+        results["micro"] = run_micro(app_module, args.iterations)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if compare_path:
+        with open(compare_path, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import gzip
+
+# Default response compression settings, overridden by the "compression"
+# section of model_config.json
+DEFAULT_COMPRESSION_SETTINGS = {
+    "enabled": True,
+    # Smaller bodies gain less than the encoding costs
+    "min_bytes": 1024,
+    "gzip_level": 6,
+    # 0-11; the levels above 5 cost much more time for a little less size
+    "brotli_quality": 5,
+    "mimetypes": ["application/json", "text/html", "text/plain", "text/css", "application/javascript"]
+}
+
+_brotli = None
+_brotli_checked = False
+
+
+def get_brotli():
+    """
+    Return the brotli module, imported on first use.
+
+    Returns:
+        module: The brotli module, or None when it is not installed, in
+            which case responses are only gzip-compressed
+    """
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_checked = True
+    return _brotli
+
+
+def parse_accept_encoding(header):
+    """
+    Read the content codings of an Accept-Encoding header.
+
+    Parameters:
+        header (str): The header value, e.g. 'gzip, deflate, br;q=0.9'
+
+    Returns:
+        dict: Quality value of each coding, in lower case
+    """
+    codings = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding.strip().lower()] = quality
+    return codings
+
+
+def choose_encoding(header):
+    """
+    Pick the content coding of a response.
+
+    Brotli is preferred over gzip when the client accepts both with the
+    same quality and the brotli module is installed.
+
+    Parameters:
+        header (str): The request's Accept-Encoding header
+
+    Returns:
+        str: 'br', 'gzip', or None to send the body as is
+    """
+    codings = parse_accept_encoding(header)
+    available = ["br", "gzip"] if get_brotli() is not None else ["gzip"]
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = codings.get(coding, codings.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data, encoding, settings):
+    """Encode a body with 'br' or 'gzip'"""
+    if encoding == "br":
+        return get_brotli().compress(data, quality=settings["brotli_quality"])
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(data, compresslevel=settings["gzip_level"], mtime=0)
+
+
+def compress_response(response, accept_encoding, settings):
+    """
+    Compress a buffered response for a client that accepts it.
+
+    Streamed responses (server-sent events, exports) and file responses are
+    left as they are, as are error, partial and 304 responses and bodies
+    below min_bytes. The ETag is made weak, as the compressed and plain
+    bodies are different bytes of the same content.
+
+    Parameters:
+        response (flask.Response): The response to send
+        accept_encoding (str): The request's Accept-Encoding header
+        settings (dict): Compression settings, see DEFAULT_COMPRESSION_SETTINGS
+
+    Returns:
+        flask.Response: The same response, compressed when worthwhile
+    """
+    if (not settings["enabled"] or response.status_code != 200 or response.is_streamed
+            or response.direct_passthrough or "Content-Encoding" in response.headers
+            or response.mimetype not in settings["mimetypes"]):
+        return response
+    # The body depends on the request's Accept-Encoding from here on
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < settings["min_bytes"]:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding, settings))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
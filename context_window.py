@@ -0,0 +1,130 @@
+# Token counts are estimated from text length, which is close enough to keep
+# request payloads bounded without calling a tokenizer.
+# Average characters per token for English text
+CHARS_PER_TOKEN = 4
+# Role markers and formatting added around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_CONTEXT_BUDGET = 8000
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a text.
+
+    Parameters:
+        text (str): The text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(message):
+    """
+    Estimate the number of tokens a message adds to a request.
+
+    Parameters:
+        message (dict): Message dictionary with 'role' and 'content'
+
+    Returns:
+        int: Estimated token count
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        text_length = estimate_tokens(content)
+    else:
+        text_length = sum(estimate_tokens(block.get("text", "")) for block in content)
+    return text_length + MESSAGE_OVERHEAD_TOKENS
+
+
+def normalize_messages(messages, model_name=None):
+    """
+    Make a message list acceptable to the Converse API.
+
+    Converse requires the conversation to start with a user message and to
+    alternate roles. A reply can be missing when a stream was interrupted,
+    so consecutive messages with the same role are merged. The replies of
+    /compare carry their 'model' and answer the same message, so only one
+    of them is kept: the one of the model being called, else the first.
+
+    Parameters:
+        messages (list): List of message dictionaries with 'role' and 'content'
+        model_name (str): Name of the model the messages are sent to
+
+    Returns:
+        list: A new list of message dictionaries with string content
+    """
+    normalized = []
+    # 'model' of each normalized message recorded by /compare, else None
+    models = []
+    for message in messages:
+        if not normalized and message["role"] != "user":
+            continue
+        model = message.get("model") if message["role"] == "assistant" else None
+        if normalized and normalized[-1]["role"] == message["role"]:
+            if model is not None and models[-1] is not None:
+                if model == model_name and models[-1] != model_name:
+                    normalized[-1] = {"role": message["role"], "content": message["content"]}
+                    models[-1] = model
+                continue
+            normalized[-1] = {
+                "role": message["role"],
+                "content": normalized[-1]["content"] + "\n\n" + message["content"]
+            }
+            models[-1] = None
+        else:
+            normalized.append({"role": message["role"], "content": message["content"]})
+            models.append(model)
+    return normalized
+
+
+def fit_context(messages, max_tokens, model_name=None):
+    """
+    Keep the most recent turns that fit in a token budget.
+
+    Whole turns are dropped from the start of the history until the estimate
+    fits. The last message is always kept, even if it is larger than the
+    budget on its own, and the result still starts with a user message.
+
+    Parameters:
+        messages (list): List of message dictionaries with 'role' and 'content'
+        max_tokens (int): Input token budget
+        model_name (str): Name of the model the messages are sent to, which
+            picks among the /compare replies
+
+    Returns:
+        list: The messages to send to the model
+    """
+    messages = normalize_messages(messages, model_name)
+    if not messages:
+        return messages
+
+    total = estimate_message_tokens(messages[-1])
+    start = len(messages) - 1
+    while start > 0:
+        cost = estimate_message_tokens(messages[start - 1])
+        if total + cost > max_tokens:
+            break
+        total += cost
+        start -= 1
+
+    # Never start on an assistant message
+    while start < len(messages) - 1 and messages[start]["role"] != "user":
+        start += 1
+    return messages[start:]
+
+
+def get_context_budget(config, model_name):
+    """
+    Read the input token budget of a model from the model configuration.
+
+    Parameters:
+        config (dict): The loaded model configuration
+        model_name (str): Name of the model
+
+    Returns:
+        int: Input token budget
+    """
+    budgets = config.get("context_budget", {})
+    return budgets.get(model_name, budgets.get("default", DEFAULT_CONTEXT_BUDGET))
@@ -0,0 +1,1253 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+DEFAULT_STORAGE_SETTINGS = {
+    # Message bodies of at least this many bytes are stored zlib-compressed
+    "compress_min_bytes": 512,
+    "compression_level": 6,
+    # Bounds of the cache of recently active conversations
+    "cache_conversations": 256,
+    "cache_max_bytes": 32 * 1024 * 1024
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    model TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    changed_at REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    model TEXT,
+    reply_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages(conversation_id, id);
+CREATE TABLE IF NOT EXISTS message_usage (
+    message_id INTEGER PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    model TEXT,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_usage_conversation ON message_usage(conversation_id);
+CREATE INDEX IF NOT EXISTS message_usage_created ON message_usage(created_at);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    model TEXT,
+    message_id INTEGER,
+    state TEXT NOT NULL,
+    response TEXT,
+    reasoning TEXT,
+    usage TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_conversation ON jobs(conversation_id, created_at);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+"""
+
+JOB_FIELDS = ("conversation_id", "model", "message_id", "state", "response", "reasoning", "usage", "error",
+              "created_at", "started_at", "finished_at")
+
+# Full-text index of the messages. The index keeps no copy of the text: it
+# reads the snippets from messages_text, which uncompresses the stored
+# bodies with message_text(). New messages are indexed by the store, which
+# has their uncompressed text; the trigger drops deleted messages, including
+# the ones removed by a conversation delete.
+SEARCH_SCHEMA = """
+CREATE VIEW IF NOT EXISTS messages_text AS SELECT id, message_text(content) AS content FROM messages;
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content = 'messages_text',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+DROP TRIGGER IF EXISTS messages_fts_insert;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, message_text(old.content));
+END;
+"""
+
+# Indexes of the keyset pagination, created once the columns they cover exist
+PAGING_INDEXES = """
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations(COALESCE(updated_at, ''), id);
+CREATE INDEX IF NOT EXISTS messages_position ON messages(conversation_id, COALESCE(reply_to, id), id);
+"""
+
+# Change counters and times behind the ETags and Last-Modified dates of the
+# read endpoints. A conversation's version grows with every change of its
+# metadata or messages, and the store version with every change of the
+# conversation list, renames and deletes included; changed_at is the Unix
+# time of that change. Triggers keep them right whichever connection or
+# process writes, and are recreated on open so older ones get changed_at.
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    database_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    changed_at REAL
+);
+INSERT OR IGNORE INTO store_version (id, database_id, version) VALUES (1, lower(hex(randomblob(8))), 0);
+DROP TRIGGER IF EXISTS conversations_version_insert;
+CREATE TRIGGER conversations_version_insert AFTER INSERT ON conversations BEGIN
+    UPDATE conversations SET changed_at = (julianday('now') - 2440587.5) * 86400 WHERE id = new.id;
+    UPDATE store_version SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400;
+END;
+DROP TRIGGER IF EXISTS conversations_version_update;
+CREATE TRIGGER conversations_version_update
+AFTER UPDATE OF title, created_at, updated_at, model ON conversations BEGIN
+    UPDATE conversations SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400
+        WHERE id = new.id;
+    UPDATE store_version SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400;
+END;
+DROP TRIGGER IF EXISTS conversations_version_delete;
+CREATE TRIGGER conversations_version_delete AFTER DELETE ON conversations BEGIN
+    UPDATE store_version SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400;
+END;
+DROP TRIGGER IF EXISTS messages_version_insert;
+CREATE TRIGGER messages_version_insert AFTER INSERT ON messages BEGIN
+    UPDATE conversations SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400
+        WHERE id = new.conversation_id;
+END;
+"""
+
+# A quoted phrase, or a bare word with an optional '-' (exclude) prefix and '*' (prefix match) suffix
+QUERY_TERM = re.compile(r'(-?)(?:"([^"]*)"?|([^\s"]+))')
+
+METADATA_FIELDS = ("title", "created_at", "updated_at", "model")
+
+USAGE_TOTALS = (
+    "COUNT(*) AS calls, COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+    "COALESCE(SUM(output_tokens), 0) AS output_tokens, AVG(latency_ms) AS avg_latency_ms"
+)
+
+
+def pack_content(text, min_bytes=512, level=6):
+    """
+    Prepare a message body for storage.
+
+    Returns:
+        The text itself, or its zlib-compressed UTF-8 bytes when it is at
+        least min_bytes long and compression makes it smaller
+    """
+    data = text.encode("utf-8")
+    if len(data) < min_bytes:
+        return text
+    packed = zlib.compress(data, level)
+    return packed if len(packed) < len(data) else text
+
+
+def unpack_content(value):
+    """Return the text of a message body stored by pack_content()"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+def message_from_row(row):
+    """Convert a messages row to a message dictionary"""
+    message = {"role": row["role"], "content": unpack_content(row["content"])}
+    if row["model"] is not None:
+        message["model"] = row["model"]
+    return message
+
+
+def encode_cursor(*values):
+    """Encode the sort key of a row as an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor made by encode_cursor().
+
+    Parameters:
+        cursor (str): The cursor sent by the client
+        size (int): Number of values the cursor must hold
+
+    Returns:
+        list: The sort key values
+
+    Raises:
+        ValueError: If the cursor is not valid
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(value, (str, int, float)) for value in values)):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def search_query(text):
+    """
+    Convert a user query to an FTS5 query.
+
+    Words and "quoted phrases" must all match; 'word*' matches a prefix and
+    '-word' excludes the messages containing it. Every term is quoted, so
+    the FTS5 operators and punctuation in the text cannot break the query.
+
+    Parameters:
+        text (str): The query typed by the user
+
+    Returns:
+        str: The FTS5 MATCH expression, or None if the query has no term to find
+    """
+    included, excluded = [], []
+    for minus, phrase, word in QUERY_TERM.findall(text):
+        prefix = word.endswith("*")
+        term = (phrase or word).strip().rstrip("*")
+        if not term:
+            continue
+        term = '"' + term.replace('"', '""') + '"' + ("*" if prefix else "")
+        (excluded if minus else included).append(term)
+    if not included:
+        return None
+    query = " AND ".join(included)
+    for term in excluded:
+        query += f" NOT {term}"
+    return query
+
+
+def job_from_row(row):
+    """Convert a jobs row to a job record"""
+    record = dict(row)
+    record["usage"] = json.loads(record["usage"]) if record["usage"] else None
+    return record
+
+
+def usage_from_row(row):
+    """Convert a row of USAGE_TOTALS grouped by model to a usage dictionary"""
+    return {key: row[key] for key in row.keys() if key != "model"}
+
+
+def check_record(number, record):
+    """
+    Validate an import record.
+
+    Parameters:
+        number (int): Position of the record in the import, for the error message
+        record (dict): The record
+
+    Returns:
+        tuple: The conversation ID and its messages
+
+    Raises:
+        ValueError: If the record is not valid
+    """
+    if not isinstance(record, dict) or not isinstance(record.get("id"), str) or not record["id"]:
+        raise ValueError(f"Record {number}: missing conversation 'id'")
+    messages = record.get("messages", [])
+    if not isinstance(messages, list) or not all(
+            isinstance(message, dict) and isinstance(message.get("role"), str)
+            and isinstance(message.get("content"), str) for message in messages):
+        raise ValueError(f"Record {number}: 'messages' must be a list of messages with 'role' and 'content'")
+    return record["id"], messages
+
+
+def message_size(message):
+    """Estimate the memory held by a message dictionary, in bytes"""
+    return sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+
+
+class MessageCache:
+    """
+    LRU cache of the messages of recently active conversations.
+
+    It is bounded by a number of conversations and by an estimate of the
+    memory their messages hold; the least recently used conversations are
+    evicted first. A conversation is cached from a read of the database
+    only if no write to it started since the read began, and messages
+    appended to a cached conversation are added in place.
+    """
+
+    def __init__(self, max_conversations=256, max_bytes=32 * 1024 * 1024, stripes=64):
+        """
+        Create a message cache.
+
+        Parameters:
+            max_conversations (int): Maximum number of conversations kept
+            max_bytes (int): Maximum estimated size of the cached messages
+            stripes (int): Number of write clocks conversation IDs are hashed onto
+        """
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        # Each entry is [messages, position of the last message, estimated bytes]
+        self._entries = OrderedDict()
+        self._writing = {}
+        self._clock = 0
+        self._last_write = [0] * stripes
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _stripe(self, conversation_id):
+        return hash(conversation_id) % len(self._last_write)
+
+    def get(self, conversation_id):
+        """
+        Look up the messages of a conversation.
+
+        Returns:
+            list: A copy of the cached message list, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return list(entry[0])
+
+    def start_fill(self):
+        """Return the token to pass to put() before reading the messages from the database"""
+        with self._lock:
+            return self._clock
+
+    def put(self, conversation_id, messages, last_position, token):
+        """
+        Cache the messages read from the database.
+
+        They are dropped if a write to the conversation started after
+        start_fill() returned the token, as they may be out of date.
+        """
+        with self._lock:
+            if (self._writing.get(conversation_id)
+                    or self._last_write[self._stripe(conversation_id)] > token):
+                return
+            self._discard(conversation_id)
+            size = sum(message_size(message) for message in messages)
+            self._entries[conversation_id] = [list(messages), last_position, size]
+            self.bytes += size
+            self._evict()
+
+    def begin_write(self, conversation_id):
+        """Mark a write to a conversation as started, before writing to the database"""
+        with self._lock:
+            self._writing[conversation_id] = self._writing.get(conversation_id, 0) + 1
+            self._tick(conversation_id)
+
+    def end_write(self, conversation_id, message=None, position=None):
+        """
+        Mark a write to a conversation as committed.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            message (dict): The message appended, or None to drop the cached
+                conversation
+            position (int): Sort position of the appended message, as in
+                get_messages()
+        """
+        with self._lock:
+            count = self._writing.pop(conversation_id) - 1
+            if count:
+                self._writing[conversation_id] = count
+            self._tick(conversation_id)
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            # A reply to an earlier turn does not go at the end of the list
+            if message is None or position < entry[1]:
+                self._discard(conversation_id)
+                return
+            size = message_size(message)
+            entry[0].append(message)
+            entry[1] = position
+            entry[2] += size
+            self.bytes += size
+            self._evict()
+
+    def discard(self, conversation_id):
+        """Drop a conversation after a write to the database made without begin_write()"""
+        with self._lock:
+            self._tick(conversation_id)
+            self._discard(conversation_id)
+
+    def _tick(self, conversation_id):
+        self._clock += 1
+        self._last_write[self._stripe(conversation_id)] = self._clock
+
+    def _discard(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_conversations or self.bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry[2]
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every cached conversation"""
+        with self._lock:
+            self._clock += 1
+            self._last_write = [self._clock] * len(self._last_write)
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Get the cache size and counters.
+
+        Returns:
+            dict: Cached conversations and messages, estimated bytes, limits,
+                hits, misses, evictions and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self._entries),
+                "messages": sum(len(entry[0]) for entry in self._entries.values()),
+                "bytes": self.bytes,
+                "max_conversations": self.max_conversations,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class ConversationStore:
+    """
+    SQLite storage for conversations and their messages.
+
+    The database runs in WAL mode so that appending a message or changing a
+    title only writes the affected rows, readers never block the writer, and
+    a crash can at worst lose the last uncommitted write. Each thread gets its
+    own connection.
+
+    Long message bodies are stored compressed. The messages of recently
+    active conversations are kept in a MessageCache, so the conversations
+    that are not in use cost no memory.
+    """
+
+    def __init__(self, path="conversations.db", settings=None):
+        """
+        Open (and create if needed) the conversation database.
+
+        Parameters:
+            path (str): Path of the SQLite database file
+            settings (dict): The "storage" section of model_config.json
+        """
+        self.path = path
+        self.settings = {**DEFAULT_STORAGE_SETTINGS, **(settings or {})}
+        self.cache = MessageCache(self.settings["cache_conversations"], self.settings["cache_max_bytes"])
+        self._local = threading.local()
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        self._migrate(connection)
+        # Identifies this database in the ETags, so a recreated one never
+        # matches the copies cached by the clients
+        self.database_id = connection.execute("SELECT database_id FROM store_version").fetchone()[0]
+
+    def _migrate(self, connection):
+        """Add the columns, change counters and search index missing from databases created by older versions"""
+        columns = {row["name"] for row in connection.execute("PRAGMA table_info(messages)")}
+        with connection:
+            if "model" not in columns:
+                connection.execute("ALTER TABLE messages ADD COLUMN model TEXT")
+            if "reply_to" not in columns:
+                connection.execute("ALTER TABLE messages ADD COLUMN reply_to INTEGER")
+
+        conversation_columns = {row["name"] for row in connection.execute("PRAGMA table_info(conversations)")}
+        version_columns = {row["name"] for row in connection.execute("PRAGMA table_info(store_version)")}
+        with connection:
+            if "version" not in conversation_columns:
+                connection.execute("ALTER TABLE conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            if "changed_at" not in conversation_columns:
+                connection.execute("ALTER TABLE conversations ADD COLUMN changed_at REAL")
+            if version_columns and "changed_at" not in version_columns:
+                connection.execute("ALTER TABLE store_version ADD COLUMN changed_at REAL")
+        connection.executescript(VERSION_SCHEMA)
+        connection.executescript(PAGING_INDEXES)
+
+        index = connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        if index is not None and "messages_text" not in index["sql"]:
+            # Older versions kept a second copy of every message in the index
+            with connection:
+                connection.execute("DROP TRIGGER IF EXISTS messages_fts_delete")
+                connection.execute("DROP TABLE messages_fts")
+        connection.executescript(SEARCH_SCHEMA)
+        if index is None or "messages_text" not in index["sql"]:
+            with connection:
+                connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def _connect(self):
+        """Return the connection of the current thread, opening it if needed"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.create_function("message_text", 1, unpack_content, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def _pack(self, content):
+        return pack_content(content, self.settings["compress_min_bytes"], self.settings["compression_level"])
+
+    def exists(self, conversation_id):
+        """Return True if the conversation exists"""
+        row = self._connect().execute(
+            "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return row is not None
+
+    def is_empty(self):
+        """Return True if the store holds no conversation"""
+        return self._connect().execute("SELECT 1 FROM conversations LIMIT 1").fetchone() is None
+
+    def create(self, conversation_id, metadata):
+        """
+        Create a conversation if it does not exist yet.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            metadata (dict): Initial 'title', 'created_at', 'updated_at' and 'model'
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO conversations (id, title, created_at, updated_at, model) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, *(metadata.get(field) for field in METADATA_FIELDS))
+            )
+
+    def get_metadata(self, conversation_id):
+        """
+        Get the metadata of one conversation.
+
+        Returns:
+            dict: The metadata, or None if the conversation does not exist
+        """
+        row = self._connect().execute(
+            "SELECT title, created_at, updated_at, model FROM conversations WHERE id = ?",
+            (conversation_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_metadata(self):
+        """
+        Get the metadata of every conversation.
+
+        Returns:
+            dict: Metadata dictionaries keyed by conversation ID
+        """
+        rows = self._connect().execute(
+            "SELECT id, title, created_at, updated_at, model FROM conversations ORDER BY rowid"
+        )
+        return {row["id"]: {field: row[field] for field in METADATA_FIELDS} for row in rows}
+
+    def list_version(self):
+        """
+        Get the change counter of the conversation list.
+
+        Returns:
+            tuple: (version, changed_at), the version growing with every
+                created, changed or deleted conversation, and the Unix time
+                of the latest such change, None if unknown
+        """
+        row = self._connect().execute("SELECT version, changed_at FROM store_version").fetchone()
+        return row["version"], row["changed_at"]
+
+    def conversation_version(self, conversation_id):
+        """
+        Get the change counter of one conversation.
+
+        Returns:
+            tuple: (version, changed_at), the version growing with every
+                change of the metadata or messages and the Unix time of the
+                latest one, or None if the conversation does not exist
+        """
+        row = self._connect().execute(
+            "SELECT version, changed_at FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return (row["version"], row["changed_at"]) if row is not None else None
+
+    def list_page(self, limit=50, cursor=None):
+        """
+        Get one page of conversation metadata, most recently updated first.
+
+        Pages are read with a keyset cursor over (updated_at, id), so each
+        page costs the same however deep it is, and conversations updated
+        while paging are neither skipped nor repeated further down.
+
+        Parameters:
+            limit (int): Maximum number of conversations returned
+            cursor (str): 'next_cursor' of the previous page, None for the first page
+
+        Returns:
+            tuple: (list of metadata dictionaries with their 'id', cursor of
+                the next page or None on the last page)
+
+        Raises:
+            ValueError: If the cursor is not valid
+        """
+        where, params = "", []
+        if cursor:
+            # The bound on the leading column alone lets SQLite seek the index
+            where = "WHERE COALESCE(updated_at, '') <= ? AND (COALESCE(updated_at, ''), id) < (?, ?) "
+            updated_at, conversation_id = decode_cursor(cursor, 2)
+            params = [updated_at, updated_at, conversation_id]
+        rows = self._connect().execute(
+            "SELECT id, title, created_at, updated_at, model FROM conversations "
+            f"{where}ORDER BY COALESCE(updated_at, '') DESC, id DESC LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+        page = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor(last["updated_at"] or "", last["id"])
+        return page, next_cursor
+
+    def update_metadata(self, conversation_id, **fields):
+        """
+        Update some metadata fields of a conversation.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            **fields: Metadata fields to set
+
+        Returns:
+            bool: True if the conversation exists
+        """
+        fields = {key: value for key, value in fields.items() if key in METADATA_FIELDS}
+        if not fields:
+            return self.exists(conversation_id)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                f"UPDATE conversations SET {assignments} WHERE id = ?",
+                (*fields.values(), conversation_id)
+            )
+        return cursor.rowcount > 0
+
+    def get_messages(self, conversation_id):
+        """
+        Get the messages of a conversation in order.
+
+        A reply is placed right after the message it answers, even when
+        another turn of the same conversation was appended while the model
+        was generating it.
+
+        Returns:
+            list: Message dictionaries with 'role' and 'content', plus 'model'
+                for replies recorded by /compare. They are shared with the
+                cache and must not be modified.
+        """
+        messages = self.cache.get(conversation_id)
+        if messages is not None:
+            return messages
+
+        token = self.cache.start_fill()
+        rows = self._connect().execute(
+            "SELECT role, content, model, COALESCE(reply_to, id) AS position FROM messages "
+            "WHERE conversation_id = ? ORDER BY position, id",
+            (conversation_id,)
+        ).fetchall()
+        messages = [message_from_row(row) for row in rows]
+        if rows:
+            self.cache.put(conversation_id, messages, rows[-1]["position"], token)
+        return messages
+
+    def get_message_range(self, conversation_id, limit=50, before=None, after=None):
+        """
+        Get a range of consecutive messages of a conversation.
+
+        Messages are in the order of get_messages(). Without a cursor the
+        range ends with the latest message; 'before' reads the messages
+        preceding a range and 'after' the ones following it.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            limit (int): Maximum number of messages returned
+            before (str): 'before' cursor of a range
+            after (str): 'after' cursor of a range
+
+        Returns:
+            dict: 'messages' with their 'id', the 'before' and 'after' cursors
+                of the range, and 'has_more_before' / 'has_more_after'
+
+        Raises:
+            ValueError: If a cursor is not valid
+        """
+        columns = "id, role, content, model, COALESCE(reply_to, id) AS position"
+        connection = self._connect()
+        if after:
+            position, message_id = decode_cursor(after, 2)
+            rows = connection.execute(
+                f"SELECT {columns} FROM messages WHERE conversation_id = ? AND COALESCE(reply_to, id) >= ? "
+                "AND (COALESCE(reply_to, id), id) > (?, ?) ORDER BY position, id LIMIT ?",
+                (conversation_id, position, position, message_id, limit + 1)
+            ).fetchall()
+            has_more_after = len(rows) > limit
+            rows = rows[:limit]
+            has_more_before = True
+        else:
+            where, params = "", []
+            if before:
+                where = "AND COALESCE(reply_to, id) <= ? AND (COALESCE(reply_to, id), id) < (?, ?) "
+                position, message_id = decode_cursor(before, 2)
+                params = [position, position, message_id]
+            rows = connection.execute(
+                f"SELECT {columns} FROM messages WHERE conversation_id = ? "
+                f"{where}ORDER BY position DESC, id DESC LIMIT ?",
+                (conversation_id, *params, limit + 1)
+            ).fetchall()
+            has_more_before = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_more_after = bool(before)
+
+        return {
+            "messages": [{"id": row["id"], **message_from_row(row)} for row in rows],
+            "before": encode_cursor(rows[0]["position"], rows[0]["id"]) if rows else before or after,
+            "after": encode_cursor(rows[-1]["position"], rows[-1]["id"]) if rows else after or before,
+            "has_more_before": has_more_before,
+            "has_more_after": has_more_after
+        }
+
+    def append_message(self, conversation_id, role, content, updated_at=None, model=None, reply_to=None,
+                       usage=None):
+        """
+        Append one message to a conversation.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            role (str): 'user' or 'assistant'
+            content (str): Text of the message
+            updated_at (str): Optional new 'updated_at' value, written in the
+                same transaction
+            model (str): Optional name of the model that wrote the message
+            reply_to (int): ID of the message this one answers
+            usage (dict): Optional 'model', 'input_tokens', 'output_tokens'
+                and 'latency_ms' of the model call that wrote the message
+
+        Returns:
+            int: ID of the new message
+        """
+        connection = self._connect()
+        message = None
+        self.cache.begin_write(conversation_id)
+        try:
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO messages (conversation_id, role, content, model, reply_to) VALUES (?, ?, ?, ?, ?)",
+                    (conversation_id, role, self._pack(content), model, reply_to)
+                )
+                connection.execute(
+                    "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content)
+                )
+                if usage is not None:
+                    connection.execute(
+                        "INSERT INTO message_usage (message_id, conversation_id, model, input_tokens, "
+                        "output_tokens, latency_ms, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (cursor.lastrowid, conversation_id, usage.get("model"), usage.get("input_tokens") or 0,
+                         usage.get("output_tokens") or 0, usage.get("latency_ms"), time.time())
+                    )
+                if updated_at is not None:
+                    connection.execute(
+                        "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                        (updated_at, conversation_id)
+                    )
+            message = {"role": role, "content": content}
+            if model is not None:
+                message["model"] = model
+        finally:
+            self.cache.end_write(conversation_id, message, (reply_to or cursor.lastrowid) if message else None)
+        return cursor.lastrowid
+
+    def get_usage(self, conversation_id):
+        """
+        Get the token usage of a conversation.
+
+        Returns:
+            dict: Totals, totals per model, and the usage of each message
+        """
+        connection = self._connect()
+        totals = connection.execute(
+            f"SELECT {USAGE_TOTALS} FROM message_usage WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        by_model = connection.execute(
+            f"SELECT model, {USAGE_TOTALS} FROM message_usage WHERE conversation_id = ? GROUP BY model",
+            (conversation_id,)
+        )
+        messages = connection.execute(
+            "SELECT message_id, model, input_tokens, output_tokens, latency_ms FROM message_usage "
+            "WHERE conversation_id = ? ORDER BY message_id",
+            (conversation_id,)
+        )
+        return {
+            **dict(totals),
+            "by_model": {row["model"]: usage_from_row(row) for row in by_model},
+            "messages": [dict(row) for row in messages]
+        }
+
+    def conversation_tokens(self, conversation_id):
+        """Return the input plus output tokens spent on a conversation"""
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(input_tokens + output_tokens), 0) FROM message_usage WHERE conversation_id = ?",
+            (conversation_id,)
+        ).fetchone()
+        return row[0]
+
+    def total_tokens(self, since=0):
+        """Return the input plus output tokens spent on all conversations since a Unix time"""
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(input_tokens + output_tokens), 0) FROM message_usage WHERE created_at >= ?",
+            (since,)
+        ).fetchone()
+        return row[0]
+
+    def usage_by_model(self, since=0):
+        """
+        Get the token usage of each model since a Unix time.
+
+        Returns:
+            dict: Calls, input and output tokens and mean latency keyed by model name
+        """
+        rows = self._connect().execute(
+            f"SELECT model, {USAGE_TOTALS} FROM message_usage WHERE created_at >= ? GROUP BY model",
+            (since,)
+        )
+        return {row["model"]: usage_from_row(row) for row in rows}
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Find the conversations whose messages match a query.
+
+        Messages are ranked with BM25 (the FTS5 rank) and each conversation is ranked by its
+        best message. The index is updated as messages are appended and
+        deleted, so a search never scans the messages themselves; only the
+        best message of each conversation is read back for its snippet.
+
+        Parameters:
+            query (str): Words, "quoted phrases", 'prefix*' and '-excluded' words
+            limit (int): Maximum number of conversations returned
+            offset (int): Number of conversations to skip, for paging
+
+        Returns:
+            list: For each conversation, best first, its 'conversation_id',
+                'title', 'updated_at', number of 'matches', and the 'message_id',
+                'role' and highlighted 'snippet' of its best message
+
+        Raises:
+            ValueError: If the query has no term to find or is not valid
+        """
+        match = search_query(query)
+        if match is None:
+            raise ValueError("Empty search query")
+
+        connection = self._connect()
+        try:
+            # A bare column next to MIN() comes from the row holding the minimum,
+            # so message_id is the best message of the conversation
+            hits = connection.execute(
+                "SELECT h.conversation_id, h.rowid AS message_id, MIN(h.score) AS score, COUNT(*) AS matches, "
+                "c.title, c.updated_at "
+                "FROM (SELECT f.rowid, m.conversation_id, f.rank AS score "
+                "      FROM messages_fts f JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?) AS h "
+                "JOIN conversations c ON c.id = h.conversation_id "
+                "GROUP BY h.conversation_id ORDER BY score, h.conversation_id LIMIT ? OFFSET ?",
+                (match, limit, offset)
+            ).fetchall()
+            if not hits:
+                return []
+            message_ids = [hit["message_id"] for hit in hits]
+            placeholders = ", ".join("?" * len(message_ids))
+            snippets = {
+                row["rowid"]: (row["snippet"], row["role"])
+                for row in connection.execute(
+                    "SELECT messages_fts.rowid AS rowid, m.role, "
+                    "snippet(messages_fts, 0, '<mark>', '</mark>', '…', 24) AS snippet "
+                    "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                    f"WHERE messages_fts MATCH ? AND messages_fts.rowid IN ({placeholders})",
+                    (match, *message_ids)
+                )
+            }
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {str(e)}")
+
+        results = []
+        for hit in hits:
+            snippet, role = snippets.get(hit["message_id"], ("", None))
+            results.append({
+                "conversation_id": hit["conversation_id"],
+                "title": hit["title"],
+                "updated_at": hit["updated_at"],
+                "matches": hit["matches"],
+                "score": -hit["score"],
+                "message_id": hit["message_id"],
+                "role": role,
+                "snippet": snippet
+            })
+        return results
+
+    def storage_stats(self):
+        """
+        Get the size of the stored messages.
+
+        This reads every message, so it is meant for occasional checks.
+
+        Returns:
+            dict: Number of messages and of compressed ones, bytes of the
+                stored bodies and of the search index, and size of the
+                database file
+        """
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT COUNT(*) AS messages, COALESCE(SUM(typeof(content) = 'blob'), 0) AS compressed, "
+            "COALESCE(SUM(length(CAST(content AS BLOB))), 0) AS stored_bytes FROM messages"
+        ).fetchone()
+        # The index tables of messages_fts; the text itself is not copied
+        search_bytes = sum(
+            connection.execute(f"SELECT COALESCE(SUM({size}), 0) FROM {table}").fetchone()[0]
+            for table, size in (("messages_fts_data", "length(block)"), ("messages_fts_idx", "length(term)"),
+                                ("messages_fts_docsize", "length(sz)"))
+        )
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        return {**dict(row), "search_index_bytes": search_bytes, "database_bytes": page_count * page_size}
+
+    def insert_job(self, job):
+        """Save a new job record, as returned by Job.status()"""
+        values = {**job, "usage": json.dumps(job["usage"]) if job["usage"] is not None else None}
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                f"INSERT INTO jobs (id, {', '.join(JOB_FIELDS)}) VALUES (?{', ?' * len(JOB_FIELDS)})",
+                (job["id"], *(values[field] for field in JOB_FIELDS))
+            )
+
+    def update_job(self, job):
+        """Save the new state of a job record; a job whose conversation was deleted is left deleted"""
+        values = {**job, "usage": json.dumps(job["usage"]) if job["usage"] is not None else None}
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in JOB_FIELDS)} WHERE id = ?",
+                (*(values[field] for field in JOB_FIELDS), job["id"])
+            )
+
+    def get_job(self, job_id):
+        """
+        Get a job record.
+
+        Returns:
+            dict: The record, or None if the job does not exist
+        """
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_from_row(row) if row is not None else None
+
+    def list_jobs(self, conversation_id=None, active=False, limit=50):
+        """
+        Get the latest job records, newest first.
+
+        Parameters:
+            conversation_id (str): Only the jobs of this conversation
+            active (bool): Only the pending and running jobs
+            limit (int): Maximum number of records
+
+        Returns:
+            list: Job records without their text
+        """
+        filters, params = [], []
+        if conversation_id is not None:
+            filters.append("conversation_id = ?")
+            params.append(conversation_id)
+        if active:
+            filters.append("state IN ('pending', 'running')")
+        rows = self._connect().execute(
+            "SELECT id, conversation_id, model, message_id, state, error, created_at, started_at, finished_at "
+            f"FROM jobs {'WHERE ' + ' AND '.join(filters) if filters else ''} ORDER BY created_at DESC LIMIT ?",
+            (*params, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def interrupt_jobs(self):
+        """
+        Mark the jobs left pending or running by a previous process as failed.
+
+        Returns:
+            int: Number of jobs marked
+        """
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Error: Interrupted by a restart', finished_at = ? "
+                "WHERE state IN ('pending', 'running')",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def prune_jobs(self, before):
+        """Delete the finished job records created before a Unix time"""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE created_at < ? AND state NOT IN ('pending', 'running')", (before,)
+            )
+
+    def delete(self, conversation_id):
+        """
+        Delete a conversation, its messages and its jobs.
+
+        Returns:
+            bool: True if the conversation existed
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM jobs WHERE conversation_id = ?", (conversation_id,))
+            cursor = connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        self.cache.discard(conversation_id)
+        return cursor.rowcount > 0
+
+    def export_records(self, since=None, until=None, model=None, page_size=100):
+        """
+        Read conversations one export record at a time.
+
+        Conversations are read by pages in updated_at order, with a short
+        read for each page and each conversation, so memory use does not
+        grow with the history and writers are never held up.
+
+        Parameters:
+            since (str): Only conversations updated at or after this time
+            until (str): Only conversations updated before this time
+            model (str): Only conversations using this model
+            page_size (int): Number of conversations read per query
+
+        Yields:
+            dict: The conversation metadata and its 'messages' in order. A
+                reply's 'reply_to' is the index of the message it answers, and
+                'usage' holds the tokens of the call that wrote it
+        """
+        filters, params = [], []
+        if since:
+            filters.append("COALESCE(updated_at, '') >= ?")
+            params.append(since)
+        if until:
+            filters.append("COALESCE(updated_at, '') < ?")
+            params.append(until)
+        if model:
+            filters.append("model = ?")
+            params.append(model)
+        connection = self._connect()
+        position = None
+        while True:
+            where = list(filters)
+            page_params = list(params)
+            if position is not None:
+                where += ["COALESCE(updated_at, '') >= ?", "(COALESCE(updated_at, ''), id) > (?, ?)"]
+                page_params += [position[0], *position]
+            rows = connection.execute(
+                "SELECT id, title, created_at, updated_at, model FROM conversations "
+                f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+                "ORDER BY COALESCE(updated_at, ''), id LIMIT ?",
+                (*page_params, page_size)
+            ).fetchall()
+            for row in rows:
+                yield {**dict(row), "messages": self._export_messages(row["id"])}
+            if len(rows) < page_size:
+                return
+            position = (rows[-1]["updated_at"] or "", rows[-1]["id"])
+
+    def _export_messages(self, conversation_id):
+        rows = self._connect().execute(
+            "SELECT m.id, m.role, m.content, m.model, m.reply_to, u.model AS usage_model, u.input_tokens, "
+            "u.output_tokens, u.latency_ms, u.created_at AS usage_created_at "
+            "FROM messages m LEFT JOIN message_usage u ON u.message_id = m.id "
+            "WHERE m.conversation_id = ? ORDER BY COALESCE(m.reply_to, m.id), m.id",
+            (conversation_id,)
+        ).fetchall()
+        indexes = {row["id"]: index for index, row in enumerate(rows)}
+        messages = []
+        for row in rows:
+            message = message_from_row(row)
+            if row["reply_to"] in indexes:
+                message["reply_to"] = indexes[row["reply_to"]]
+            if row["usage_created_at"] is not None:
+                message["usage"] = {
+                    "model": row["usage_model"],
+                    "input_tokens": row["input_tokens"],
+                    "output_tokens": row["output_tokens"],
+                    "latency_ms": row["latency_ms"],
+                    "created_at": row["usage_created_at"]
+                }
+            messages.append(message)
+        return messages
+
+    def import_records(self, records, batch_size=200, counts=None):
+        """
+        Import conversations from export records.
+
+        Records are written in transactions of batch_size conversations. A
+        conversation whose ID already exists is skipped, so an interrupted
+        import can be run again.
+
+        Parameters:
+            records: Iterable of records as yielded by export_records()
+            batch_size (int): Number of conversations written per transaction
+            counts (dict): Optional dictionary updated as batches are written,
+                to tell what was imported when an error is raised
+
+        Returns:
+            dict: Numbers of 'imported' and 'skipped' conversations and of
+                imported 'messages'
+
+        Raises:
+            ValueError: If a record is not valid; the batches before it are kept
+        """
+        if counts is None:
+            counts = {}
+        for key in ("imported", "skipped", "messages"):
+            counts.setdefault(key, 0)
+        batch = []
+        for number, record in enumerate(records, 1):
+            batch.append((number, record))
+            if len(batch) >= batch_size:
+                self._import_batch(batch, counts)
+                batch = []
+        if batch:
+            self._import_batch(batch, counts)
+        return counts
+
+    def _import_batch(self, batch, counts):
+        connection = self._connect()
+        imported = []
+        skipped = 0
+        message_count = 0
+        with connection:
+            for number, record in batch:
+                conversation_id, messages = check_record(number, record)
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO conversations (id, title, created_at, updated_at, model) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (conversation_id, *(record.get(field) for field in METADATA_FIELDS))
+                )
+                if cursor.rowcount == 0:
+                    skipped += 1
+                    continue
+                ids = []
+                fts_rows = []
+                for message in messages:
+                    reply_to = message.get("reply_to")
+                    cursor = connection.execute(
+                        "INSERT INTO messages (conversation_id, role, content, model, reply_to) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (conversation_id, message["role"], self._pack(message["content"]), message.get("model"),
+                         ids[reply_to] if isinstance(reply_to, int) and 0 <= reply_to < len(ids) else None)
+                    )
+                    ids.append(cursor.lastrowid)
+                    fts_rows.append((cursor.lastrowid, message["content"]))
+                    usage = message.get("usage")
+                    if isinstance(usage, dict):
+                        connection.execute(
+                            "INSERT INTO message_usage (message_id, conversation_id, model, input_tokens, "
+                            "output_tokens, latency_ms, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (cursor.lastrowid, conversation_id, usage.get("model"), usage.get("input_tokens") or 0,
+                             usage.get("output_tokens") or 0, usage.get("latency_ms"),
+                             usage.get("created_at") or time.time())
+                        )
+                connection.executemany(
+                    "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", fts_rows
+                )
+                imported.append(conversation_id)
+                message_count += len(messages)
+        counts["imported"] += len(imported)
+        counts["skipped"] += skipped
+        counts["messages"] += message_count
+        for conversation_id in imported:
+            self.cache.discard(conversation_id)
+
+    def import_json(self, path):
+        """
+        Import conversations from the legacy conversations.json format.
+
+        Parameters:
+            path (str): Path of a file holding {"metadata": {...}, "data": {...}}
+
+        Returns:
+            int: Number of conversations imported
+        """
+        with open(path, 'r') as f:
+            legacy = json.load(f)
+
+        metadata = legacy.get("metadata", {})
+        records = (
+            {**metadata.get(conversation_id, {}), "id": conversation_id, "messages": messages}
+            for conversation_id, messages in legacy.get("data", {}).items()
+        )
+        self.import_records(records)
+        return len(legacy.get("data", {}))
+
+
+class ConversationLocks:
+    """
+    Locks that serialize the changes made to each conversation.
+
+    Conversation IDs are hashed onto a fixed set of locks, so memory stays
+    bounded and unrelated conversations rarely wait for each other. The
+    locks must only be held for store operations, never for model calls.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, conversation_id):
+        """Return the lock of a conversation"""
+        return self._locks[hash(conversation_id) % len(self._locks)]
+
+
+def open_store(path="conversations.db", legacy_path="conversations.json", settings=None):
+    """
+    Open the conversation store, migrating a legacy JSON file on first run.
+
+    The legacy file is imported only into an empty store and is then renamed
+    with a '.bak' suffix so it is not imported twice.
+
+    Parameters:
+        path (str): Path of the SQLite database file
+        legacy_path (str): Path of the old conversations.json file
+        settings (dict): The "storage" section of model_config.json
+
+    Returns:
+        ConversationStore: The opened store
+    """
+    store = ConversationStore(path, settings)
+    if legacy_path and os.path.exists(legacy_path) and store.is_empty():
+        count = store.import_json(legacy_path)
+        os.replace(legacy_path, legacy_path + ".bak")
+        print(f"Migrated {count} conversations from {legacy_path} to {path}")
+    return store
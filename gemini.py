@@ -1,28 +1,482 @@
+import asyncio
 import os
-from dotenv import load_dotenv
+import queue
+import threading
+import time
+from context_window import estimate_message_tokens, estimate_tokens
+from metrics import record_model_call
+from rate_limiter import get_limiter, is_throttling_error
 
+# Default Gemini settings, overridden by the "gemini" section of
+# model_config.json; project and location fall back to the environment
+# variables used by the Google SDK.
+DEFAULT_GEMINI_SETTINGS = {
+    "project": None,
+    "location": None,
+    "use_vertexai": True,
+    "api_version": "v1",
+    "include_thoughts": False,
+    "timeout": 300
+}
 
-load_dotenv()
-GOOGLE_CLOUD_PROJECT= os.getenv("GOOGLE_CLOUD_PROJECT", "modelplayground-416920")
-GOOGLE_CLOUD_LOCATION=os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
-GOOGLE_GENAI_USE_VERTEXAI=os.getenv("GOOGLE_GENAI_USE_VERTEXAI", "true")
+_settings = dict(DEFAULT_GEMINI_SETTINGS)
+_client = None
+_loop = None
+_models = {}
+_model_ids = {}
+_registry_lock = threading.Lock()
 
-if GOOGLE_GENAI_USE_VERTEXAI == "True":
-    GOOGLE_GENAI_USE_VERTEXAI = True
 
-print(f"GOOGLE_CLOUD_PROJECT: {GOOGLE_CLOUD_PROJECT}")
-print(f"GOOGLE_CLOUD_LOCATION: {GOOGLE_CLOUD_LOCATION}")
-print(f"GOOGLE_GENAI_USE_VERTEXAI: {GOOGLE_GENAI_USE_VERTEXAI}")
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
 
-if GOOGLE_GENAI_USE_VERTEXAI:
-    print("Using Vertex AI")
 
-from google import genai
-from google.genai.types import HttpOptions
+def get_loop():
+    """
+    Return the event loop running every Gemini request.
 
-client = genai.Client(http_options=HttpOptions(api_version="v1"))
-response = client.models.generate_content(
-    model="gemini-2.0-flash-001",
-    contents="How does AI work?",
-)
-print(response.text)
\ No newline at end of file
+    The loop runs in a daemon thread started on first use. Request threads
+    submit coroutines to it, so many Gemini calls share one thread and one
+    connection pool instead of blocking a thread each.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running loop
+    """
+    global _loop
+    with _registry_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(_loop,), daemon=True, name="gemini-loop").start()
+    return _loop
+
+
+def get_client():
+    """
+    Return the shared google-genai client, built once from the settings.
+
+    Returns:
+        google.genai.Client: The client; its 'aio' attribute holds the async API
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _registry_lock:
+        if _client is None:
+            # Imported on first use so that loading the module stays cheap
+            from google import genai
+            from google.genai.types import HttpOptions
+
+            settings = _settings
+            _client = genai.Client(
+                vertexai=settings["use_vertexai"],
+                project=settings["project"],
+                location=settings["location"],
+                http_options=HttpOptions(api_version=settings["api_version"])
+            )
+    return _client
+
+
+def gemini_content(message):
+    """
+    Convert a chat message to a Gemini content.
+
+    Parameters:
+        message (dict): Message dictionary with 'role' and 'content'
+
+    Returns:
+        dict: Content with the 'user' or 'model' role Gemini expects
+    """
+    role = "model" if message["role"] == "assistant" else "user"
+    if isinstance(message["content"], str):
+        parts = [{"text": message["content"]}]
+    else:
+        parts = [{"text": block["text"]} for block in message["content"] if "text" in block]
+    return {"role": role, "parts": parts}
+
+
+def format_contents(messages):
+    """
+    Convert chat messages to Gemini contents.
+
+    Parameters:
+        messages (list): List of message dictionaries with 'role' and 'content'
+
+    Returns:
+        list: Contents with the 'user' and 'model' roles Gemini expects
+    """
+    return [gemini_content(message) for message in messages]
+
+
+def read_parts(response):
+    """
+    Split the parts of a Gemini response or stream chunk.
+
+    Returns:
+        tuple: (text, reasoning), where reasoning holds the thought parts
+    """
+    text = ""
+    reasoning = ""
+    for candidate in (response.candidates or [])[:1]:
+        if candidate.content is None:
+            continue
+        for part in candidate.content.parts or []:
+            if not part.text:
+                continue
+            if part.thought:
+                reasoning += part.text
+            else:
+                text += part.text
+    return text, reasoning
+
+
+def read_gemini_usage(response):
+    """
+    Extract the token counts of a Gemini response.
+
+    Returns:
+        tuple: (input_tokens, output_tokens), None when unknown
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None
+    return usage.prompt_token_count, usage.candidates_token_count
+
+
+class GeminiModel:
+    """
+    Gemini model served through the google-genai SDK.
+
+    Offers the same generate, converse and stream methods as BedrockModel.
+    Calls run as coroutines on the shared event loop (see get_loop()) and go
+    through the model's rate limiter like the Bedrock calls.
+    """
+
+    def __init__(self, model_id, region_name=None, client=None):
+        """
+        Initialize a Gemini model.
+
+        Parameters:
+            model_id (str): The Gemini model name, e.g. 'gemini-2.0-flash-001'
+            region_name (str): Unused, the location comes from the settings
+            client: Optional google-genai client, defaults to the shared one
+        """
+        self.model_id = model_id
+        self.region_name = _settings["location"]
+        self.client = client if client is not None else get_client()
+        self.limiter = get_limiter(model_id, self.region_name)
+
+    def _config(self, max_tokens, temperature, top_p=None):
+        from google.genai import types
+
+        config = {"max_output_tokens": max_tokens, "temperature": temperature}
+        if top_p is not None:
+            config["top_p"] = top_p
+        if _settings["include_thoughts"]:
+            config["thinking_config"] = types.ThinkingConfig(include_thoughts=True)
+        return types.GenerateContentConfig(**config)
+
+    def _run(self, coroutine):
+        """Run a coroutine on the shared loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+        try:
+            return future.result(timeout=_settings["timeout"])
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _call(self, operation, tokens, contents, config):
+        """
+        Call generate_content through the model's rate limiter.
+
+        Parameters:
+            operation (str): Name recorded in the metrics, e.g. 'converse'
+            tokens (int): Estimated tokens of the call
+            contents: The prompt or Gemini contents
+            config: The GenerateContentConfig of the call
+
+        Returns:
+            The generate_content response
+        """
+        start = time.time()
+        try:
+            response = self.limiter.call(
+                lambda: self._run(self.client.aio.models.generate_content(
+                    model=self.model_id, contents=contents, config=config
+                )),
+                tokens
+            )
+        except Exception:
+            record_model_call(self.model_id, operation, time.time() - start, error=True)
+            raise
+        input_tokens, output_tokens = read_gemini_usage(response)
+        record_model_call(self.model_id, operation, time.time() - start, input_tokens, output_tokens)
+        return response
+
+    def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
+        """
+        Generate text using the Gemini model.
+
+        Parameters:
+            prompt (str): The input text to generate from
+            max_tokens (int): Maximum number of tokens to generate
+            temperature (float): Controls randomness (0-1)
+            top_p (float): Controls diversity via nucleus sampling (0-1)
+
+        Returns:
+            str: The generated text
+        """
+        try:
+            response = self._call(
+                "generate",
+                estimate_tokens(prompt) + max_tokens,
+                prompt,
+                self._config(max_tokens, temperature, top_p)
+            )
+            return read_parts(response)[0]
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def converse(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Have a conversation with the Gemini model.
+
+        Parameters:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            max_tokens (int): Maximum number of tokens to generate
+            temperature (float): Controls randomness (0-1)
+
+        Returns:
+            dict: Contains 'response' (str) and 'reasoning' (str) if available
+        """
+        try:
+            response = self._call(
+                "converse",
+                sum(estimate_message_tokens(m) for m in messages) + max_tokens,
+                format_contents(messages),
+                self._config(max_tokens, temperature)
+            )
+            response_text, reasoning = read_parts(response)
+            input_tokens, output_tokens = read_gemini_usage(response)
+            return {
+                "response": response_text,
+                "reasoning": reasoning,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+            }
+        except Exception as e:
+            return {"response": f"Error: {str(e)}", "reasoning": ""}
+
+    def stream(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Stream a conversation reply from the model as it is generated.
+
+        The stream is read by a coroutine on the shared loop, which hands
+        the chunks to the calling thread through a queue.
+
+        Parameters:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            max_tokens (int): Maximum number of tokens to generate
+            temperature (float): Controls randomness (0-1)
+
+        Yields:
+            dict: Events with a 'type' of 'reasoning', 'text' or 'error' and
+                the corresponding 'text', then a 'usage' event with the
+                'input_tokens' and 'output_tokens' of the call
+        """
+        contents = format_contents(messages)
+        config = self._config(max_tokens, temperature)
+        tokens = sum(estimate_message_tokens(m) for m in messages) + max_tokens
+        start = time.time()
+        try:
+            # The limiter slot is held until the stream is fully read
+            chunks = self.limiter.call(
+                lambda: self._run(self.client.aio.models.generate_content_stream(
+                    model=self.model_id, contents=contents, config=config
+                )),
+                tokens,
+                keep_slot=True
+            )
+        except Exception as e:
+            record_model_call(self.model_id, "converse_stream", time.time() - start, error=True)
+            yield {"type": "error", "text": f"Error: {str(e)}"}
+            return
+
+        events = queue.Queue()
+        usage = [None, None]
+
+        async def read_chunks():
+            try:
+                async for chunk in chunks:
+                    input_tokens, output_tokens = read_gemini_usage(chunk)
+                    if output_tokens is not None:
+                        usage[:] = [input_tokens, output_tokens]
+                    text, reasoning = read_parts(chunk)
+                    if reasoning:
+                        events.put({"type": "reasoning", "text": reasoning})
+                    if text:
+                        events.put({"type": "text", "text": text})
+            except Exception as e:
+                events.put(e)
+            finally:
+                events.put(None)
+
+        reader = asyncio.run_coroutine_threadsafe(read_chunks(), get_loop())
+        throttled = False
+        failed = False
+        first_token_at = None
+        try:
+            while True:
+                event = events.get(timeout=_settings["timeout"])
+                if event is None:
+                    if usage[1] is not None:
+                        yield {"type": "usage", "input_tokens": usage[0], "output_tokens": usage[1]}
+                    break
+                if isinstance(event, Exception):
+                    throttled = is_throttling_error(event)
+                    failed = True
+                    yield {"type": "error", "text": f"Error: {str(event)}"}
+                    break
+                if first_token_at is None:
+                    first_token_at = time.time()
+                yield event
+        except queue.Empty:
+            failed = True
+            yield {"type": "error", "text": "Error: Gemini stream timed out"}
+        finally:
+            # Stops the reader if the client went away mid-stream
+            reader.cancel()
+            self.limiter.release(throttled=throttled)
+            record_model_call(
+                self.model_id,
+                "converse_stream",
+                time.time() - start,
+                usage[0],
+                usage[1],
+                time_to_first_token=first_token_at - start if first_token_at is not None else None,
+                error=failed
+            )
+
+
+# Model classes by name, replaced by the "providers" section of
+# model_config.json (see providers.py)
+MODEL_CLASSES = {
+    "gemini": GeminiModel
+}
+
+
+def configure_registry(config, models=None):
+    """
+    Apply model_config.json settings to the Gemini registry.
+
+    The "gemini" section overrides DEFAULT_GEMINI_SETTINGS. It is read once
+    here; the project and location default to the GOOGLE_CLOUD_PROJECT and
+    GOOGLE_CLOUD_LOCATION environment variables. The shared client and
+    models are dropped so the next get_model() call uses the new settings.
+
+    Parameters:
+        config (dict): The loaded model configuration
+        models (dict): Class name of each model name served by this
+            module, defaults to the built-in MODEL_CLASSES
+    """
+    global MODEL_CLASSES, _settings, _model_ids, _client
+    with _registry_lock:
+        if models is not None:
+            MODEL_CLASSES = {name: globals()[class_name] for name, class_name in models.items()}
+        _model_ids = {
+            name: model_id for name, model_id in config.get("model_ids", {}).items()
+            if name in MODEL_CLASSES
+        }
+        settings = {**DEFAULT_GEMINI_SETTINGS, **config.get("gemini", {})}
+        settings["project"] = settings["project"] or os.getenv("GOOGLE_CLOUD_PROJECT")
+        settings["location"] = settings["location"] or os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+        _settings = settings
+        _client = None
+        _models.clear()
+
+
+def set_model_ids(model_ids):
+    """
+    Change the ids of some models.
+
+    Parameters:
+        model_ids (dict): Model ids keyed by model name
+    """
+    global _model_ids
+    with _registry_lock:
+        changed = {
+            name for name, model_id in model_ids.items()
+            if name in MODEL_CLASSES and _model_ids.get(name) != model_id
+        }
+        _model_ids = {**_model_ids, **{name: model_ids[name] for name in changed}}
+        for name in changed:
+            _models.pop(name, None)
+
+
+def get_model(model_name, region_name=None):
+    """
+    Return the shared instance of a Gemini model.
+
+    Parameters:
+        model_name (str): Name of the model, e.g. 'gemini'
+        region_name (str): Unused, the location comes from the settings
+
+    Returns:
+        GeminiModel: The model instance
+
+    Raises:
+        ValueError: If the model name is not recognized
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    if model_name not in MODEL_CLASSES or model_name not in _model_ids:
+        raise ValueError(f"Unknown model: {model_name}")
+
+    client = get_client()
+    with _registry_lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = MODEL_CLASSES[model_name](_model_ids[model_name], client=client)
+            _models[model_name] = model
+    return model
+
+
+def warm_models(model_names, region_name=None):
+    """
+    Build the client, the event loop and the model instances ahead of the first request.
+
+    Returns:
+        list: Names of the models that could not be prepared
+    """
+    failed = []
+    get_loop()
+    for model_name in model_names:
+        try:
+            get_model(model_name)
+        except Exception as e:
+            print(f"Could not warm model {model_name}: {e}")
+            failed.append(model_name)
+    return failed
+
+
+def main():
+    """Ask Gemini a question with the settings of model_config.json"""
+    import json
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    with open("model_config.json", 'r') as f:
+        configure_registry(json.load(f))
+    print(f"GOOGLE_CLOUD_PROJECT: {_settings['project']}")
+    print(f"GOOGLE_CLOUD_LOCATION: {_settings['location']}")
+    print(f"Using Vertex AI: {_settings['use_vertexai']}")
+
+    model = get_model("gemini")
+    for event in model.stream([{"role": "user", "content": "How does AI work?"}]):
+        print(event["text"], end="", flush=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
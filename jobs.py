@@ -0,0 +1,267 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_JOB_SETTINGS = {
+    "workers": 8,
+    # Finished jobs kept in memory; older ones are read back from the store
+    "keep_in_memory": 1000,
+    # Finished jobs older than this are deleted from the store at startup
+    "keep_days": 7
+}
+
+FINAL_STATES = ("finished", "failed", "cancelled")
+
+
+class Job:
+    """
+    A /send generation running in the background.
+
+    The worker adds the events of the model stream as they arrive; any
+    number of readers replay them and wait for new ones until the job ends.
+    """
+
+    def __init__(self, conversation_id, model, message_id, job_id=None):
+        """
+        Create a pending job.
+
+        Parameters:
+            conversation_id (str): ID of the conversation
+            model (str): Name of the model to call
+            message_id (int): ID of the user message being answered
+            job_id (str): ID of a job read back from the store
+        """
+        self.id = job_id or uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.model = model
+        self.message_id = message_id
+        self.state = "pending"
+        self.events = []
+        self.response = ""
+        self.reasoning = ""
+        self.usage = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a job from its store record, with its text as events"""
+        job = cls(record["conversation_id"], record["model"], record["message_id"], record["id"])
+        for field in ("state", "response", "reasoning", "usage", "error", "created_at", "started_at",
+                      "finished_at"):
+            setattr(job, field, record[field])
+        job.response = job.response or ""
+        job.reasoning = job.reasoning or ""
+        if job.reasoning:
+            job.events.append({"type": "reasoning", "text": job.reasoning})
+        if job.error:
+            job.events.append({"type": "error", "text": job.error})
+        elif job.response:
+            job.events.append({"type": "text", "text": job.response})
+        return job
+
+    def start(self):
+        """Mark the job as running, unless it was cancelled while pending"""
+        with self.condition:
+            if self.state != "pending":
+                return False
+            self.state = "running"
+            self.started_at = time.time()
+            return True
+
+    def add_event(self, event):
+        """Record a 'text', 'reasoning' or 'error' event of the model stream"""
+        with self.condition:
+            self.events.append(event)
+            if event["type"] == "text":
+                self.response += event["text"]
+            elif event["type"] == "reasoning":
+                self.reasoning += event["text"]
+            elif event["type"] == "error":
+                self.response = event["text"]
+                self.error = event["text"]
+            self.condition.notify_all()
+
+    def finish(self, state):
+        """Move the job to a final state and wake up the readers"""
+        with self.condition:
+            if self.state in FINAL_STATES:
+                return False
+            self.state = state
+            self.finished_at = time.time()
+            self.condition.notify_all()
+            return True
+
+    def cancel(self):
+        """
+        Ask the job to stop.
+
+        Returns:
+            bool: True if the job was pending and is now cancelled; a running
+                job stops in its worker
+        """
+        with self.condition:
+            self.cancelled.set()
+            if self.state != "pending":
+                return False
+            self.state = "cancelled"
+            self.finished_at = time.time()
+            self.condition.notify_all()
+            return True
+
+    def read_events(self, start=0):
+        """Yield the events from index start, waiting for new ones until the job ends"""
+        index = start
+        while True:
+            with self.condition:
+                while index >= len(self.events) and self.state not in FINAL_STATES:
+                    self.condition.wait()
+                if index >= len(self.events):
+                    return
+                event = self.events[index]
+            index += 1
+            yield event
+
+    def status(self):
+        """
+        Get the state of the job.
+
+        Returns:
+            dict: State, whether a cancel was requested, text generated so
+                far, usage, error and timestamps
+        """
+        with self.condition:
+            return {
+                "id": self.id,
+                "conversation_id": self.conversation_id,
+                "model": self.model,
+                "message_id": self.message_id,
+                "state": self.state,
+                "cancel_requested": self.cancelled.is_set(),
+                "response": self.response,
+                "reasoning": self.reasoning,
+                "usage": self.usage,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+
+class JobQueue:
+    """
+    Worker pool running Jobs, with their state saved to the conversation store.
+
+    A job keeps running when its client goes away, so its result is still
+    written to the conversation. The jobs that were pending or running
+    when the process stopped are marked as failed on the next start.
+    """
+
+    def __init__(self, run, store, settings=None):
+        """
+        Create the job queue.
+
+        Parameters:
+            run (callable): Called as run(job, *args) in a worker to perform a job
+            store (ConversationStore): Store the job records are saved to
+            settings (dict): The "jobs" section of model_config.json
+        """
+        self.settings = {**DEFAULT_JOB_SETTINGS, **(settings or {})}
+        self.run = run
+        self.store = store
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.settings["workers"], thread_name_prefix="job")
+        store.interrupt_jobs()
+        store.prune_jobs(time.time() - self.settings["keep_days"] * 86400)
+
+    def submit(self, job, *args):
+        """
+        Queue a job.
+
+        Parameters:
+            job (Job): The pending job
+            *args: Extra arguments passed to run()
+
+        Returns:
+            Job: The job
+        """
+        self.store.insert_job(job.status())
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self.executor.submit(self._run, job, args)
+        return job
+
+    def _run(self, job, args):
+        if not job.start():
+            return
+        self.store.update_job(job.status())
+        try:
+            self.run(job, *args)
+        except Exception as e:
+            job.add_event({"type": "error", "text": f"Error: {str(e)}"})
+        if job.cancelled.is_set():
+            job.finish("cancelled")
+        else:
+            job.finish("failed" if job.error else "finished")
+        self.store.update_job(job.status())
+
+    def _forget_finished(self):
+        """Drop the oldest finished jobs from memory above keep_in_memory"""
+        excess = len(self._jobs) - self.settings["keep_in_memory"]
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].state in FINAL_STATES:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id):
+        """
+        Find a job in memory or in the store.
+
+        Returns:
+            Job: The job, or None if it does not exist
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        record = self.store.get_job(job_id)
+        return Job.from_record(record) if record is not None else None
+
+    def cancel(self, job_id):
+        """
+        Cancel a pending or running job.
+
+        A running job stops reading the model stream, which closes the model
+        call, and its partial reply is not added to the conversation.
+
+        Returns:
+            Job: The job, or None if it is not in progress
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.state in FINAL_STATES:
+            return None
+        if job.cancel():
+            self.store.update_job(job.status())
+        return job
+
+    def stats(self):
+        """
+        Count the jobs in progress.
+
+        Returns:
+            dict: Number of pending and running jobs
+        """
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {"pending": states.count("pending"), "running": states.count("running")}
@@ -0,0 +1,68 @@
+# Default prompt caching settings, overridden by the "message_format"
+# section of model_config.json
+DEFAULT_FORMAT_SETTINGS = {
+    # Model names whose requests get a Bedrock prompt cache point; None
+    # gives one to every model whose id supports prompt caching
+    "cache_point_models": None,
+    # Smallest request, in estimated tokens, worth a cache point; smaller
+    # prefixes are not cached by Bedrock
+    "cache_point_min_tokens": 1024
+}
+
+# Bedrock model ids, without their region prefix, of the model families
+# that accept a cachePoint block in Converse requests
+CACHE_POINT_MODEL_IDS = (
+    "anthropic.claude-3-5-haiku",
+    "anthropic.claude-3-7-sonnet",
+    "anthropic.claude-sonnet-4",
+    "anthropic.claude-opus-4",
+    "amazon.nova-"
+)
+
+
+def supports_cache_point(model_id):
+    """
+    Tell whether a Bedrock model supports prompt caching.
+
+    Parameters:
+        model_id (str): Model or inference profile id, e.g. 'us.amazon.nova-pro-v1:0'
+
+    Returns:
+        bool: True if Converse requests of the model may carry a cache point
+    """
+    return any(family in model_id for family in CACHE_POINT_MODEL_IDS)
+
+
+def cache_point_tokens(settings, model_name, model_id):
+    """
+    Get the smallest request given a prompt cache point for a model.
+
+    Parameters:
+        settings (dict): Prompt caching settings, see DEFAULT_FORMAT_SETTINGS
+        model_name (str): Name of the model
+        model_id (str): Bedrock id of the model
+
+    Returns:
+        int: Estimated tokens, or None for a model without cache points
+    """
+    models = settings["cache_point_models"]
+    enabled = supports_cache_point(model_id) if models is None else model_name in models
+    return settings["cache_point_min_tokens"] if enabled else None
+
+
+def with_cache_point(formatted):
+    """
+    Close a Converse request with a prompt cache point.
+
+    Bedrock caches the request up to the cache point, and the next turn of
+    the conversation, which starts with the same messages, reads that
+    prefix from the cache instead of processing it again.
+
+    Parameters:
+        formatted (list): Converse messages, left unchanged
+
+    Returns:
+        list: The messages with a cachePoint block after the last one's content
+    """
+    last = formatted[-1]
+    return formatted[:-1] + [{**last, "content": list(last["content"]) + [{"cachePoint": {"type": "default"}}]}]
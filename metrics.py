@@ -0,0 +1,219 @@
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+
+
+def format_labels(labels):
+    """Format a label tuple as a Prometheus label set"""
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [f"{name}{format_labels(labels)} {self.value}"]
+
+
+class Histogram:
+    """Histogram with fixed upper bounds, rendered with cumulative buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels((*labels, ('le', bound)))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of counters and histograms rendered in Prometheus text format.
+
+    Metrics are created on first use for each label set; after that a
+    record costs one dictionary lookup and one short locked update.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, kind, help_text, labels, factory):
+        key = (name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[key] = metric
+                    self._families.setdefault(name, (kind, help_text))
+        return metric
+
+    def counter(self, name, help_text, **labels):
+        """
+        Return the counter of a metric for a label set.
+
+        Parameters:
+            name (str): Metric name
+            help_text (str): Description shown in the HELP line
+            **labels: Label values
+
+        Returns:
+            Counter: The counter
+        """
+        return self._get(name, "counter", help_text, tuple(sorted(labels.items())), Counter)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Return the histogram of a metric for a label set.
+
+        Parameters:
+            name (str): Metric name
+            help_text (str): Description shown in the HELP line
+            buckets (tuple): Upper bounds of the buckets
+            **labels: Label values
+
+        Returns:
+            Histogram: The histogram
+        """
+        return self._get(name, "histogram", help_text, tuple(sorted(labels.items())),
+                         lambda: Histogram(buckets))
+
+    def render(self):
+        """
+        Render every metric in Prometheus text exposition format.
+
+        Returns:
+            str: The metrics text
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+            families = dict(self._families)
+        lines = []
+        current = None
+        for (name, labels), metric in metrics:
+            if name != current:
+                kind, help_text = families[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                current = name
+            lines.extend(metric.samples(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+def format_samples(name, help_text, kind, values):
+    """
+    Render samples computed at scrape time, such as limiter or cache state.
+
+    Parameters:
+        name (str): Metric name
+        help_text (str): Description shown in the HELP line
+        kind (str): 'gauge' or 'counter'
+        values (list): (labels dict, value) pairs
+
+    Returns:
+        str: The metrics text
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in values:
+        lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def read_usage(response):
+    """
+    Extract the token counts of a Bedrock response.
+
+    Converse responses carry a 'usage' field; invoke_model responses report
+    the counts in HTTP headers.
+
+    Returns:
+        tuple: (input_tokens, output_tokens), None when unknown
+    """
+    usage = response.get("usage")
+    if usage:
+        return usage.get("inputTokens"), usage.get("outputTokens")
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    input_tokens = headers.get("x-amzn-bedrock-input-token-count")
+    output_tokens = headers.get("x-amzn-bedrock-output-token-count")
+    return (
+        int(input_tokens) if input_tokens is not None else None,
+        int(output_tokens) if output_tokens is not None else None
+    )
+
+
+def record_model_call(model_id, operation, duration, input_tokens=None, output_tokens=None,
+                      time_to_first_token=None, error=False):
+    """
+    Record one Bedrock call.
+
+    Parameters:
+        model_id (str): Bedrock model ID
+        operation (str): 'invoke_model', 'converse' or 'converse_stream'
+        duration (float): Total latency in seconds, including queueing
+        input_tokens (int): Input tokens reported by Bedrock, if known
+        output_tokens (int): Output tokens reported by Bedrock, if known
+        time_to_first_token (float): Seconds until the first streamed delta
+        error (bool): True if the call failed
+    """
+    registry.counter("model_requests_total", "Bedrock calls", model=model_id, operation=operation).inc()
+    if error:
+        registry.counter("model_errors_total", "Failed Bedrock calls", model=model_id, operation=operation).inc()
+        return
+
+    registry.histogram("model_request_duration_seconds", "Total latency of Bedrock calls",
+                       model=model_id, operation=operation).observe(duration)
+    if time_to_first_token is not None:
+        registry.histogram("model_time_to_first_token_seconds", "Time until the first streamed token",
+                           model=model_id).observe(time_to_first_token)
+    if input_tokens is not None:
+        registry.histogram("model_input_tokens", "Input tokens per call", TOKEN_BUCKETS,
+                           model=model_id).observe(input_tokens)
+    if output_tokens is not None:
+        registry.histogram("model_output_tokens", "Output tokens per call", TOKEN_BUCKETS,
+                           model=model_id).observe(output_tokens)
+        # Generation speed, measured after the first token when streaming
+        generation_time = duration - (time_to_first_token or 0)
+        if generation_time > 0:
+            registry.histogram("model_output_tokens_per_second", "Output tokens per second", RATE_BUCKETS,
+                               model=model_id).observe(output_tokens / generation_time)
@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+
+# Prefixes of cross-region inference profile ids, e.g. "us.deepseek.r1-v1:0"
+PROFILE_PREFIXES = ("us", "eu", "apac", "us-gov", "global")
+
+
+def base_model_id(model_id, profiles=None):
+    """
+    Return the foundation model id behind a model or inference profile id.
+
+    Parameters:
+        model_id (str): Foundation model id or inference profile id
+        profiles (dict): Known inference profile summaries keyed by id
+
+    Returns:
+        str: The foundation model id
+    """
+    profile = (profiles or {}).get(model_id)
+    if profile and profile.get("models"):
+        # arn:aws:bedrock:<region>::foundation-model/<model id>
+        return profile["models"][0]["modelArn"].split("/", 1)[-1]
+    prefix, _, rest = model_id.partition(".")
+    if prefix in PROFILE_PREFIXES and rest:
+        return rest
+    return model_id
+
+
+class ModelCatalog:
+    """
+    Local cache of the Bedrock model summaries and inference profiles.
+
+    The catalog is read from a JSON file at startup and only refreshed from
+    the Bedrock control plane in a background thread, so resolving ids and
+    capabilities never makes a network call on the request path.
+    """
+
+    def __init__(self, cache_path="model_catalog.json", region_name="us-east-1", ttl=86400):
+        """
+        Create a catalog.
+
+        Parameters:
+            cache_path (str): Path of the JSON cache file
+            region_name (str): AWS region of the catalog
+            ttl (float): Age in seconds after which the cache is refreshed
+        """
+        self.cache_path = cache_path
+        self.region_name = region_name
+        self.ttl = ttl
+        self.fetched_at = 0
+        self.models = {}
+        self.profiles = {}
+        self.details = {}
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._listeners = []
+
+    def load(self):
+        """
+        Load the cache file if it exists and matches the region.
+
+        Returns:
+            bool: True if a cache was loaded
+        """
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable model catalog {self.cache_path}: {e}")
+            return False
+        if data.get("region") != self.region_name:
+            return False
+        self.models = data.get("models", {})
+        self.profiles = data.get("profiles", {})
+        self.details = data.get("details", {})
+        self.fetched_at = data.get("fetched_at", 0)
+        return True
+
+    def save(self):
+        """Write the catalog to the cache file atomically"""
+        data = {
+            "region": self.region_name,
+            "fetched_at": self.fetched_at,
+            "models": self.models,
+            "profiles": self.profiles,
+            "details": self.details
+        }
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.cache_path)
+
+    def is_stale(self):
+        """Return True if the catalog is empty or older than the TTL"""
+        return not self.models or time.time() - self.fetched_at > self.ttl
+
+    def on_refresh(self, listener):
+        """Register a function called with the catalog after each refresh"""
+        self._listeners.append(listener)
+
+    def _client(self):
+        # Imported here so loading the cached catalog does not load boto3
+        import boto3
+        return boto3.session.Session().client("bedrock", region_name=self.region_name)
+
+    def refresh(self):
+        """Fetch the model summaries and inference profiles from Bedrock and save them"""
+        client = self._client()
+        models = {
+            summary["modelId"]: summary
+            for summary in client.list_foundation_models()["modelSummaries"]
+        }
+        profiles = {}
+        kwargs = {}
+        while True:
+            response = client.list_inference_profiles(**kwargs)
+            for summary in response.get("inferenceProfileSummaries", []):
+                profiles[summary["inferenceProfileId"]] = summary
+            if not response.get("nextToken"):
+                break
+            kwargs = {"nextToken": response["nextToken"]}
+
+        # Replace whole dictionaries so readers never see a partial catalog
+        self.models = models
+        self.profiles = profiles
+        self.fetched_at = time.time()
+        self.save()
+        for listener in self._listeners:
+            listener(self)
+
+    def refresh_in_background(self, force=False):
+        """
+        Start a refresh thread if the catalog is stale and none is running.
+
+        Parameters:
+            force (bool): Refresh even if the catalog is fresh
+
+        Returns:
+            bool: True if a refresh was started
+        """
+        with self._refresh_lock:
+            if self._refreshing or not (force or self.is_stale()):
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Could not refresh the model catalog: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def start_auto_refresh(self, interval=None):
+        """
+        Refresh the catalog now if stale, then every `interval` seconds.
+
+        Parameters:
+            interval (float): Seconds between refreshes, defaults to the TTL
+        """
+        interval = interval or self.ttl
+        self.refresh_in_background()
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.refresh_in_background(force=True)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def get_model_details(self, model_id):
+        """
+        Get the details of a foundation model, fetched once then cached.
+
+        This calls Bedrock on the first use of a model, so it is meant for
+        tools rather than the request path.
+
+        Returns:
+            dict: The 'modelDetails' of get_foundation_model
+        """
+        if model_id not in self.details:
+            response = self._client().get_foundation_model(modelIdentifier=model_id)
+            self.details[model_id] = response["modelDetails"]
+            self.save()
+        return self.details[model_id]
+
+    def resolve_model_id(self, model_id):
+        """
+        Return the id to call for a model.
+
+        Models that cannot be invoked on demand are swapped for an inference
+        profile of the catalog region that serves them, when one is known.
+
+        Parameters:
+            model_id (str): Configured foundation model or profile id
+
+        Returns:
+            str: The model or inference profile id to call
+        """
+        if model_id in self.profiles:
+            return model_id
+        summary = self.models.get(model_id)
+        if summary is None or "ON_DEMAND" in summary.get("inferenceTypesSupported", ["ON_DEMAND"]):
+            return model_id
+        for profile_id, profile in self.profiles.items():
+            if base_model_id(profile_id, self.profiles) == model_id and profile_id.startswith(
+                    self.region_name.split("-")[0] + "."):
+                return profile_id
+        return model_id
+
+    def capabilities(self, model_id, overrides=None):
+        """
+        Describe what a model supports.
+
+        Parameters:
+            model_id (str): Foundation model or inference profile id
+            overrides (dict): Values from the configuration, e.g. 'reasoning'
+                and 'max_output_tokens', which the summaries do not include
+
+        Returns:
+            dict: Capabilities of the model
+        """
+        summary = self.models.get(base_model_id(model_id, self.profiles), {})
+        capabilities = {
+            "model_id": model_id,
+            "provider": summary.get("providerName"),
+            "streaming": summary.get("responseStreamingSupported", True),
+            "input_modalities": summary.get("inputModalities", ["TEXT"]),
+            "output_modalities": summary.get("outputModalities", ["TEXT"]),
+            "inference_types": summary.get("inferenceTypesSupported", []),
+            "reasoning": False,
+            "max_output_tokens": None
+        }
+        capabilities.update(overrides or {})
+        return capabilities
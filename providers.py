@@ -0,0 +1,235 @@
+import importlib
+import threading
+import time
+
+from rate_limiter import configure_limiters
+from response_cache import CachedModel, ResponseCache
+from single_flight import CoalescedModel, SingleFlight
+
+# Used when model_config.json has no "providers" section
+DEFAULT_PROVIDERS = {
+    "bedrock": {
+        "module": "bedrock_models",
+        "models": {
+            "deepseek": "DeepSeekModel",
+            "claude": "ClaudeModel",
+            "mistral": "MistralModel"
+        }
+    }
+}
+
+_config = {}
+_providers = dict(DEFAULT_PROVIDERS)
+_modules = {}
+_models = {}
+_load_report = {}
+_lock = threading.Lock()
+# Shared response cache, enabled by the "cache" section of model_config.json
+response_cache = None
+# Identical calls in flight, merged when "coalesce" is enabled in model_config.json
+single_flight = None
+
+
+def _configure_limiters(retired_ids=()):
+    """Map the per-model-name rate limits onto the current model ids"""
+    limits = dict(_config.get("rate_limits", {}))
+    default_limits = limits.pop("default", {})
+    model_ids = _config.get("model_ids", {})
+    configure_limiters(
+        {model_ids[name]: settings for name, settings in limits.items() if name in model_ids},
+        default_limits,
+        retired_ids
+    )
+
+
+def configure_providers(config):
+    """
+    Apply model_config.json to the provider registry.
+
+    Each entry of "providers" names the module implementing a backend and
+    the model class of each model name it serves. Modules are imported the
+    first time one of their models is used, so a provider that is never used
+    costs nothing. A provider module exposes configure_registry(config,
+    models), get_model(model_name, region_name) and warm_models(model_names,
+    region_name). The "rate_limits" of every model are applied here, as the
+    limiters are shared by all providers.
+
+    Parameters:
+        config (dict): The loaded model configuration
+    """
+    global _config, _providers, response_cache, single_flight
+    with _lock:
+        _config = config
+        _providers = config.get("providers", DEFAULT_PROVIDERS)
+        _configure_limiters()
+        cache_settings = config.get("cache", {})
+        if cache_settings.get("enabled", False):
+            response_cache = ResponseCache(
+                max_entries=cache_settings.get("max_entries", 1000),
+                ttl=cache_settings.get("ttl", 3600),
+                disk_path=cache_settings.get("disk_path"),
+                max_disk_entries=cache_settings.get("max_disk_entries", 10000),
+                bypass_sampled=cache_settings.get("bypass_sampled", False)
+            )
+        else:
+            response_cache = None
+        single_flight = SingleFlight() if config.get("coalesce", {}).get("enabled", False) else None
+        _models.clear()
+        # Providers already imported pick up the new settings right away
+        for name, module in _modules.items():
+            if name in _providers:
+                module.configure_registry(config, _providers[name]["models"])
+
+
+def provider_of(model_name):
+    """
+    Return the name of the provider serving a model.
+
+    Raises:
+        ValueError: If no provider declares the model
+    """
+    for provider_name, provider in _providers.items():
+        if model_name in provider["models"]:
+            return provider_name
+    raise ValueError(f"Unknown model: {model_name}")
+
+
+def load_provider(provider_name):
+    """
+    Import and configure a provider module on first use.
+
+    Parameters:
+        provider_name (str): Key of the provider in the "providers" section
+
+    Returns:
+        module: The provider module
+    """
+    module = _modules.get(provider_name)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = _modules.get(provider_name)
+        if module is None:
+            provider = _providers[provider_name]
+            start = time.perf_counter()
+            module = importlib.import_module(provider["module"])
+            imported = time.perf_counter()
+            module.configure_registry(_config, provider["models"])
+            _load_report[provider_name] = {
+                "module": provider["module"],
+                "import_ms": round((imported - start) * 1000, 2),
+                "configure_ms": round((time.perf_counter() - imported) * 1000, 2),
+                "loaded_at": time.time()
+            }
+            _modules[provider_name] = module
+    return module
+
+
+def get_model(model_name, region_name=None, cached=True):
+    """
+    Return the shared instance of a model from its provider.
+
+    When coalescing is enabled the instance is wrapped in a CoalescedModel,
+    so identical concurrent calls share one model call, and when the
+    response cache is enabled that is wrapped in a CachedModel.
+
+    Parameters:
+        model_name (str): Name of the model
+        region_name (str): Region of the model, defaults to the configured one
+        cached (bool): Set to False to bypass the response cache
+
+    Returns:
+        The model instance
+
+    Raises:
+        ValueError: If the model name is not recognized
+    """
+    region_name = region_name or _config.get("region", "us-east-1")
+    cached = cached and response_cache is not None
+    key = (model_name, region_name, cached)
+    model = _models.get(key)
+    if model is None:
+        model = load_provider(provider_of(model_name)).get_model(model_name, region_name)
+        if single_flight is not None:
+            model = CoalescedModel(model, single_flight)
+        if cached:
+            model = CachedModel(model, response_cache)
+        _models[key] = model
+    return model
+
+
+def warm_models(model_names, region_name=None):
+    """
+    Import the providers of some models and build their clients.
+
+    Returns:
+        list: Names of the models that could not be prepared
+    """
+    region_name = region_name or _config.get("region", "us-east-1")
+    failed = []
+    for model_name in model_names:
+        try:
+            load_provider(provider_of(model_name)).warm_models([model_name], region_name)
+        except Exception as e:
+            print(f"Could not warm model {model_name}: {e}")
+            failed.append(model_name)
+    return failed
+
+
+def warm_in_background(model_names, region_name=None):
+    """Run warm_models() in a daemon thread so startup does not wait for it"""
+    thread = threading.Thread(target=warm_models, args=(model_names, region_name), daemon=True)
+    thread.start()
+    return thread
+
+
+def set_model_ids(model_ids):
+    """
+    Change the ids of some models, for example after a catalog refresh.
+
+    Providers not imported yet will use the new ids when they are loaded.
+
+    Parameters:
+        model_ids (dict): Model ids keyed by model name
+    """
+    global _config
+    with _lock:
+        current = _config.get("model_ids", {})
+        model_ids = {name: model_id for name, model_id in model_ids.items() if current.get(name) != model_id}
+        if not model_ids:
+            return
+        _config = {**_config, "model_ids": {**current, **model_ids}}
+        # Only the limiters of the replaced ids are dropped; the others keep
+        # the concurrency they have learned
+        in_use = set(_config["model_ids"].values())
+        _configure_limiters({current[name] for name in model_ids if name in current} - in_use)
+        for key in [key for key in _models if key[0] in model_ids]:
+            del _models[key]
+        modules = dict(_modules)
+    for name, module in modules.items():
+        if hasattr(module, "set_model_ids"):
+            module.set_model_ids({
+                model_name: model_id for model_name, model_id in model_ids.items()
+                if model_name in _providers[name]["models"]
+            })
+
+
+def get_model_id(model_name):
+    """Return the id configured for a model name, or None"""
+    return _config.get("model_ids", {}).get(model_name)
+
+
+def load_report():
+    """
+    Describe which providers are loaded and what loading them cost.
+
+    Returns:
+        dict: Load timings keyed by provider name, plus the declared
+            providers that have not been loaded
+    """
+    with _lock:
+        return {
+            "loaded": dict(_load_report),
+            "not_loaded": [name for name in _providers if name not in _modules]
+        }
@@ -0,0 +1,313 @@
+import random
+import threading
+import time
+
+# Error codes returned by Bedrock when a quota is exceeded, lower-cased because
+# errors raised inside a stream use camelCase names such as "throttlingException"
+THROTTLING_CODES = ("throttlingexception", "toomanyrequestsexception", "serviceunavailableexception")
+
+DEFAULT_LIMIT_SETTINGS = {
+    "requests_per_minute": None,
+    "tokens_per_minute": None,
+    "initial_concurrency": 4,
+    "min_concurrency": 1,
+    "max_concurrency": 32,
+    "max_retries": 5,
+    "base_delay": 0.5,
+    "max_delay": 20,
+    "max_queue_wait": 300
+}
+
+_settings = {}
+_default_settings = dict(DEFAULT_LIMIT_SETTINGS)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def is_throttling_error(error):
+    """Return True if an exception is a Bedrock or Gemini throttling error"""
+    # google-genai APIErrors carry the HTTP status in `code`
+    if getattr(error, "code", None) == 429:
+        return True
+    # botocore ClientErrors carry the error code in `response`; checked by
+    # attribute so importing this module does not load botocore
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code", "").lower() in THROTTLING_CODES
+
+
+class QueueTimeout(Exception):
+    """Raised when a call waited longer than max_queue_wait for capacity"""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+
+    The capacity is one minute of refill, so a quiet period allows a burst
+    of up to the per-minute quota.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be taken (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency and rate limiter for one Bedrock model.
+
+    Calls wait in a queue until a concurrency slot is free and the request
+    and token buckets have room. The concurrency limit adapts AIMD-style: it
+    grows by one after a full window of successful calls and is halved when
+    Bedrock throttles. Throttled calls are retried with exponential backoff
+    and full jitter.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, initial_concurrency=4,
+                 min_concurrency=1, max_concurrency=32, max_retries=5, base_delay=0.5, max_delay=20,
+                 max_queue_wait=300):
+        """
+        Create a limiter.
+
+        Parameters:
+            requests_per_minute (int): Request quota, None for no limit
+            tokens_per_minute (int): Token quota (input estimate plus max output), None for no limit
+            initial_concurrency (int): Starting number of concurrent calls
+            min_concurrency (int): Lowest concurrency limit after throttling
+            max_concurrency (int): Highest concurrency limit
+            max_retries (int): Retries of a throttled call before giving up
+            base_delay (float): First backoff delay in seconds
+            max_delay (float): Longest backoff delay in seconds
+            max_queue_wait (float): Longest wait for capacity in seconds, None to wait forever
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.limit = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_queue_wait = max_queue_wait
+        self._condition = threading.Condition()
+        self._successes = 0
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.throttled = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    def _wait_time(self, tokens):
+        """Seconds before a call can start, 0 if it can start now"""
+        if self.in_flight >= self.limit:
+            return None
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        """
+        Wait for a concurrency slot and rate budget.
+
+        Parameters:
+            tokens (int): Estimated tokens of the call
+
+        Raises:
+            QueueTimeout: If no capacity freed up within max_queue_wait
+        """
+        deadline = None if self.max_queue_wait is None else time.monotonic() + self.max_queue_wait
+        with self._condition:
+            self.queued += 1
+            try:
+                while True:
+                    wait = self._wait_time(tokens)
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise QueueTimeout("Timed out waiting for model capacity")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    # Woken by release() when a slot frees up, or after the bucket refill time
+                    self._condition.wait(wait)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def release(self, throttled=False):
+        """
+        Free a slot and adapt the concurrency limit.
+
+        Parameters:
+            throttled (bool): True if the call was throttled
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                self._successes = 0
+                # Calls throttled together count as one congestion signal
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(self.min_concurrency, self.limit // 2)
+                    self._last_decrease = now
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def backoff(self, attempt):
+        """Return the jittered delay before retry number `attempt` (0-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, tokens=0, keep_slot=False):
+        """
+        Run `fn` within the limits, retrying it while it is throttled.
+
+        Parameters:
+            fn (callable): The Bedrock call, without arguments
+            tokens (int): Estimated tokens of the call
+            keep_slot (bool): Keep the slot after a successful call, for
+                streams; the caller must then call release()
+
+        Returns:
+            The value returned by fn
+
+        Raises:
+            ClientError: The last throttling error once retries are exhausted,
+                or any other error raised by fn
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.release(throttled=throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise
+                with self._condition:
+                    self.retries += 1
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            if not keep_slot:
+                self.release()
+            return result
+
+    def stats(self):
+        """
+        Get the limiter state.
+
+        Returns:
+            dict: Concurrency limit, in-flight and queued calls, and counters
+        """
+        with self._condition:
+            return {
+                "concurrency_limit": self.limit,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "queue_timeouts": self.timeouts
+            }
+
+
+def configure_limiters(settings_by_model_id, default_settings=None, retired_ids=()):
+    """
+    Set the limiter settings and drop the limiters they change.
+
+    A limiter whose settings are unchanged is kept, with the concurrency it
+    has learned, so reapplying the same settings does not reset it.
+
+    Parameters:
+        settings_by_model_id (dict): Settings keyed by Bedrock model ID
+        default_settings (dict): Settings for models without their own entry
+        retired_ids (iterable): Model IDs no longer used, whose limiters are dropped
+    """
+    global _settings, _default_settings
+    retired_ids = set(retired_ids)
+    with _limiters_lock:
+        previous, previous_default = _settings, _default_settings
+        _default_settings = {**DEFAULT_LIMIT_SETTINGS, **(default_settings or {})}
+        _settings = {
+            model_id: {**_default_settings, **settings}
+            for model_id, settings in settings_by_model_id.items()
+        }
+        for key in list(_limiters):
+            model_id = key[0]
+            if model_id in retired_ids or (
+                _settings.get(model_id, _default_settings) != previous.get(model_id, previous_default)
+            ):
+                del _limiters[key]
+
+
+def get_limiter(model_id, region_name):
+    """
+    Return the limiter shared by every caller of a model in a region.
+
+    Bedrock quotas are per model and region, so each region gets its own
+    limiter, with the settings of the model.
+
+    Parameters:
+        model_id (str): Bedrock model ID
+        region_name (str): Region the model is called in
+
+    Returns:
+        AdaptiveLimiter: The limiter of the model in that region
+    """
+    key = (model_id, region_name)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = AdaptiveLimiter(**_settings.get(model_id, _default_settings))
+                _limiters[key] = limiter
+    return limiter
+
+
+def limiter_stats():
+    """
+    Get the state of every limiter.
+
+    Returns:
+        list: Limiter stats with the 'model' ID and 'region' of each limiter
+    """
+    return [
+        {"model": model_id, "region": region_name, **limiter.stats()}
+        for (model_id, region_name), limiter in sorted(list(_limiters.items()))
+    ]
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(model_id, method, messages, params):
+    """
+    Build the cache key of a model call.
+
+    Parameters:
+        model_id (str): ID of the Bedrock model
+        method (str): 'generate' or 'converse'
+        messages: Prompt string or list of message dictionaries
+        params (dict): Inference parameters of the call
+
+    Returns:
+        str: Hex SHA-256 digest identifying the call
+    """
+    if isinstance(messages, str):
+        normalized = messages.strip()
+    else:
+        normalized = []
+        for message in messages:
+            content = message["content"]
+            if not isinstance(content, str):
+                content = "".join(block.get("text", "") for block in content)
+            normalized.append([message["role"], content.strip()])
+    payload = json.dumps([model_id, method, normalized, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier exact-match cache for model responses.
+
+    Recent entries are kept in an in-memory LRU; when a disk path is given,
+    entries are also written to a SQLite file so they survive restarts.
+    Every entry expires after the TTL.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600, disk_path=None, max_disk_entries=10000,
+                 bypass_sampled=False):
+        """
+        Create a response cache.
+
+        Parameters:
+            max_entries (int): Maximum number of entries kept in memory
+            ttl (float): Lifetime of an entry in seconds
+            disk_path (str): Optional SQLite file for the on-disk tier
+            max_disk_entries (int): Maximum number of entries kept on disk
+            bypass_sampled (bool): Skip the cache for calls with temperature > 0;
+                off by default, as the temperature is part of the key
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.bypass_sampled = bypass_sampled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS responses_expiry ON responses(expires_at)")
+            self._disk.commit()
+
+    def should_bypass(self, temperature):
+        """
+        Tell whether a call must skip the cache.
+
+        Parameters:
+            temperature (float): Temperature of the call
+
+        Returns:
+            bool: True if the call must go to the model
+        """
+        if self.bypass_sampled and temperature > 0:
+            with self._lock:
+                self.bypassed += 1
+            return True
+        return False
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Store a response.
+
+        Parameters:
+            key (str): Key from make_key()
+            value: JSON-serializable response
+        """
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._disk_writes += 1
+                # Trim the disk tier every so often rather than on every write
+                if self._disk_writes % 100 == 0:
+                    self._trim_disk()
+                self._disk.commit()
+
+    def _remember(self, key, value, expires_at):
+        """Insert into the memory tier and evict the least recently used entries"""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _trim_disk(self):
+        """Drop expired entries, then the oldest ones above max_disk_entries"""
+        self._disk.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self._disk.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM responses")
+                self._disk.commit()
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: Hits, misses, bypassed calls, hit rate and memory size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl
+            }
+
+
+class CachedModel:
+    """
+    Wrapper that answers repeated model calls from a ResponseCache.
+
+    It exposes the same generate/converse/stream interface as BedrockModel
+    and forwards any other attribute to the wrapped model.
+    """
+
+    def __init__(self, model, cache):
+        """
+        Wrap a model.
+
+        Parameters:
+            model (BedrockModel): The model to call on a miss
+            cache (ResponseCache): The shared cache
+        """
+        self.model = model
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    @staticmethod
+    def _entry(result):
+        # A hit costs no tokens, so the usage of the original call is not kept
+        return {key: value for key, value in result.items() if key != "usage"}
+
+    def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
+        """Cached BedrockModel.generate()"""
+        if self.cache.should_bypass(temperature):
+            return self.model.generate(prompt, max_tokens, temperature, top_p)
+
+        params = {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+        key = make_key(self.model.model_id, "generate", prompt, params)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.model.generate(prompt, max_tokens, temperature, top_p)
+            if not response.startswith("Error:"):
+                self.cache.put(key, response)
+        return response
+
+    def converse(self, messages, max_tokens=2000, temperature=0.3):
+        """Cached BedrockModel.converse()"""
+        if self.cache.should_bypass(temperature):
+            return self.model.converse(messages, max_tokens, temperature)
+
+        params = {"max_tokens": max_tokens, "temperature": temperature}
+        key = make_key(self.model.model_id, "converse", messages, params)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.model.converse(messages, max_tokens, temperature)
+            if not result["response"].startswith("Error:"):
+                self.cache.put(key, self._entry(result))
+        return result
+
+    def stream(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Cached BedrockModel.stream().
+
+        A hit is replayed as one reasoning event and one text event. On a
+        miss the events are forwarded as they arrive and the assembled reply
+        is stored once the stream completes without error. Streams share
+        their entries with converse().
+        """
+        if self.cache.should_bypass(temperature):
+            yield from self.model.stream(messages, max_tokens, temperature)
+            return
+
+        params = {"max_tokens": max_tokens, "temperature": temperature}
+        key = make_key(self.model.model_id, "converse", messages, params)
+        result = self.cache.get(key)
+        if result is not None:
+            if result["reasoning"]:
+                yield {"type": "reasoning", "text": result["reasoning"]}
+            yield {"type": "text", "text": result["response"]}
+            return
+
+        response, reasoning, failed = "", "", False
+        for event in self.model.stream(messages, max_tokens, temperature):
+            if event["type"] == "text":
+                response += event["text"]
+            elif event["type"] == "reasoning":
+                reasoning += event["text"]
+            elif event["type"] == "error":
+                failed = True
+            yield event
+        if not failed:
+            self.cache.put(key, {"response": response, "reasoning": reasoning})
@@ -0,0 +1,436 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from context_window import estimate_message_tokens, estimate_tokens
+from metrics import registry
+from providers import get_model
+
+DEFAULT_ROUTING_SETTINGS = {
+    "enabled": False,
+    # Endpoints of each model name in order of preference, e.g.
+    # "claude": [{"model": "claude", "region": "us-east-1"},
+    #            {"model": "claude", "region": "us-west-2"},
+    #            {"model": "mistral"}]
+    "routes": {},
+    # Hedged calls are paid twice, so hedging is opt-in
+    "hedge": False,
+    # Seconds before hedging while an endpoint has fewer than min_samples
+    "hedge_delay": 10,
+    "stream_hedge_delay": 3,
+    "hedge_percentile": 0.95,
+    "window": 100,
+    "min_samples": 10,
+    "max_error_rate": 0.5,
+    "unhealthy_cooldown": 60,
+    "workers": 32
+}
+
+
+class LatencyWindow:
+    """Rolling window of the latest call latencies and errors of an endpoint"""
+
+    def __init__(self, size):
+        self.latencies = deque(maxlen=size)
+        self.outcomes = deque(maxlen=size)
+        self.last_error_at = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self.outcomes.append(error)
+            if error:
+                self.last_error_at = time.time()
+            else:
+                self.latencies.append(latency)
+
+    def percentile(self, fraction):
+        """Return a latency percentile of the successful calls, or None without samples"""
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def samples(self):
+        return len(self.latencies)
+
+    def error_rate(self):
+        with self._lock:
+            return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class Router:
+    """
+    Route model calls to the fastest healthy endpoint and hedge slow calls.
+
+    An endpoint is a (model name, region) pair. The router keeps a rolling
+    window of the latency of each endpoint: total latency for converse and
+    generate calls, time to first token for streams. Calls go to the
+    healthy endpoint with the lowest median latency. When the call has not
+    answered by the endpoint's p95 latency, a hedged duplicate is sent to
+    the next endpoint; the first good answer wins. A losing stream is
+    closed; a losing call cannot be aborted, so the tokens of its answer
+    are passed to the on_discarded() callbacks.
+    """
+
+    def __init__(self, settings, region_name):
+        """
+        Create a router.
+
+        Parameters:
+            settings (dict): The "routing" section of model_config.json
+            region_name (str): Region of endpoints that do not name one
+        """
+        self.settings = {**DEFAULT_ROUTING_SETTINGS, **settings}
+        self.region_name = region_name
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._discard_callbacks = []
+        # Runs the generate and converse calls; streams get their own threads
+        self.executor = ThreadPoolExecutor(max_workers=self.settings["workers"], thread_name_prefix="route")
+
+    def endpoints(self, model_name):
+        """Return the configured (model, region) endpoints of a model name"""
+        routes = self.settings["routes"].get(model_name) or [{"model": model_name}]
+        return [(route.get("model", model_name), route.get("region", self.region_name)) for route in routes]
+
+    def window(self, endpoint, kind):
+        """Return the latency window of an endpoint for 'total' or 'ttft' latencies"""
+        key = (endpoint, kind)
+        window = self._windows.get(key)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(key, LatencyWindow(self.settings["window"]))
+        return window
+
+    def record(self, endpoint, kind, latency, error=False):
+        self.window(endpoint, kind).record(latency, error)
+
+    def is_healthy(self, endpoint, kind):
+        """An endpoint is unhealthy while it fails often and has failed recently"""
+        window = self.window(endpoint, kind)
+        return (window.error_rate() <= self.settings["max_error_rate"]
+                or time.time() - window.last_error_at > self.settings["unhealthy_cooldown"])
+
+    def ranked(self, model_name, kind):
+        """
+        Order the endpoints of a model name by preference.
+
+        Healthy endpoints come first, measured ones by median latency, then
+        the endpoints without enough samples in their configured order.
+        """
+        def score(item):
+            index, endpoint = item
+            window = self.window(endpoint, kind)
+            measured = window.samples() >= self.settings["min_samples"]
+            median = window.percentile(0.5) if measured else float("inf")
+            return (not self.is_healthy(endpoint, kind), median, index)
+
+        return [endpoint for _, endpoint in sorted(enumerate(self.endpoints(model_name)), key=score)]
+
+    def hedge_delay(self, endpoint, kind):
+        """Return how long to wait for an endpoint before sending a hedged call"""
+        window = self.window(endpoint, kind)
+        if window.samples() >= self.settings["min_samples"]:
+            return window.percentile(self.settings["hedge_percentile"])
+        return self.settings["stream_hedge_delay" if kind == "ttft" else "hedge_delay"]
+
+    def on_discarded(self, callback):
+        """Call a function with the usage of every answer dropped by a hedge"""
+        self._discard_callbacks.append(callback)
+
+    def discarded(self, model_name, usage):
+        """Count and report the tokens of a dropped answer"""
+        tokens = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+        registry.counter("route_discarded_tokens_total", "Tokens of hedged answers that were dropped",
+                         model=model_name).inc(tokens)
+        for callback in self._discard_callbacks:
+            callback(tokens)
+
+    def get_model(self, model_name, cached=True):
+        """
+        Return the model to call for a model name.
+
+        Parameters:
+            model_name (str): Name of the model
+            cached (bool): Set to False to bypass the response cache
+
+        Returns:
+            A RoutedModel when routing is enabled, else the model itself
+
+        Raises:
+            ValueError: If the model name is not recognized
+        """
+        if not self.settings["enabled"]:
+            return get_model(model_name, self.region_name, cached=cached)
+        # Fails early on unknown names, like get_model()
+        for name, region in self.endpoints(model_name):
+            get_model(name, region, cached=cached)
+        return RoutedModel(self, model_name, cached)
+
+    def stats(self):
+        """
+        Get the latency and health of every endpoint used so far.
+
+        Returns:
+            list: One entry per endpoint and latency kind
+        """
+        with self._lock:
+            windows = dict(self._windows)
+        return [
+            {
+                "model": model_name,
+                "region": region,
+                "kind": kind,
+                "samples": window.samples(),
+                "p50": window.percentile(0.5),
+                "p95": window.percentile(0.95),
+                "error_rate": window.error_rate(),
+                "healthy": self.is_healthy((model_name, region), kind)
+            }
+            for ((model_name, region), kind), window in sorted(windows.items())
+        ]
+
+
+# Help text of the routing counters, which are labelled by model name
+COUNTERS = {
+    "route_hedges_total": "Hedged model calls",
+    "route_hedge_wins_total": "Hedged calls answered first",
+    "route_failovers_total": "Calls retried on another endpoint after an error"
+}
+
+
+def _count(name, model_name):
+    registry.counter(name, COUNTERS[name], model=model_name).inc()
+
+
+def _is_error(result):
+    text = result if isinstance(result, str) else result.get("response", "")
+    return text.startswith("Error:")
+
+
+class RoutedModel:
+    """
+    Model facade that spreads the calls of a model name over its endpoints.
+
+    Offers the same generate/converse/stream interface as BedrockModel.
+    """
+
+    def __init__(self, router, model_name, cached=True):
+        self.router = router
+        self.model_name = model_name
+        self.cached = cached
+
+    def _model(self, endpoint):
+        return get_model(endpoint[0], endpoint[1], cached=self.cached)
+
+    def _answered(self, usage, endpoint):
+        """Name the endpoint that answered in the usage of a call"""
+        return {**usage, "model": endpoint[0], "region": endpoint[1]}
+
+    def _timed(self, endpoint, call, started):
+        start = time.time()
+        started.set()
+        try:
+            result = call(self._model(endpoint))
+        except Exception as e:
+            result = {"response": f"Error: {str(e)}", "reasoning": ""}
+        self.router.record(endpoint, "total", time.time() - start, _is_error(result))
+        return result
+
+    def _race(self, call):
+        """
+        Run a call on the best endpoint, hedging and failing over.
+
+        A second endpoint is tried when the first is slower than its p95 or
+        fails; the first good answer is returned. The hedge delay counts from
+        when the call starts, not from when it is queued on the executor. A
+        call that already started cannot be aborted, so the tokens of the
+        losing answer are reported to the router once it arrives. The usage
+        of the answer names the endpoint that gave it.
+        """
+        router = self.router
+        remaining = router.ranked(self.model_name, "total")
+        futures = {}
+        hedged = False
+
+        def launch():
+            endpoint = remaining.pop(0)
+            started = threading.Event()
+            futures[router.executor.submit(self._timed, endpoint, call, started)] = (endpoint, started)
+            return endpoint
+
+        def discard(future):
+            if future.cancelled():
+                return
+            result = future.result()
+            if isinstance(result, dict) and result.get("usage"):
+                router.discarded(self.model_name, self._answered(result["usage"], futures[future][0]))
+
+        primary = launch()
+        pending = set(futures)
+        result = None
+        while pending:
+            timeout = None
+            if router.settings["hedge"] and not hedged and remaining and len(pending) == 1:
+                endpoint, started = futures[next(iter(pending))]
+                # A call waiting for a worker cannot answer, so the clock starts with it
+                started.wait()
+                timeout = router.hedge_delay(endpoint, "total")
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                _count("route_hedges_total", self.model_name)
+                launch()
+                pending = {future for future in futures if not future.done()}
+                continue
+            for future in done:
+                result = future.result()
+                if not _is_error(result):
+                    for other in futures:
+                        if other is not future:
+                            other.cancel()
+                            other.add_done_callback(discard)
+                    if hedged and futures[future][0] != primary:
+                        _count("route_hedge_wins_total", self.model_name)
+                    if isinstance(result, dict) and result.get("usage"):
+                        result = {**result, "usage": self._answered(result["usage"], futures[future][0])}
+                    return result
+            if not pending and remaining:
+                _count("route_failovers_total", self.model_name)
+                launch()
+                pending = {future for future in futures if not future.done()}
+        return result
+
+    def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
+        """Routed BedrockModel.generate()"""
+        return self._race(lambda model: model.generate(prompt, max_tokens, temperature, top_p))
+
+    def converse(self, messages, max_tokens=2000, temperature=0.3):
+        """Routed BedrockModel.converse()"""
+        return self._race(lambda model: model.converse(messages, max_tokens, temperature))
+
+    def stream(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Routed BedrockModel.stream().
+
+        Hedging is decided on the time to the first event. The first
+        endpoint to produce a good event is streamed to the caller and the
+        other stream is closed at its next event. Each stream is read by a
+        thread of its own, as a whole generation would hold a worker of the
+        router's executor for its full length.
+
+        A losing stream is reported to the router with its 'usage' event
+        when it got that far, else with an estimate of its input and of the
+        output it produced before being closed. The 'usage' event of the
+        answer names the endpoint that gave it.
+        """
+        router = self.router
+        remaining = router.ranked(self.model_name, "ttft")
+        events = queue.Queue()
+        cancels = {}
+        hedged = False
+        winner = None
+        # Set once the winner is known or the caller went away
+        decided = threading.Event()
+        input_tokens = sum(estimate_message_tokens(m) for m in messages)
+
+        def read(endpoint, cancel):
+            start = time.time()
+            first_event_at = None
+            failed = False
+            stream = None
+            usage = None
+            output = []
+            try:
+                stream = self._model(endpoint).stream(messages, max_tokens, temperature)
+                for event in stream:
+                    if first_event_at is None:
+                        first_event_at = time.time()
+                        failed = event["type"] == "error"
+                    if event["type"] == "usage":
+                        usage = self._answered(event, endpoint)
+                    elif event["type"] != "error":
+                        output.append(event.get("text", ""))
+                    if cancel.is_set():
+                        break
+                    events.put((endpoint, event))
+            except Exception as e:
+                failed = True
+                events.put((endpoint, {"type": "error", "text": f"Error: {str(e)}"}))
+            finally:
+                if stream is not None:
+                    stream.close()
+                if first_event_at is not None or not cancel.is_set():
+                    router.record(endpoint, "ttft", (first_event_at or time.time()) - start,
+                                  failed or first_event_at is None)
+                events.put((endpoint, None))
+            if stream is not None and not failed:
+                decided.wait()
+                if winner is not None and winner != endpoint:
+                    router.discarded(self.model_name, usage or {
+                        "input_tokens": input_tokens, "output_tokens": estimate_tokens("".join(output))
+                    })
+
+        def launch():
+            endpoint = remaining.pop(0)
+            cancels[endpoint] = threading.Event()
+            threading.Thread(target=read, args=(endpoint, cancels[endpoint]),
+                             name="route-stream", daemon=True).start()
+            return endpoint
+
+        primary = launch()
+        running = {primary}
+        error = None
+        try:
+            while True:
+                timeout = None
+                if winner is None and router.settings["hedge"] and not hedged and remaining and len(running) == 1:
+                    timeout = router.hedge_delay(primary, "ttft")
+                try:
+                    endpoint, event = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    _count("route_hedges_total", self.model_name)
+                    running.add(launch())
+                    continue
+
+                if winner is None:
+                    if event is not None and event["type"] != "error":
+                        winner = endpoint
+                        decided.set()
+                        for other, cancel in cancels.items():
+                            if other != winner:
+                                cancel.set()
+                        if hedged and winner != primary:
+                            _count("route_hedge_wins_total", self.model_name)
+                    else:
+                        # This endpoint failed before its first good event
+                        if event is not None:
+                            error = event
+                            cancels[endpoint].set()
+                        else:
+                            running.discard(endpoint)
+                        if not running and not remaining:
+                            if error is not None:
+                                yield error
+                            return
+                        if event is None and not running and remaining:
+                            _count("route_failovers_total", self.model_name)
+                            running.add(launch())
+                        continue
+
+                if endpoint != winner:
+                    continue
+                if event is None:
+                    return
+                if event["type"] == "usage":
+                    event = self._answered(event, endpoint)
+                yield event
+        finally:
+            decided.set()
+            for cancel in cancels.values():
+                cancel.set()
@@ -0,0 +1,266 @@
+import threading
+
+from metrics import registry
+from response_cache import make_key
+
+
+def _count_coalesced(model_id, operation):
+    registry.counter("model_calls_coalesced_total", "Model calls answered by an identical call in flight",
+                     model=model_id, operation=operation).inc()
+
+
+class _Call:
+    """Result of a call shared by its leader and followers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """
+    Events of one model stream, read by every subscriber.
+
+    A pump thread reads the model stream and appends each event; the
+    subscribers replay the events already received, then wait for new ones.
+    The stream is closed early once every subscriber has gone away; it then
+    takes no new subscriber, as they would only get the start of the events.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.stopped = False
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def pump(self, stream):
+        try:
+            for event in stream:
+                with self.condition:
+                    if self.subscribers == 0:
+                        self.stopped = True
+                        break
+                    self.events.append(event)
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.events.append({"type": "error", "text": f"Error: {str(e)}"})
+        finally:
+            stream.close()
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def add_subscriber(self):
+        """Subscribe to the events, or return False if the stream was stopped early"""
+        with self.condition:
+            if self.stopped:
+                return False
+            self.subscribers += 1
+            return True
+
+    def read(self):
+        """Yield every event, waiting for new ones until the stream ends; add_subscriber() first"""
+        try:
+            index = 0
+            while True:
+                with self.condition:
+                    while index == len(self.events) and not self.finished:
+                        self.condition.wait()
+                    if index == len(self.events):
+                        return
+                    event = self.events[index]
+                index += 1
+                yield event
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+
+class SingleFlight:
+    """
+    Group of in-flight calls keyed by request.
+
+    The first caller of a key (the leader) runs the call; callers arriving
+    with the same key while it runs (followers) wait for its result instead
+    of making their own call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, model_id="", operation=""):
+        """
+        Run fn() once for all concurrent callers of the same key.
+
+        Parameters:
+            key (str): Key from make_key()
+            fn (callable): The call, without arguments
+            model_id (str): Model ID, for the metrics
+            operation (str): 'generate' or 'converse', for the metrics
+
+        Returns:
+            The value returned by fn, shared with the followers
+
+        Raises:
+            The exception raised by fn, in the leader and every follower
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            _count_coalesced(model_id, operation)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key, open_stream, model_id=""):
+        """
+        Share one model stream between the concurrent callers of a key.
+
+        Followers receive every event from the start of the stream, then
+        the new events as they arrive.
+
+        Parameters:
+            key (str): Key from make_key()
+            open_stream (callable): Returns the model's event generator
+            model_id (str): Model ID, for the metrics
+
+        Yields:
+            dict: The stream events
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            # A stream stopped early is still listed until its pump thread ends
+            if broadcast is not None and broadcast.add_subscriber():
+                self.coalesced += 1
+                leader = False
+            else:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                self.calls += 1
+                leader = True
+                # Subscribe before the pump starts so it does not stop right away
+                broadcast.add_subscriber()
+
+        if leader:
+            def run():
+                try:
+                    broadcast.pump(open_stream())
+                finally:
+                    with self._lock:
+                        if self._streams.get(key) is broadcast:
+                            del self._streams[key]
+
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            _count_coalesced(model_id, "converse_stream")
+        yield from broadcast.read()
+
+    def stats(self):
+        """
+        Get the coalescing counters.
+
+        Returns:
+            dict: Calls made, calls saved by coalescing and calls in flight
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._streams)
+            }
+
+
+class CoalescedModel:
+    """
+    Wrapper that merges identical concurrent calls to a model.
+
+    It exposes the same generate/converse/stream interface as BedrockModel
+    and forwards any other attribute to the wrapped model.
+    """
+
+    def __init__(self, model, group):
+        """
+        Wrap a model.
+
+        Parameters:
+            model (BedrockModel): The model to call
+            group (SingleFlight): The shared group of in-flight calls
+        """
+        self.model = model
+        self.group = group
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _endpoint(self):
+        # Calls to other regions are not merged, so hedged calls stay separate
+        return f"{self.model.model_id}@{self.model.region_name}"
+
+    def generate(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
+        """Coalesced BedrockModel.generate()"""
+        params = {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+        key = make_key(self._endpoint(), "generate", prompt, params)
+        return self.group.do(
+            key, lambda: self.model.generate(prompt, max_tokens, temperature, top_p),
+            self.model.model_id, "generate"
+        )
+
+    def converse(self, messages, max_tokens=2000, temperature=0.3):
+        """
+        Coalesced BedrockModel.converse().
+
+        Only the caller that made the model call gets its 'usage'; the
+        followers did not spend any tokens.
+        """
+        params = {"max_tokens": max_tokens, "temperature": temperature}
+        key = make_key(self._endpoint(), "converse", messages, params)
+        leader = []
+
+        def call():
+            leader.append(True)
+            return self.model.converse(messages, max_tokens, temperature)
+
+        result = self.group.do(key, call, self.model.model_id, "converse")
+        if leader:
+            return result
+        return {key: value for key, value in result.items() if key != "usage"}
+
+    def stream(self, messages, max_tokens=2000, temperature=0.3):
+        """Coalesced BedrockModel.stream(), with the 'usage' event sent to the leader only"""
+        params = {"max_tokens": max_tokens, "temperature": temperature}
+        key = make_key(self._endpoint(), "converse_stream", messages, params)
+        leader = []
+
+        def open_stream():
+            leader.append(True)
+            return self.model.stream(messages, max_tokens, temperature)
+
+        for event in self.group.stream(key, open_stream, self.model.model_id):
+            if event["type"] != "usage" or leader:
+                yield event
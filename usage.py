@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+
+DEFAULT_BUDGET_SETTINGS = {
+    "conversation_tokens": None,
+    "global_tokens": None,
+    "global_window": 86400,
+    # Seconds the global total read from the store is reused
+    "refresh": 10
+}
+
+
+class TokenBudgets:
+    """
+    Per-conversation and global token budgets, checked before model calls.
+
+    Spent tokens come from the usage recorded in the conversation store.
+    The global total covers the last `global_window` seconds; it is read
+    from the store at most every `refresh` seconds and kept up to date in
+    between by record(). Tokens of calls whose reply is not stored, like
+    the dropped answers of hedged calls, are added by charge().
+    """
+
+    def __init__(self, settings, store):
+        """
+        Create the budgets.
+
+        Parameters:
+            settings (dict): The "budgets" section of model_config.json;
+                a budget set to None is not enforced
+            store (ConversationStore): The store holding the usage
+        """
+        self.settings = {**DEFAULT_BUDGET_SETTINGS, **settings}
+        self.store = store
+        self._lock = threading.Lock()
+        self._global_total = 0
+        self._global_read_at = 0
+        # (time, tokens) of the calls that are not in the store
+        self._unstored = deque()
+
+    def _global_tokens(self):
+        now = time.time()
+        with self._lock:
+            if now - self._global_read_at > self.settings["refresh"]:
+                self._global_total = self.store.total_tokens(now - self.settings["global_window"])
+                self._global_read_at = now
+            while self._unstored and self._unstored[0][0] < now - self.settings["global_window"]:
+                self._unstored.popleft()
+            return self._global_total + sum(tokens for _, tokens in self._unstored)
+
+    def record(self, tokens):
+        """Add the tokens of a call just recorded in the store to the global total"""
+        with self._lock:
+            self._global_total += tokens
+
+    def charge(self, tokens):
+        """Add the tokens of a call that has no stored reply to the global total"""
+        with self._lock:
+            self._unstored.append((time.time(), tokens))
+
+    def check(self, conversation_id, tokens):
+        """
+        Tell whether a call fits in the budgets.
+
+        Parameters:
+            conversation_id (str): ID of the conversation, None for calls
+                outside a conversation
+            tokens (int): Estimated tokens of the call, input plus maximum output
+
+        Returns:
+            str: An error message if a budget would be exceeded, else None
+        """
+        limit = self.settings["conversation_tokens"]
+        if limit is not None and conversation_id is not None:
+            used = self.store.conversation_tokens(conversation_id)
+            if used + tokens > limit:
+                return f"Error: Token budget of this conversation exhausted ({used} of {limit} tokens used)"
+
+        limit = self.settings["global_tokens"]
+        if limit is not None:
+            used = self._global_tokens()
+            if used + tokens > limit:
+                return f"Error: Global token budget exhausted ({used} of {limit} tokens used)"
+        return None
+
+    def stats(self, conversation_id=None):
+        """
+        Get the budgets and the tokens used against them.
+
+        Returns:
+            dict: Limits and usage of the global budget, and of the
+                conversation budget when a conversation ID is given
+        """
+        stats = {
+            "global": {
+                "limit": self.settings["global_tokens"],
+                "window": self.settings["global_window"],
+                "used": self._global_tokens()
+            }
+        }
+        if conversation_id is not None:
+            stats["conversation"] = {
+                "limit": self.settings["conversation_tokens"],
+                "used": self.store.conversation_tokens(conversation_id)
+            }
+        return stats